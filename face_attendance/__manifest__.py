@@ -1,6 +1,6 @@
 {
     'name': 'Door Monitoring - Face Recognition',
-    'version': '19.0.1.0.0',
+    'version': '19.0.1.1.0',
     'category': 'Human Resources/Attendance',
     'summary': 'Camera at office door detects staff movement and reports mismatches with app attendance',
     'description': """
@@ -22,6 +22,7 @@
     'depends': ['hr', 'hr_attendance'],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_config_parameter.xml',
         'views/face_employee_views.xml',
         'views/face_attendance_views.xml',
         'views/menu.xml',
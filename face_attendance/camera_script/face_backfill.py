@@ -0,0 +1,171 @@
+"""
+Face Recognition Attendance - Bulk Enrolment
+============================================
+Turns the Face Photos uploaded in Odoo into face encodings, so employees
+can be recognised without standing in front of a camera first.
+
+Employees with a photo but no encoding are fetched from Odoo a page at a
+time, the photos are encoded in a process pool (while the next page
+downloads) and each page is written back with one bulk registration call.
+Photos without a usable face are reported and left for a camera
+registration.
+
+Usage:
+    python face_backfill.py
+    python face_backfill.py --workers 8 --page-size 100
+    python face_backfill.py --dry-run --failures failed.csv
+
+Odoo settings come from face_camera.py (FACE_CAMERA_CONFIG or the
+FACE_CAMERA_* environment variables).
+"""
+
+import argparse
+import base64
+import binascii
+import csv
+import multiprocessing
+import os
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+import face_camera as fc
+
+PAGE_SIZE = 50                  # Photos fetched per request (the server caps this at 200)
+MAX_PHOTO_SIDE = 1600           # Larger photos are shrunk first; detection cost grows with the area
+JITTERS = 5                     # Re-sampled encodings averaged per photo (enrolment is not time critical)
+MIN_FACE_RATIO = 0.5            # A second face at least this large (area) makes the photo ambiguous
+
+
+def encode_photo(item):
+    """Worker: (employee_id, base64 photo) -> (employee_id, packed encoding, error).
+
+    The largest face is encoded; photos with no face, a face smaller than
+    REGISTER_MIN_FACE or two faces of similar size are rejected.
+    """
+    employee_id, image = item
+    try:
+        data = np.frombuffer(base64.b64decode(image, validate=True), dtype=np.uint8)
+    except (binascii.Error, ValueError, TypeError):
+        return employee_id, None, 'photo is not base64'
+    frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if frame is None:
+        return employee_id, None, 'photo is not a readable image'
+
+    h, w = frame.shape[:2]
+    factor = min(1.0, MAX_PHOTO_SIDE / float(max(h, w)))
+    if factor < 1.0:
+        frame = cv2.resize(frame, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    locations = sorted(fc.get_detector().detect(rgb),
+                       key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]), reverse=True)
+    if not locations:
+        return employee_id, None, 'no face found'
+    area = [(b - t) * (r - l) for t, r, b, l in locations[:2]]
+    if len(area) > 1 and area[1] >= MIN_FACE_RATIO * area[0]:
+        return employee_id, None, f'{len(locations)} faces in the photo'
+    top, right, bottom, left = locations[0]
+    if (bottom - top) / factor < fc.REGISTER_MIN_FACE:
+        return employee_id, None, f'face too small ({int((bottom - top) / factor)}px)'
+
+    encodings = face_recognition.face_encodings(rgb, [locations[0]], num_jitters=JITTERS)
+    if not encodings:
+        return employee_id, None, 'face could not be encoded'
+    return employee_id, fc.pack_encoding(encodings[0]), None
+
+
+def backfill(odoo, pool, page_size=PAGE_SIZE, dry_run=False, limit=0):
+    """Encode every pending photo; returns (registered, failures).
+
+    `failures` is a list of (employee_id, name, reason).
+    """
+    registered = 0
+    failures = []
+    done = 0
+    total = None
+    started = time.monotonic()
+
+    page = odoo.get_backfill_page(0, page_size)
+    while page['employees']:
+        employees = page['employees']
+        if limit:
+            employees = employees[:limit - done]
+        if total is None:
+            total = min(page['remaining'], limit) if limit else page['remaining']
+            print(f'[Backfill] {total} employees have a photo but no face encoding.')
+        names = {emp['id']: emp['name'] for emp in employees}
+
+        pending = pool.map_async(encode_photo, [(emp['id'], emp['image']) for emp in employees])
+        # Download the next page while this one is being encoded
+        last_id = employees[-1]['id']
+        done += len(employees)
+        more = not limit or done < limit
+        next_page = odoo.get_backfill_page(last_id, page_size) if more else {'employees': []}
+        results = pending.get()
+
+        registrations = []
+        for employee_id, encoding, error in results:
+            if error:
+                failures.append((employee_id, names[employee_id], error))
+            else:
+                registrations.append({'employee_id': employee_id, 'encoding': encoding})
+        if registrations and not dry_run:
+            for result in odoo.register_faces(registrations):
+                if result['success']:
+                    registered += 1
+                else:
+                    employee_id = result['employee_id']
+                    failures.append((employee_id, names.get(employee_id, ''), result.get('error')))
+        elif dry_run:
+            registered += len(registrations)
+
+        elapsed = time.monotonic() - started
+        print(f'[Backfill] {done}/{total} photos  registered={registered} failed={len(failures)}  '
+              f'{done / elapsed:.1f} photos/s')
+        page = next_page
+    if total is None:
+        print('[Backfill] Every employee with a photo already has a face encoding.')
+    return registered, failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Compute face encodings for uploaded employee photos.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='encoding processes (default: one per CPU)')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='photos fetched per request')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many photos')
+    parser.add_argument('--dry-run', action='store_true', help='encode, but do not write to Odoo')
+    parser.add_argument('--failures', metavar='FILE', help='write failed employees to this CSV file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    odoo = fc.OdooClient(fc.ODOO_URL, fc.ODOO_DB, fc.ODOO_USERNAME, fc.ODOO_PASSWORD)
+    try:
+        odoo.authenticate()
+    except Exception as e:
+        raise SystemExit(f'[Error] Cannot connect to Odoo: {e}')
+
+    print(f'[Backfill] Encoding with {args.workers} processes, detector {fc.DETECTOR_BACKEND}'
+          f'{" (dry run)" if args.dry_run else ""}.')
+    with multiprocessing.Pool(args.workers, fc.apply_settings, (fc.current_settings(),)) as pool:
+        registered, failures = backfill(odoo, pool, args.page_size, args.dry_run, args.limit)
+
+    print(f'[Backfill] Done: {registered} registered, {len(failures)} failed.')
+    for employee_id, name, reason in failures:
+        print(f'[Backfill]   {employee_id:>6} {name}: {reason}')
+    if args.failures and failures:
+        with open(args.failures, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['employee_id', 'name', 'reason'])
+            writer.writerows(failures)
+        print(f'[Backfill] Failures written to {args.failures}')
+    return registered, failures
+
+
+if __name__ == '__main__':
+    main()
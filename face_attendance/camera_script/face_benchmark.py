@@ -0,0 +1,509 @@
+"""
+Face Recognition Attendance - Offline Benchmark
+===============================================
+Runs recorded video (or a folder of images) through the same
+detect/encode/match code as face_camera.py, without a camera and without
+Odoo, and reports throughput, per-stage latency, CPU use and - given a
+labelled ground truth - match accuracy.
+
+Usage:
+    python face_benchmark.py --video door.mp4 --gallery face_gallery.npz
+    python face_benchmark.py --video door.mp4 --gallery face_gallery.npz --labels door.json
+    python face_benchmark.py --frames shots/ --gallery face_gallery.npz --scale 0.75
+    python face_benchmark.py --video door.mp4 --gallery face_gallery.npz --gallery-size 5000 --matcher ivf
+    python face_benchmark.py --video door.mp4 --gallery face_gallery.npz --pipeline --processes 4
+    python face_benchmark.py --video door.mp4 --gallery face_gallery.npz --detector yunet --upsample 0
+    python face_benchmark.py --video door.mp4 --gallery face_gallery.npz --roi "0.3,0 0.7,0 0.7,1 0.3,1"
+
+Stage mode (default) processes frames one after another and times each
+stage (motion, resize, detect, encode, match, snapshot). --pipeline runs the real
+threaded DetectionPipeline with the video paced at its frame rate, so
+dropped frames, end-to-end latency and uploads to a local stub of the
+Odoo endpoints show how a configuration holds up live.
+
+Labels (--labels) are JSON: a list of segments
+    [{"employee_id": 7, "start_frame": 120, "end_frame": 310}, ...]
+meaning the employee is visible in those frames (0-based, inclusive).
+
+--json FILE appends one result line per run, so runs with different
+settings can be compared side by side.
+"""
+
+import argparse
+import email.parser
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+import face_camera as fc
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.bmp')
+STAGES = ('motion', 'resize', 'detect', 'encode', 'match', 'snapshot', 'total')
+
+
+# ------------------------------------------------------------
+# Inputs
+# ------------------------------------------------------------
+
+def iter_frames(video=None, frames_dir=None, max_frames=0):
+    """Yield BGR frames from a video file or a folder of images (sorted by name)."""
+    count = 0
+    if video:
+        cap = cv2.VideoCapture(video)
+        if not cap.isOpened():
+            raise SystemExit(f'Cannot open video {video}')
+        try:
+            while not max_frames or count < max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                count += 1
+                yield frame
+        finally:
+            cap.release()
+        return
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(frames_dir, pattern)))
+    for path in paths[:max_frames or None]:
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield frame
+
+
+def source_fps(video, default):
+    if video:
+        cap = cv2.VideoCapture(video)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+        if fps and fps > 0:
+            return fps
+    return default
+
+
+def load_gallery_file(path, size=0, seed=0):
+    """Gallery from a face_gallery.npz snapshot, whichever server wrote it.
+
+    Random employees are appended until the gallery holds `size`
+    employees, to measure matching cost on a larger gallery; they sit far
+    from real faces and never match.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        gallery = fc.GalleryIndex.from_arrays(data['encodings'], data['ids'], data['names'])
+    extra = size - gallery.employee_count()
+    if extra > 0:
+        rng = np.random.default_rng(seed)
+        fake = rng.normal(0.0, 0.09, (extra, fc.ENCODING_SIZE)).astype(np.float32)
+        first = int(gallery.ids.max()) + 1 if len(gallery) else 1
+        for i in range(extra):
+            gallery.add(first + i, f'Synthetic {i}', fake[i])
+    return gallery
+
+
+def load_labels(path):
+    """Ground-truth segments -> function frame_index -> set of employee ids."""
+    if not path:
+        return None
+    with open(path) as f:
+        segments = json.load(f)
+    spans = [(int(s['start_frame']), int(s['end_frame']), int(s['employee_id'])) for s in segments]
+
+    def truth(index):
+        return {employee_id for start, end, employee_id in spans if start <= index <= end}
+    return truth
+
+
+# ------------------------------------------------------------
+# Measurements
+# ------------------------------------------------------------
+
+class Accuracy:
+    """Counts matches of identified employees against the ground truth."""
+
+    def __init__(self, truth):
+        self.truth = truth
+        self.true_pos = self.false_pos = self.false_neg = 0
+        self.frames = 0
+
+    def add(self, index, faces):
+        if self.truth is None:
+            return
+        predicted = {
+            face.candidates[0].employee_id for face in faces
+            if face.candidates and face.candidates[0].distance <= fc.CONFIDENCE_THRESHOLD
+        }
+        expected = self.truth(index)
+        self.frames += 1
+        self.true_pos += len(predicted & expected)
+        self.false_pos += len(predicted - expected)
+        self.false_neg += len(expected - predicted)
+
+    def report(self):
+        if self.truth is None:
+            return None
+        found = self.true_pos + self.false_pos
+        wanted = self.true_pos + self.false_neg
+        return {
+            'frames': self.frames,
+            'precision': round(self.true_pos / found, 4) if found else None,
+            'recall': round(self.true_pos / wanted, 4) if wanted else None,
+            'false_matches': self.false_pos,
+            'missed': self.false_neg,
+        }
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000.0, [50, 95, 99])
+    return {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2), 'n': len(samples)}
+
+
+def cpu_seconds():
+    """User + system CPU of this process and its finished children."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+# ------------------------------------------------------------
+# Stub Odoo
+# ------------------------------------------------------------
+
+class StubOdoo(ThreadingHTTPServer):
+    """Local stand-in for the Odoo routes the camera script uploads to.
+
+    Accepts every login and logs every detection; it records what arrived
+    so the benchmark can count uploads and snapshot bytes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubOdooHandler)
+        self.logged = []
+        self.snapshot_bytes = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, name='stub-odoo', daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def record(self, detections, snapshot_bytes=0):
+        with self.lock:
+            first_id = len(self.logged) + 1
+            self.logged.extend(detections)
+            self.snapshot_bytes += snapshot_bytes
+        return [{'key': d.get('key'), 'success': True, 'id': i}
+                for i, d in enumerate(detections, first_id)]
+
+
+class StubOdooHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, payload, cookie=False):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if cookie:
+            self.send_header('Set-Cookie', 'session_id=benchmark; Path=/')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/web/session/authenticate':
+            self._reply({'jsonrpc': '2.0', 'result': {'uid': 1}}, cookie=True)
+        elif self.path == '/face_attendance/log_batch':
+            detections = json.loads(body)['params']['detections']
+            snapshot_bytes = sum(len(d.get('snapshot_base64') or '') * 3 // 4 for d in detections)
+            results = self.server.record(detections, snapshot_bytes)
+            self._reply({'jsonrpc': '2.0', 'result': {'success': True, 'results': results}})
+        elif self.path == '/face_attendance/log_upload':
+            message = email.parser.BytesParser().parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+            detections, snapshot_bytes = [], 0
+            for part in message.get_payload():
+                payload = part.get_payload(decode=True)
+                if part.get_param('name', header='content-disposition') == 'detections':
+                    detections = json.loads(payload)
+                else:
+                    snapshot_bytes += len(payload)
+            self._reply({'success': True, 'results': self.server.record(detections, snapshot_bytes)})
+        else:
+            self.send_error(404)
+
+
+# ------------------------------------------------------------
+# Runs
+# ------------------------------------------------------------
+
+def run_stages(frames, matcher, args, accuracy, fps):
+    """Process frames one by one, timing every stage.
+
+    The motion gate and the tracker see video time (frame index / fps), so
+    hold and re-encode periods mean the same as live however fast the
+    frames are processed.
+    """
+    tracker = fc.FaceTracker() if args.tracking else None
+    motion = fc.MotionGate() if args.motion else None
+    roi = fc.parse_roi(args.roi)
+    samples = {stage: [] for stage in STAGES}
+    processed = faces_seen = 0
+    started = time.perf_counter()
+    for index, frame in enumerate(frames):
+        if index % args.skip:
+            continue
+        frame_started = time.perf_counter()
+        video_time = index / fps
+        if motion is not None:
+            moving = motion.check(roi.crop(frame)[0] if roi else frame, video_time)
+            samples['motion'].append(time.perf_counter() - frame_started)
+            if not moving and not (tracker and tracker.tracks):
+                accuracy.add(index, [])
+                continue
+        timings = {}
+        faces = fc.process_frame(frame, matcher, tracker, index, args.scale, timings, roi, video_time)
+        for stage, seconds in timings.items():
+            samples[stage].append(seconds)
+        for face in faces:
+            if face.candidates and face.candidates[0].distance <= fc.CONFIDENCE_THRESHOLD:
+                snap_started = time.perf_counter()
+                fc.encode_snapshot(frame, face.location)
+                samples['snapshot'].append(time.perf_counter() - snap_started)
+        samples['total'].append(time.perf_counter() - frame_started)
+        accuracy.add(index, faces)
+        processed += 1
+        faces_seen += len(faces)
+    return {
+        'wall_s': time.perf_counter() - started,
+        'processed': processed,
+        'faces': faces_seen,
+        'stages': {stage: percentiles(values) for stage, values in samples.items() if values},
+    }
+
+
+class PacedCapture:
+    """VideoCapture look-alike replaying frames at a fixed rate."""
+
+    def __init__(self, frames, fps):
+        self.frames = iter(frames)
+        self.interval = 1.0 / fps
+        self.frame = None
+        self.started = None
+        self.count = 0
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        if self.started is None:
+            self.started = time.perf_counter()
+        delay = self.started + self.count * self.interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.frame = next(self.frames, None)
+        self.count += 1
+        return self.frame is not None
+
+    def retrieve(self):
+        return True, self.frame
+
+    def get(self, prop):
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+
+class BenchmarkPipeline(fc.DetectionPipeline):
+    """DetectionPipeline that also records per-frame timings and results."""
+
+    def __init__(self, *args, accuracy=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accuracy = accuracy
+        self.detector_seconds = []
+        self.latencies = []
+
+    def _finish(self, task, faces, seconds, timings=None):
+        with self._stats_lock:
+            self.detector_seconds.append(seconds)
+        super()._finish(task, faces, seconds, timings)
+
+    def route(self, result):
+        self.latencies.append(result.processed_at - result.captured_at)
+        self.accuracy.add(result.seq - 1, result.faces)
+        super().route(result)
+
+
+def run_pipeline(frames, matcher, args, accuracy, fps):
+    """Replay the frames in real time through the threaded pipeline."""
+    stub = StubOdoo().start()
+    spool_dir = tempfile.mkdtemp(prefix='face_benchmark_')
+    odoo = fc.OdooClient(stub.url, 'benchmark', 'benchmark', 'benchmark')
+    uploader = fc.DetectionUploader(odoo, path=os.path.join(spool_dir, 'spool.db'))
+    uploader.start()
+
+    feed = fc.CameraFeed('benchmark', '<benchmark>', threading.Condition(), fc.parse_roi(args.roi))
+    feed.cap = PacedCapture(frames, fps)
+    feed.alive = True
+    feed.reconnectable = False
+    feed.decode_all = False
+    feed.controller.skip = args.skip
+    feed.controller.scale = args.scale
+
+    pool = fc.EncoderProcessPool(args.processes) if args.processes > 1 else None
+    pipeline = BenchmarkPipeline([feed], matcher, uploader, workers=args.workers, pool=pool,
+                                 accuracy=accuracy)
+    started = time.perf_counter()
+    pipeline.start()
+    try:
+        while not pipeline.stop_event.is_set():
+            pipeline.drain_results()
+            time.sleep(0.02)
+        # Frames still in flight when the video ended
+        time.sleep(0.5)
+        pipeline.drain_results()
+    finally:
+        pipeline.stop()
+        wall = time.perf_counter() - started
+        uploader.stop()
+        if pool is not None:
+            pool.close()
+        stub.stop()
+    stats = pipeline.stats()
+    return {
+        'wall_s': wall,
+        'processed': stats['processed'],
+        'captured': stats['captured'],
+        'dropped': stats['frame_slot_dropped'],
+        'faces': None,
+        'stages': {
+            'detect+encode': percentiles(pipeline.detector_seconds),
+            'end_to_end': percentiles(pipeline.latencies),
+        },
+        'uploaded': len(stub.logged),
+        'snapshot_kb': round(stub.snapshot_bytes / len(stub.logged) / 1024.0, 1) if stub.logged else None,
+    }
+
+
+# ------------------------------------------------------------
+# Main
+# ------------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark for face_camera.py')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video', help='recorded video file')
+    source.add_argument('--frames', metavar='DIR', help='folder of images, processed in name order')
+    parser.add_argument('--gallery', required=True, help='face_gallery.npz snapshot to match against')
+    parser.add_argument('--labels', help='ground-truth JSON segments (see module docstring)')
+    parser.add_argument('--gallery-size', type=int, default=0, metavar='N',
+                        help='pad the gallery with synthetic employees up to N')
+    parser.add_argument('--matcher', default=fc.MATCHER_BACKEND, choices=sorted(fc.MATCHER_BACKENDS))
+    parser.add_argument('--detector', default=fc.DETECTOR_BACKEND, choices=sorted(fc.DETECTOR_BACKENDS))
+    parser.add_argument('--upsample', type=int, default=fc.DETECTOR_UPSAMPLE, help='detector upsample steps')
+    parser.add_argument('--roi', default='', help="region of interest 'x,y x,y x,y ...' (pixels or 0-1)")
+    parser.add_argument('--scale', type=float, default=fc.DETECT_SCALE, help='detect scale')
+    parser.add_argument('--skip', type=int, default=1, help='process every Nth frame')
+    parser.add_argument('--no-tracking', dest='tracking', action='store_false')
+    parser.add_argument('--no-motion', dest='motion', action='store_false')
+    parser.add_argument('--max-frames', type=int, default=0)
+    parser.add_argument('--pipeline', action='store_true',
+                        help='real-time replay through the threaded pipeline')
+    parser.add_argument('--workers', type=int, default=fc.DETECT_WORKERS, help='pipeline: detect threads')
+    parser.add_argument('--processes', type=int, default=0, help='pipeline: encoder processes')
+    parser.add_argument('--fps', type=float, default=15.0, help='frame rate of --frames input')
+    parser.add_argument('--json', metavar='FILE', help='append the result as one JSON line')
+    return parser.parse_args(argv)
+
+
+def print_report(result):
+    print('=' * 50)
+    print(f'[Bench] {result["mode"]} | {result["source"]} | gallery={result["gallery"]} '
+          f'matcher={result["matcher"]} detector={result["detector"]} scale={result["scale"]} skip={result["skip"]}')
+    print(f'[Bench] processed={result["processed"]} frames in {result["wall_s"]:.1f}s '
+          f'-> {result["fps"]} fps, CPU {result["cpu_percent"]}%')
+    if result.get('dropped') is not None:
+        print(f'[Bench] captured={result["captured"]} dropped={result["dropped"]} '
+              f'uploaded={result["uploaded"]} snapshot={result["snapshot_kb"]}KB')
+    for stage, p in result['stages'].items():
+        if p:
+            print(f'[Bench]   {stage:<14} p50={p["p50_ms"]:>8.2f}ms  p95={p["p95_ms"]:>8.2f}ms  '
+                  f'p99={p["p99_ms"]:>8.2f}ms  (n={p["n"]})')
+    accuracy = result.get('accuracy')
+    if accuracy:
+        print(f'[Bench] accuracy over {accuracy["frames"]} frames: precision={accuracy["precision"]} '
+              f'recall={accuracy["recall"]} false_matches={accuracy["false_matches"]} '
+              f'missed={accuracy["missed"]}')
+    print('=' * 50)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fc.TRACKING_ENABLED = args.tracking
+    fc.MOTION_GATE_ENABLED = args.motion
+    fc.DETECTOR_BACKEND = args.detector
+    fc.DETECTOR_UPSAMPLE = args.upsample
+    # Fixed settings make runs comparable
+    fc.ADAPTIVE_ENABLED = False
+
+    gallery = load_gallery_file(args.gallery, args.gallery_size)
+    matcher = fc.build_matcher(gallery, args.matcher)
+    accuracy = Accuracy(load_labels(args.labels))
+    frames = iter_frames(args.video, args.frames, args.max_frames)
+
+    fps = source_fps(args.video, args.fps)
+    cpu_started = cpu_seconds()
+    if args.pipeline:
+        result = run_pipeline(frames, matcher, args, accuracy, fps)
+    else:
+        result = run_stages(frames, matcher, args, accuracy, fps)
+    cpu = cpu_seconds() - cpu_started
+
+    result.update({
+        'mode': 'pipeline' if args.pipeline else 'stages',
+        'source': args.video or args.frames,
+        'gallery': gallery.employee_count(),
+        'matcher': matcher.name,
+        'detector': args.detector,
+        'upsample': args.upsample,
+        'roi': args.roi,
+        'scale': args.scale,
+        'skip': args.skip,
+        'workers': args.workers,
+        'processes': args.processes,
+        'tracking': args.tracking,
+        'motion': args.motion,
+        'fps': round(result['processed'] / result['wall_s'], 2) if result['wall_s'] else 0.0,
+        'cpu_percent': round(cpu / result['wall_s'] * 100.0, 1) if result['wall_s'] else 0.0,
+        'accuracy': accuracy.report(),
+    })
+    print_report(result)
+    if args.json:
+        with open(args.json, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -7,16 +7,40 @@ Detects faces, matches against known employees from Odoo, and logs attendance.
 Usage:
     pip install -r requirements.txt
     python face_camera.py
+    python face_camera.py --register         # register a face (burst of samples)
+    python face_camera.py --recall-report    # approximate vs exact matching on the gallery
+    python face_camera.py --calibrate-detectors door.mp4   # pick the fastest accurate detector
+    python face_camera.py --detect --workers 4   # detection on 4 CPU cores
+    python face_camera.py --detect --cameras cameras.json   # many doors, one process
+    FACE_CAMERA_EVENT_MODE=line FACE_CAMERA_DOOR_LINE="0,0.6 1,0.6" python face_camera.py --detect
+    python face_camera.py --replay nvr/door_20261001_080000.mp4 --workers 8   # reprocess recorded footage
+    python face_camera.py --headless --config door.json     # service: no GUI, stops on SIGTERM
+    python face_camera.py --headless --metrics-port 9108     # Prometheus metrics at /metrics
+    FACE_CAMERA_ODOO_PASSWORD=secret python face_camera.py --headless --preview /tmp/door.jpg
 
 Configuration:
     Edit the ODOO_* variables below to match your Odoo server.
     Set CAMERA_SOURCE to 0 for USB/webcam, or an RTSP URL for IP camera.
+    Any setting can instead come from a JSON --config file or a
+    FACE_CAMERA_<SETTING> environment variable (see load_settings).
 """
 
+import argparse
 import base64
 import json
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import sqlite3
+import threading
 import time
 import sys
+import uuid
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
 
 import cv2
 import face_recognition
@@ -32,22 +56,186 @@ ODOO_USERNAME = 'admin'                   # Odoo username
 ODOO_PASSWORD = 'admin'                   # Odoo password
 CAMERA_SOURCE = 0                         # 0 = USB/webcam, or RTSP URL string for IP camera
 CAMERA_NAME = 'Main Door'                # Name for this camera
+CAMERA_ROI = ''                           # Door region polygon 'x,y x,y x,y ...' (pixels or 0-1 fractions), '' = whole frame
 CONFIDENCE_THRESHOLD = 0.6               # Lower = stricter match (0.4-0.6 recommended)
 COOLDOWN_SECONDS = 300                    # 5 minutes - won't re-log same person within this time
-FRAME_SKIP = 3                            # Process every Nth frame (for performance)
+EVENT_MODE = 'cooldown'                   # 'cooldown' (log a recognised face every COOLDOWN_SECONDS) or 'line'
+DOOR_LINE = ''                            # 'line' mode: door line 'x1,y1 x2,y2' (pixels or 0-1 fractions), see DoorLine
+DOOR_LINE_MARGIN = 0.03                   # Band either side of the line (fraction of frame diagonal) that counts as on it
+LINE_PENDING_SECONDS = 5.0                # A crossing still unrecognised after this is dropped
+LINE_REPEAT_SECONDS = 10.0                # Same employee, same direction within this = one passage (track split)
+FRAME_SKIP = 3                            # Process every Nth frame (starting value if ADAPTIVE_ENABLED)
+DETECT_SCALE = 0.5                        # Resize before detection (starting value if ADAPTIVE_ENABLED)
+MATCH_TOP_K = 2                           # Candidates returned per face (2 = best + runner-up for margin)
+MATCHER_BACKEND = 'exact'                 # 'exact' or 'ivf' (approximate, for galleries of thousands)
+IVF_LISTS = 0                             # IVF clusters, 0 = auto (sqrt of gallery size)
+IVF_PROBE = 4                             # Clusters searched per face - higher = better recall, slower
+IVF_MIN_GALLERY = 2000                    # Below this size 'ivf' falls back to exact search
+DETECT_WORKERS = 1                        # Threads running detection/encoding
+PROCESS_WORKERS = 0                       # >1 = encode in this many processes (--workers N)
+WORKER_TASK_TIMEOUT = 30.0                # Seconds before a frame stuck in a worker process is given up
+RESULT_QUEUE_SIZE = 8                     # Processed frames waiting for display/routing
+PUBLISH_QUEUE_SIZE = 64                   # Detections waiting to be logged to Odoo
+TRACKING_ENABLED = True                   # Follow faces across frames, encode once per person
+TRACK_IOU = 0.3                           # Box overlap needed to continue a track
+TRACK_MAX_MISSED = 5                      # Processed frames a track survives without a detection
+TRACK_REFRESH_SECONDS = 3.0               # Re-identify a confidently matched track this often
+TRACK_RETRY_SECONDS = 0.5                 # Re-identify a new/unknown/ambiguous track this often
+TRACK_MIN_MARGIN = 0.05                   # Best match must beat the runner-up by this much to be settled
+MOTION_GATE_ENABLED = True                # Run the face detector only when something moves
+MOTION_THRESHOLD = 25                     # Grey-level change that counts a pixel as moving
+MOTION_MIN_AREA = 0.002                   # Fraction of moving pixels that wakes the detector (sensitivity)
+MOTION_HOLD_SECONDS = 2.0                 # Keep detecting this long after the last motion
+MOTION_WIDTH = 160                        # Width of the downscaled frame used for motion checks
+MOTION_BG_ALPHA = 0.05                    # Background adaptation rate (higher = forgets faster)
+ADAPTIVE_ENABLED = True                   # Tune frame skip and detect scale to the machine's speed
+TARGET_FRAME_MS = 200.0                   # Detection time budget per processed frame
+TARGET_FPS = 0.0                          # Max processed frames/s per camera, 0 = as many as CPU allows
+MAX_FRAME_SKIP = 10                       # Never process fewer than every Nth frame
+MIN_FACE_SIZE = 80                        # Smallest face (full-frame pixels) that must stay detectable
+HOG_MIN_FACE = 40                         # Smallest face the HOG detector finds in its input image (upsample 1)
+DETECTOR_BACKEND = 'hog'                  # 'hog' (dlib), 'haar' (OpenCV cascade), 'yunet' or 'ssd' (OpenCV DNN)
+DETECTOR_UPSAMPLE = 1                     # Enlarge the detector input 2^N times to find smaller faces (slower)
+DETECTOR_INPUT_SIZE = 0                   # DNN input (pixels, longest side / SSD square), 0 = model default
+DETECTOR_CONFIDENCE = 0.6                 # Minimum score of a DNN detection
+YUNET_MODEL = 'face_detection_yunet_2023mar.onnx'     # OpenCV Zoo YuNet model file
+SSD_CONFIG = 'deploy.prototxt'                        # OpenCV res10 SSD network definition
+SSD_MODEL = 'res10_300x300_ssd_iter_140000.caffemodel'  # OpenCV res10 SSD weights
+CALIBRATION_MIN_RECALL = 0.9              # --calibrate-detectors recommends the fastest backend above this
+CALIBRATION_FRAME_STEP = 5                # --calibrate-detectors samples every Nth frame of the footage
+DETECT_SCALE_STEPS = (1.0, 0.75, 0.5, 0.4, 0.33, 0.25)
+STATS_INTERVAL = 60                       # Seconds between pipeline stats lines
+SCHEDULER_ACTIVITY_WEIGHT = 0.5           # Extra detection share per recently seen face (multi-camera)
+SCHEDULER_ACTIVITY_DECAY = 0.9            # Per processed frame decay of a camera's activity
+ODOO_TIMEOUT = 15                         # Seconds before an Odoo request is abandoned
+SPOOL_PATH = 'face_camera_spool.db'       # SQLite file keeping detections not yet uploaded
+UPLOAD_BATCH_SIZE = 20                    # Detections sent per flush
+UPLOAD_FLUSH_INTERVAL = 2.0               # Seconds a detection may wait for its batch to fill
+UPLOAD_RETRY_MAX = 300                    # Longest retry backoff in seconds (while Odoo is unreachable)
+UPLOAD_MAX_ATTEMPTS = 5                   # Rejected detections are dropped after this many tries
+GALLERY_SYNC_INTERVAL = 60                # Seconds between checks for new/changed face registrations
+SNAPSHOT_PATH = 'face_gallery.npz'        # Local copy of the gallery for fast / offline start ('' = off)
+SNAPSHOT_MAX_SIZE = 320                   # Longest side (pixels) of detection snapshots, 0 = keep size
+SNAPSHOT_QUALITY = 75                     # JPEG quality of detection snapshots
+SNAPSHOT_MAX_BYTES = 30000                # Re-encode smaller/lower quality until under this, 0 = no limit
+SNAPSHOT_BINARY_UPLOAD = True             # Send snapshots as multipart files instead of base64 in JSON
+REGISTER_SAMPLES = 12                     # Good frames captured per registration burst
+REGISTER_MIN_SAMPLES = 5                  # Fewer good frames than this and registration fails
+REGISTER_BURST_SECONDS = 10               # Time allowed to collect the samples
+REGISTER_TEMPLATES = 4                    # Templates kept per employee (1 = store the centroid, max 8)
+REGISTER_MIN_FACE = 100                   # Smallest face height (pixels) accepted as a sample
+REGISTER_MIN_SHARPNESS = 60               # Laplacian variance below this = too blurry
+REGISTER_MAX_YAW = 0.15                   # Nose offset from the eye midpoint (fraction of eye distance)
+CAPTURE_BUFFER_SIZE = 1                   # Frames OpenCV may buffer (1 = always the newest)
+RTSP_TRANSPORT = 'tcp'                    # 'tcp' (no smeared frames on packet loss) or 'udp' (lower latency)
+CAPTURE_TIMEOUT_MS = 5000                 # Give up opening/reading a network stream after this long
+RECONNECT_MIN_SECONDS = 1.0               # First retry delay after a stream drops
+RECONNECT_MAX_SECONDS = 30.0              # Retry delay doubles up to this while the stream stays down
+METRICS_PORT = 0                          # Serve Prometheus metrics on this port (--metrics-port), 0 = off
+METRICS_HOST = '127.0.0.1'                # Interface for the metrics endpoint ('0.0.0.0' = reachable remotely)
+HEADLESS = False                          # No windows: run as a service (--headless)
+PREVIEW_PATH = ''                         # Headless debug preview JPEG, '{camera}' = camera name ('' = off)
+PREVIEW_INTERVAL = 5.0                    # Seconds between debug preview writes
+REPLAY_SEGMENT_SECONDS = 300              # --replay splits footage into segments of this length, one per core
+REPLAY_FPS = 5.0                          # Frames per second of footage that --replay processes
+REPLAY_UPLOAD_BATCH = 200                 # Replayed detections sent per upload call
 # ============================================================
 
+# Every setting above can also come from a JSON file ({"ODOO_URL": ...},
+# passed with --config or FACE_CAMERA_CONFIG) and from environment
+# variables named FACE_CAMERA_<SETTING>, which win over the file.
+SETTINGS_ENV_PREFIX = 'FACE_CAMERA_'
+
+
+def _coerce_setting(name, value, default):
+    """Convert a config/env value to the type of the setting's default."""
+    if name == 'CAMERA_SOURCE':
+        return int(value) if str(value).isdigit() else value
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, int):
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(f'{name} must be a whole number, got {value!r}')
+        return int(number)
+    if isinstance(default, tuple):
+        items = value.split(',') if isinstance(value, str) else value
+        return tuple(type(default[0])(item) for item in items)
+    return str(value)
+
+
+def load_settings(path=None, environ=None):
+    """Override the settings above from a JSON file and the environment.
+
+    Must run before the rest of the module is defined, because function
+    defaults capture the settings (see the call below). Unknown names in
+    the file raise ValueError, so typos do not go unnoticed. Returns the
+    names that were overridden.
+    """
+    environ = os.environ if environ is None else environ
+    settings = globals()
+    names = list(current_settings())
+    values = {}
+    path = path or environ.get(f'{SETTINGS_ENV_PREFIX}CONFIG')
+    if path:
+        with open(path) as f:
+            values.update(json.load(f))
+        unknown = sorted(set(values) - set(names))
+        if unknown:
+            raise ValueError(f'Unknown settings in {path}: {", ".join(unknown)}')
+    for name in names:
+        if f'{SETTINGS_ENV_PREFIX}{name}' in environ:
+            values[name] = environ[f'{SETTINGS_ENV_PREFIX}{name}']
+    for name, value in values.items():
+        settings[name] = _coerce_setting(name, value, settings[name])
+    return sorted(values)
+
+
+def current_settings():
+    """The resolved value of every setting, e.g. to hand to worker processes."""
+    return {name: value for name, value in globals().items()
+            if name.isupper() and not name.startswith('SETTINGS_')
+            and isinstance(value, (bool, int, float, str, tuple))}
+
+
+def apply_settings(settings):
+    """Worker process setup: take over the parent's current_settings().
+
+    Under the spawn and forkserver start methods workers re-import this
+    script as __mp_main__, so the --config file and command-line choices
+    would be lost. Function defaults never capture a setting: they are
+    None and read the setting when called, so this reaches them too.
+    """
+    globals().update(settings)
+
+
+def _config_argument(argv):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--config')
+    return parser.parse_known_args(argv)[0].config
+
+
+# Only the script itself reads --config; importers get env overrides only.
+OVERRIDDEN_SETTINGS = load_settings(_config_argument(sys.argv[1:]) if __name__ == '__main__' else None)
+
 
 class OdooClient:
     """Simple Odoo JSON-RPC client."""
 
-    def __init__(self, url, db, username, password):
+    def __init__(self, url, db, username, password, timeout=None):
         self.url = url.rstrip('/')
         self.db = db
         self.username = username
         self.password = password
+        self.timeout = ODOO_TIMEOUT if timeout is None else timeout
         self.uid = None
         self.session = requests.Session()
+        # Uploader and gallery sync threads share the session
+        self._lock = threading.Lock()
 
     def authenticate(self):
         """Login to Odoo and get session."""
@@ -61,6 +249,7 @@ class OdooClient:
                     'password': self.password,
                 },
             },
+            timeout=self.timeout,
         )
         result = response.json().get('result', {})
         self.uid = result.get('uid')
@@ -70,62 +259,763 @@ class OdooClient:
         return self.uid
 
     def call(self, route, params):
-        """Call Odoo JSON-RPC endpoint."""
+        """Call Odoo JSON-RPC endpoint.
+
+        Logs in first if the client is not authenticated yet (e.g. Odoo was
+        down at startup) and once more if the session has expired.
+        """
+        with self._lock:
+            if self.uid is None:
+                self.authenticate()
+            data = self._post(route, params)
+            if data.get('error') and data['error'].get('code') == 100:
+                # Session expired - log in again and retry once
+                self.authenticate()
+                data = self._post(route, params)
+        if data.get('error'):
+            raise Exception(f'Odoo error: {data["error"]}')
+        return data.get('result')
+
+    def _post(self, route, params):
         response = self.session.post(
             f'{self.url}{route}',
             json={'jsonrpc': '2.0', 'params': params},
+            timeout=self.timeout,
         )
-        data = response.json()
-        if data.get('error'):
-            raise Exception(f'Odoo error: {data["error"]}')
-        return data.get('result')
+        return response.json()
+
+    def upload(self, route, fields, files):
+        """POST a multipart form to a plain HTTP route and return its JSON.
+
+        Odoo redirects to the login page when the session has expired, so a
+        redirect means: log in again and retry once. Raises
+        requests.HTTPError for error statuses (404 on older servers).
+        """
+        with self._lock:
+            if self.uid is None:
+                self.authenticate()
+            for attempt in range(2):
+                response = self.session.post(
+                    f'{self.url}{route}', data=fields, files=files,
+                    timeout=self.timeout, allow_redirects=False,
+                )
+                if not response.is_redirect or attempt:
+                    break
+                self.authenticate()
+        response.raise_for_status()
+        return response.json()
 
     def get_employees_with_faces(self):
         """Fetch all employees with registered face encodings."""
         return self.call('/face_attendance/employees', {})
 
-    def log_attendance(self, employee_id, confidence, snapshot_base64=None):
-        """Log face detection to Odoo."""
+    def get_face_changes(self, since=None, etag=None):
+        """Fetch face encodings changed since a sync cursor.
+
+        Without a cursor the full gallery comes back; with a matching etag
+        only {'not_modified': True}. Encodings arrive packed in one blob.
+        """
+        return self.call('/face_attendance/employees',
+                         {'since': since, 'etag': etag, 'format': 'blob'})
+
+    def log_attendance(self, employee_id, confidence, snapshot_base64=None, camera_name=None,
+                       detection_time=None):
+        """Log face detection to Odoo.
+
+        `detection_time` ('YYYY-MM-DD HH:MM:SS' UTC) defaults to the time
+        the server receives the call.
+        """
         return self.call('/face_attendance/log', {
             'employee_id': employee_id,
             'confidence': round(confidence * 100, 1),
             'snapshot_base64': snapshot_base64,
-            'camera_name': CAMERA_NAME,
+            'camera_name': camera_name or CAMERA_NAME,
+            'detection_time': detection_time,
         })
 
-    def register_face(self, employee_id, encoding_json, image_base64=None):
-        """Register face encoding for an employee."""
+    def log_attendance_batch(self, detections):
+        """Log many detections in one call.
+
+        Each item carries the log_attendance fields (confidence already in
+        percent) and an idempotency 'key'. Returns the per-item results.
+        """
+        result = self.call('/face_attendance/log_batch', {'detections': detections})
+        if not result.get('success'):
+            raise Exception(f'Odoo batch error: {result.get("error")}')
+        return result['results']
+
+    def log_attendance_upload(self, detections, snapshots):
+        """Same as log_attendance_batch, but JPEG snapshots ({key: bytes})
+        travel as binary multipart files rather than base64 inside JSON."""
+        files = [(f'snapshot_{key}', (f'{key}.jpg', data, 'image/jpeg'))
+                 for key, data in snapshots.items()]
+        result = self.upload('/face_attendance/log_upload',
+                             {'detections': json.dumps(detections)}, files)
+        if not result.get('success'):
+            raise Exception(f'Odoo batch error: {result.get("error")}')
+        return result['results']
+
+    def register_face(self, employee_id, encoding, image_base64=None):
+        """Register face encoding (packed, see pack_encoding) for an employee."""
         return self.call('/face_attendance/register', {
             'employee_id': employee_id,
-            'encoding': encoding_json,
+            'encoding': encoding,
             'face_image_base64': image_base64,
         })
 
+    def get_backfill_page(self, after_id=0, limit=50):
+        """Employees with a face photo but no encoding, `limit` at a time
+        after `after_id`. Returns {'employees': [...], 'remaining': n}."""
+        result = self.call('/face_attendance/backfill', {'after_id': after_id, 'limit': limit})
+        if not result.get('success'):
+            raise Exception(f'Odoo backfill error: {result.get("error")}')
+        return result
+
+    def register_faces(self, registrations):
+        """Register many packed encodings ({'employee_id', 'encoding'}) in
+        one call. Returns the per-item results."""
+        result = self.call('/face_attendance/register_batch', {'registrations': registrations})
+        if not result.get('success'):
+            raise Exception(f'Odoo batch error: {result.get("error")}')
+        return result['results']
+
+
+ENCODING_SIZE = 128
+
+# One candidate for a detected face. `margin` is how much further away the next
+# candidate is (inf when the gallery has a single entry) - small margins mean
+# two employees look alike and the match should be treated with care.
+Match = namedtuple('Match', ['employee_id', 'name', 'distance', 'margin'])
+
+
+class GalleryIndex:
+    """Known faces held as one contiguous float32 (N x 128) matrix.
+
+    Rows are appended into a preallocated buffer, so loading does not build a
+    list of small arrays, and matching a whole frame is a single matrix call
+    instead of one face_distance() per detected face.
+
+    The gallery can be patched in place while the camera runs (delta sync);
+    `lock` serialises those patches with matching.
+    """
+
+    def __init__(self, capacity=256):
+        self._matrix = np.zeros((max(capacity, 1), ENCODING_SIZE), dtype=np.float32)
+        self._sq_norms = np.zeros(max(capacity, 1), dtype=np.float32)
+        self._ids = np.zeros(max(capacity, 1), dtype=np.int64)
+        self._names = []
+        self._size = 0
+        self._version = 0
+        self._templates_cache = (-1, 1)
+        self.lock = threading.RLock()
+        # Delta sync position on the server (see GallerySync)
+        self.sync_cursor = None
+        self.sync_etag = None
+        # Employees whose server-side encoding could not be used
+        self.invalid_ids = set()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def encodings(self):
+        return self._matrix[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def names(self):
+        return self._names
+
+    def _grow(self, capacity):
+        for attr in ('_matrix', '_sq_norms', '_ids'):
+            old = getattr(self, attr)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+
+    def add(self, employee_id, name, encoding):
+        """Append an employee's templates: one 128-long sequence or (T x 128)."""
+        encoding = np.asarray(encoding, dtype=np.float32)
+        if encoding.size == 0 or encoding.size % ENCODING_SIZE:
+            raise ValueError(f'Expected multiples of {ENCODING_SIZE} values, got {encoding.size}')
+        encoding = encoding.reshape(-1, ENCODING_SIZE)
+        n = len(encoding)
+        with self.lock:
+            if self._size + n > self._matrix.shape[0]:
+                self._grow(max(self._size * 2, self._size + n))
+            rows = slice(self._size, self._size + n)
+            self._matrix[rows] = encoding
+            self._sq_norms[rows] = np.einsum('ij,ij->i', encoding, encoding)
+            self._ids[rows] = employee_id
+            self._names.extend([name] * n)
+            self._size += n
+            self._version += 1
+
+    def remove(self, employee_id):
+        """Drop every row of an employee. Returns the number of rows removed.
+
+        The last rows are moved into the freed slots, so the matrix stays
+        contiguous without shifting the whole buffer.
+        """
+        with self.lock:
+            rows = np.flatnonzero(self._ids[:self._size] == employee_id)
+            for row in rows[::-1]:
+                last = self._size - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._sq_norms[row] = self._sq_norms[last]
+                    self._ids[row] = self._ids[last]
+                    self._names[row] = self._names[last]
+                self._names.pop()
+                self._size -= 1
+            if len(rows):
+                self._version += 1
+            return len(rows)
+
+    def upsert(self, employee_id, name, encoding):
+        """Replace an employee's templates (or add them if new).
+
+        Sync deltas overlap, so the same entry often arrives again; an
+        unchanged entry leaves the gallery (and its version) alone.
+        """
+        with self.lock:
+            rows = np.flatnonzero(self._ids[:self._size] == employee_id)
+            encoding = np.asarray(encoding, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            if len(rows) == len(encoding) and all(self._names[row] == name for row in rows) \
+                    and np.array_equal(self._matrix[rows], encoding):
+                return
+            self.remove(employee_id)
+            self.add(employee_id, name, encoding)
+
+    def clear(self):
+        with self.lock:
+            self._names = []
+            self._size = 0
+            self._version += 1
+            self.invalid_ids = set()
+
+    @classmethod
+    def from_arrays(cls, encodings, ids, names):
+        """Build a gallery from ready-made arrays in one copy."""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        gallery = cls(capacity=len(encodings))
+        n = len(encodings)
+        gallery._matrix[:n] = encodings
+        gallery._sq_norms[:n] = np.einsum('ij,ij->i', encodings, encodings)
+        gallery._ids[:n] = ids
+        gallery._names = [str(name) for name in names]
+        gallery._size = n
+        gallery._version += 1
+        return gallery
+
+    def employee_count(self):
+        """Number of distinct employees (an employee may own several rows)."""
+        with self.lock:
+            return len(np.unique(self._ids[:self._size]))
+
+    def templates_per_employee(self):
+        """Most rows any single employee owns (cached per version)."""
+        with self.lock:
+            if self._templates_cache[0] != self._version:
+                counts = np.unique(self._ids[:self._size], return_counts=True)[1]
+                self._templates_cache = (self._version, int(counts.max()) if len(counts) else 1)
+            return self._templates_cache[1]
+
+    @property
+    def version(self):
+        """Bumped on every change, so matchers know when to rebuild."""
+        return self._version
+
+    def distances(self, face_encodings, rows=None):
+        """Euclidean distances, shape (faces x rows), in one matrix call.
+
+        `rows` restricts the comparison to a subset of gallery rows (used by
+        approximate matchers); by default every employee is compared.
+        """
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if rows is None:
+            matrix, sq_norms = self.encodings, self._sq_norms[:self._size]
+        else:
+            matrix, sq_norms = self._matrix[rows], self._sq_norms[rows]
+        sq = (
+            (queries * queries).sum(axis=1)[:, None]
+            + sq_norms[None, :]
+            - 2.0 * (queries @ matrix.T)
+        )
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def rank(self, distances, rows=None, k=None):
+        """Turn one face's distance row into its k best Match entries.
+
+        `distances[i]` is the distance to gallery row `rows[i]` (or row i
+        when `rows` is None). An employee with several templates is scored
+        by the closest one and appears once; the margin is measured against
+        the next *other* employee.
+        """
+        k = k or MATCH_TOP_K
+        n = len(distances)
+        if n == 0:
+            return []
+        # Take one extra employee so the last one still gets a real margin;
+        # k + 1 employees are surely among the (k + 1) * T nearest rows.
+        kk = min((k + 1) * self.templates_per_employee(), n)
+        cand = np.argpartition(distances, kk - 1)[:kk] if kk < n else np.arange(n)
+        order = cand[np.argsort(distances[cand], kind='stable')]
+        gallery_rows = order if rows is None else np.asarray(rows)[order]
+
+        best = []
+        seen = set()
+        for pos, idx in zip(order, gallery_rows):
+            employee_id = int(self._ids[idx])
+            if employee_id not in seen:
+                seen.add(employee_id)
+                best.append((pos, idx, employee_id))
+                if len(best) > k:
+                    break
+
+        result = []
+        for rank, (pos, idx, employee_id) in enumerate(best):
+            nxt = distances[best[rank + 1][0]] if rank + 1 < len(best) else np.inf
+            result.append(Match(
+                employee_id=employee_id,
+                name=self._names[idx],
+                distance=float(distances[pos]),
+                margin=float(nxt - distances[pos]),
+            ))
+        return result[:k]
+
+    def match(self, face_encodings, k=None):
+        """Return the k nearest employees for each face, best first.
+
+        Result is one list of Match per input face (empty lists when the
+        gallery is empty).
+        """
+        if len(face_encodings) == 0:
+            return []
+        with self.lock:
+            if self._size == 0:
+                return [[] for _ in face_encodings]
+            return [self.rank(row, k=k) for row in self.distances(face_encodings)]
+
+
+class ExactMatcher:
+    """Brute-force search over the whole gallery. Always exact."""
+
+    name = 'exact'
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def match(self, face_encodings, k=None):
+        return self.gallery.match(face_encodings, k=k)
+
+
+class IVFMatcher:
+    """Approximate search: inverted file over a k-means partition (pure NumPy).
+
+    The gallery is split into `n_lists` clusters. A face is compared with
+    the cluster centroids first and then only with the employees of the
+    `n_probe` nearest clusters, so the work per face grows with roughly
+    sqrt(N) instead of N. Raising `n_probe` trades latency for recall;
+    n_probe == n_lists is exact search.
+
+    The partition is rebuilt by prepare(), which build_matcher and
+    GallerySync call whenever the gallery is loaded or changed, so the
+    k-means cost stays off the frame path; matches arriving during a
+    rebuild use exact search. While the gallery holds fewer than
+    `min_gallery` employees the search is exact - checked on every call,
+    as delta sync grows the gallery.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, gallery, n_lists=0, n_probe=None, iterations=10, seed=0, min_gallery=0):
+        self.gallery = gallery
+        self.min_gallery = min_gallery
+        self.n_lists_setting = n_lists
+        self.n_probe = IVF_PROBE if n_probe is None else n_probe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self._built_version = None
+        self._building = False
+        self._build_lock = threading.Lock()
+
+    def prepare(self):
+        """(Re)build the partition for the current gallery, outside its lock."""
+        with self._build_lock:
+            with self.gallery.lock:
+                if self._built_version == self.gallery.version or len(self.gallery) < self.min_gallery:
+                    return
+                data = self.gallery.encodings.copy()
+                version = self.gallery.version
+                self._building = True
+            try:
+                centroids, lists = self._partition(data)
+            finally:
+                self._building = False
+            with self.gallery.lock:
+                if self.gallery.version == version:
+                    self.centroids, self.lists, self._built_version = centroids, lists, version
+
+    def _build(self):
+        self.centroids, self.lists = self._partition(self.gallery.encodings)
+        self._built_version = self.gallery.version
+
+    def _partition(self, data):
+        n = len(data)
+        n_lists = self.n_lists_setting or int(round(np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(n, n_lists, replace=False)].copy()
+        data_sq = (data * data).sum(axis=1)
+        assign = np.zeros(n, dtype=np.int64)
+        for _ in range(self.iterations):
+            sq = data_sq[:, None] + (centroids * centroids).sum(axis=1)[None, :] - 2.0 * (data @ centroids.T)
+            assign = sq.argmin(axis=1)
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            filled = counts > 0
+            # Empty clusters keep their previous centroid
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        return centroids.astype(np.float32), [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+
+    def match(self, face_encodings, k=None):
+        if len(face_encodings) == 0:
+            return []
+        with self.gallery.lock:
+            return self._match(face_encodings, k)
+
+    def _match(self, face_encodings, k):
+        if len(self.gallery) == 0:
+            return [[] for _ in face_encodings]
+        stale = self._built_version != self.gallery.version
+        if len(self.gallery) < self.min_gallery or (stale and self._building):
+            return [self.gallery.rank(row, k=k) for row in self.gallery.distances(face_encodings)]
+        if stale:
+            # Nobody called prepare() for this gallery version
+            self._build()
+
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        sq = (
+            (queries * queries).sum(axis=1)[:, None]
+            + (self.centroids * self.centroids).sum(axis=1)[None, :]
+            - 2.0 * (queries @ self.centroids.T)
+        )
+        n_probe = max(1, min(self.n_probe, len(self.lists)))
+        probes = np.argpartition(sq, n_probe - 1, axis=1)[:, :n_probe] if n_probe < len(self.lists) \
+            else np.broadcast_to(np.arange(len(self.lists)), sq.shape)
+
+        results = []
+        for query, probe in zip(queries, probes):
+            rows = np.concatenate([self.lists[p] for p in probe])
+            distances = self.gallery.distances(query, rows)[0]
+            results.append(self.gallery.rank(distances, rows, k=k))
+        return results
+
+
+MATCHER_BACKENDS = {
+    'exact': ExactMatcher,
+    'ivf': IVFMatcher,
+}
+
+
+def build_matcher(gallery, backend=None):
+    """Create the configured matcher for a gallery.
+
+    Small galleries always use exact search - below IVF_MIN_GALLERY a linear
+    scan is already well under a millisecond per face.
+    """
+    backend = backend or MATCHER_BACKEND
+    if backend not in MATCHER_BACKENDS:
+        raise ValueError(f'Unknown matcher backend {backend!r}, expected one of {sorted(MATCHER_BACKENDS)}')
+    if backend == 'ivf':
+        matcher = IVFMatcher(gallery, n_lists=IVF_LISTS, n_probe=IVF_PROBE, min_gallery=IVF_MIN_GALLERY)
+        matcher.prepare()
+        return matcher
+    return MATCHER_BACKENDS[backend](gallery)
+
+
+def _time_per_face(matcher, queries, k):
+    start = time.perf_counter()
+    results = matcher.match(queries, k=k)
+    return results, (time.perf_counter() - start) * 1000.0 / max(len(queries), 1)
+
+
+def recall_report(gallery, queries=None, samples=500, noise=0.03, k=1, probes=(1, 2, 4, 8, 16)):
+    """Compare approximate search with exact search on this gallery.
+
+    Without real `queries`, synthetic probe faces are made by jittering random
+    gallery rows (noise is per dimension; 0.03 gives distances around 0.35,
+    typical of a second photo of the same person). Prints recall@k and
+    per-face latency for each n_probe setting and returns the rows.
+    """
+    if len(gallery) == 0:
+        print('[Recall] Gallery is empty.')
+        return []
+    if queries is None:
+        rng = np.random.default_rng(0)
+        picks = rng.integers(0, len(gallery), size=samples)
+        queries = gallery.encodings[picks] + rng.normal(0.0, noise, (samples, ENCODING_SIZE)).astype(np.float32)
+
+    exact_results, exact_ms = _time_per_face(ExactMatcher(gallery), queries, k)
+    exact_sets = [{m.employee_id for m in r} for r in exact_results]
+
+    print(f'[Recall] Gallery: {len(gallery)} encodings, {len(queries)} probe faces, k={k}')
+    print(f'[Recall]   exact         recall=1.000  {exact_ms:.3f} ms/face')
+    rows = [{'backend': 'exact', 'n_probe': None, 'recall': 1.0, 'ms_per_face': exact_ms}]
+
+    ivf = IVFMatcher(gallery, n_lists=IVF_LISTS)
+    ivf.prepare()
+    for n_probe in probes:
+        if n_probe > len(ivf.lists):
+            break
+        ivf.n_probe = n_probe
+        results, ms = _time_per_face(ivf, queries, k)
+        hits = sum(len(expected & {m.employee_id for m in got})
+                   for expected, got in zip(exact_sets, results))
+        recall = hits / max(sum(len(e) for e in exact_sets), 1)
+        print(f'[Recall]   ivf probe={n_probe:<3d} recall={recall:.3f}  {ms:.3f} ms/face '
+              f'({len(ivf.lists)} lists)')
+        rows.append({'backend': 'ivf', 'n_probe': n_probe, 'recall': recall, 'ms_per_face': ms})
+    return rows
+
+
+def pack_encoding(encoding):
+    """128 floats (or T x 128 templates) -> base64 of little-endian float32,
+    the server's storage form."""
+    packed = np.ascontiguousarray(encoding, dtype='<f4')
+    if packed.size == 0 or packed.size % ENCODING_SIZE:
+        raise ValueError(f'Expected multiples of {ENCODING_SIZE} values, got {packed.size}')
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+
+def unpack_encodings(text):
+    """Packed base64 (one or many encodings) -> float32 (N x 128) matrix."""
+    raw = base64.b64decode(text, validate=True)
+    if len(raw) % (ENCODING_SIZE * 4):
+        raise ValueError(f'Packed encodings of {len(raw)} bytes')
+    return np.frombuffer(raw, dtype='<f4').reshape(-1, ENCODING_SIZE)
+
+
+def _decode_encoding(emp):
+    """An employee's templates as a (T x 128) matrix."""
+    text = emp['encoding']
+    if text.lstrip().startswith('['):
+        # Servers that still store JSON
+        return np.asarray(json.loads(text), dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    return unpack_encodings(text)
+
+
+def apply_gallery_changes(gallery, changes):
+    """Patch a gallery with one /face_attendance/employees sync response.
+
+    Returns (changed, removed) counts; invalid encodings are skipped.
+    """
+    changed = removed = 0
+    with gallery.lock:
+        if changes.get('full'):
+            gallery.clear()
+        if 'blob' in changes:
+            encodings = unpack_encodings(changes['blob'])
+            # Servers before multi-template registration send no counts
+            counts = changes.get('counts') or [1] * len(changes['ids'])
+            bounds = np.cumsum([0] + list(counts))
+            for employee_id, name, start, end in zip(changes['ids'], changes['names'],
+                                                     bounds[:-1], bounds[1:]):
+                gallery.upsert(employee_id, name, encodings[start:end])
+                gallery.invalid_ids.discard(employee_id)
+                changed += 1
+            for employee_id in changes.get('invalid', []):
+                removed += gallery.remove(employee_id)
+                gallery.invalid_ids.add(employee_id)
+        for emp in changes.get('employees', []):
+            try:
+                gallery.upsert(emp['id'], emp['name'], _decode_encoding(emp))
+                gallery.invalid_ids.discard(emp['id'])
+                changed += 1
+            except (TypeError, ValueError):
+                print(f'  [!] Invalid encoding for {emp["name"]}, skipping.')
+                removed += gallery.remove(emp['id'])
+                gallery.invalid_ids.add(emp['id'])
+        for employee_id in changes.get('removed', []):
+            removed += gallery.remove(employee_id)
+            gallery.invalid_ids.discard(employee_id)
+        gallery.sync_cursor = changes.get('cursor')
+        gallery.sync_etag = changes.get('etag')
+    return changed, removed
+
+
+SNAPSHOT_FORMAT = 1
+
+
+def save_gallery_snapshot(gallery, path=None):
+    """Write the gallery to a versioned .npz file (atomically)."""
+    path = SNAPSHOT_PATH if path is None else path
+    if not path:
+        return
+    with gallery.lock:
+        arrays = {
+            'format': np.array(SNAPSHOT_FORMAT),
+            'server': np.array(f'{ODOO_URL}|{ODOO_DB}'),
+            'saved_at': np.array(time.time()),
+            'encodings': gallery.encodings.copy(),
+            'ids': gallery.ids.copy(),
+            'names': np.array(gallery.names, dtype=str),
+            'cursor': np.array(gallery.sync_cursor or ''),
+            'etag': np.array(gallery.sync_etag or ''),
+        }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_gallery_snapshot(path=None):
+    """Read a gallery snapshot; None if missing, outdated or for another server."""
+    path = SNAPSHOT_PATH if path is None else path
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format']) != SNAPSHOT_FORMAT or str(data['server']) != f'{ODOO_URL}|{ODOO_DB}':
+                print(f'[Faces] Ignoring snapshot {path} (other format or server).')
+                return None
+            gallery = GalleryIndex.from_arrays(data['encodings'], data['ids'], data['names'])
+            gallery.sync_cursor = str(data['cursor']) or None
+            gallery.sync_etag = str(data['etag']) or None
+            age = time.time() - float(data['saved_at'])
+    except (OSError, KeyError, ValueError) as e:
+        print(f'[Faces] Cannot read snapshot {path}: {e}')
+        return None
+    print(f'[Faces] Loaded {len(gallery)} faces from snapshot {path} ({age / 3600:.1f}h old).')
+    return gallery
+
+
+def load_known_faces(odoo, snapshot_path=None):
+    """Load known face encodings into a GalleryIndex.
+
+    A local snapshot is used when present - it loads in milliseconds and
+    works while Odoo is unreachable; GallerySync then reconciles it with
+    the server in the background. Otherwise the gallery is downloaded
+    from Odoo and a snapshot is written for the next start.
+    """
+    gallery = load_gallery_snapshot(snapshot_path)
+    if gallery is not None:
+        return gallery
 
-def load_known_faces(odoo):
-    """Load known face encodings from Odoo."""
     print('[Faces] Loading known faces from Odoo...')
-    employees = odoo.get_employees_with_faces()
+    changes = odoo.get_face_changes()
 
-    known_encodings = []
-    known_ids = []
-    known_names = []
+    if isinstance(changes, list):
+        # Server module without delta sync: plain list of employees
+        changes = {'full': True, 'employees': changes}
 
-    for emp in employees:
+    gallery = GalleryIndex(capacity=len(changes.get('ids') or changes.get('employees') or ()))
+    apply_gallery_changes(gallery, changes)
+    save_gallery_snapshot(gallery, snapshot_path)
+
+    print(f'[Faces] Loaded {len(gallery)} faces.')
+    return gallery
+
+
+class GallerySync:
+    """Keeps a running gallery in step with Odoo.
+
+    Every GALLERY_SYNC_INTERVAL seconds the server is asked what changed
+    since the last cursor; an unchanged gallery costs one tiny "not
+    modified" answer. New registrations are patched in without a restart.
+    Deletions cannot be seen in a delta, so when the gallery size does not
+    match the server's count the next poll asks for the full list.
+
+    The first poll runs right away, so a gallery started from a local
+    snapshot is reconciled as soon as Odoo is reachable; every change is
+    written back to the snapshot.
+    """
+
+    def __init__(self, odoo, gallery, interval=None, snapshot_path=None, matcher=None):
+        self.odoo = odoo
+        self.gallery = gallery
+        self.matcher = matcher          # Its index is rebuilt here, not on the frame path
+        self.interval = GALLERY_SYNC_INTERVAL if interval is None else interval
+        self.snapshot_path = SNAPSHOT_PATH if snapshot_path is None else snapshot_path
+        self.legacy_server = False
+        self.polls = 0
+        self.updates = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """Fetch and apply one delta. Returns True if the gallery changed."""
+        self.polls += 1
+        changes = self.odoo.get_face_changes(self.gallery.sync_cursor, self.gallery.sync_etag)
+        if isinstance(changes, list):
+            # Server module without delta sync: take the full list once
+            self.legacy_server = True
+            changes = {'full': True, 'employees': changes}
+        elif changes.get('not_modified'):
+            return False
+
+        changed, removed = apply_gallery_changes(self.gallery, changes)
+        self.updates += 1
+        print(f'[Faces] Sync: {changed} updated, {removed} removed, {len(self.gallery)} in gallery.')
+        if hasattr(self.matcher, 'prepare'):
+            self.matcher.prepare()
+        known = self.gallery.employee_count() + len(self.gallery.invalid_ids)
+        if changes.get('count') is not None and changes['count'] != known:
+            # Someone was deleted on the server: resync fully next time
+            self.gallery.sync_cursor = None
+            self.gallery.sync_etag = None
         try:
-            encoding = json.loads(emp['encoding'])
-            known_encodings.append(np.array(encoding))
-            known_ids.append(emp['id'])
-            known_names.append(emp['name'])
-        except (json.JSONDecodeError, TypeError):
-            print(f'  [!] Invalid encoding for {emp["name"]}, skipping.')
+            save_gallery_snapshot(self.gallery, self.snapshot_path)
+        except OSError as e:
+            print(f'[Faces] Cannot write snapshot: {e}')
+        return bool(changed or removed)
 
-    print(f'[Faces] Loaded {len(known_encodings)} faces.')
-    return known_encodings, known_ids, known_names
+    def _run(self):
+        delay = 0
+        while not self._stop.wait(delay):
+            delay = self.interval
+            try:
+                self.poll()
+            except Exception as e:
+                self.errors += 1
+                print(f'[Faces] Sync failed: {e}')
+            if self.legacy_server:
+                print('[Faces] Server does not support gallery sync; restart to pick up new faces.')
+                return
 
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='gallery-sync', daemon=True)
+        self._thread.start()
 
-def frame_to_base64(frame, face_location=None):
-    """Convert a frame (or cropped face) to base64 for sending to Odoo."""
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def encode_snapshot(frame, face_location=None, max_size=None, quality=None, max_bytes=None):
+    """JPEG bytes of a frame (or padded face crop) within a size budget.
+
+    The image is shrunk so its longest side is at most `max_size`, encoded
+    at `quality`, and if still over `max_bytes` re-encoded at lower quality
+    and then smaller size. Defaults come from the SNAPSHOT_* settings.
+    """
+    max_size = SNAPSHOT_MAX_SIZE if max_size is None else max_size
+    quality = SNAPSHOT_QUALITY if quality is None else quality
+    max_bytes = SNAPSHOT_MAX_BYTES if max_bytes is None else max_bytes
     if face_location:
         top, right, bottom, left = face_location
         # Add some padding
@@ -139,13 +1029,86 @@ def frame_to_base64(frame, face_location=None):
     else:
         face_img = frame
 
-    _, buffer = cv2.imencode('.jpg', face_img)
-    return base64.b64encode(buffer).decode('utf-8')
+    longest = max(face_img.shape[:2])
+    if max_size and longest > max_size:
+        factor = max_size / longest
+        face_img = cv2.resize(face_img, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    while True:
+        _, buffer = cv2.imencode('.jpg', face_img, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        if not max_bytes or len(buffer) <= max_bytes or max(face_img.shape[:2]) < 64:
+            return buffer.tobytes()
+        if quality > 40:
+            quality -= 15
+        else:
+            face_img = cv2.resize(face_img, None, fx=0.75, fy=0.75, interpolation=cv2.INTER_AREA)
+
+
+def frame_to_base64(frame, face_location=None, **budget):
+    """Convert a frame (or cropped face) to base64 for sending to Odoo."""
+    return base64.b64encode(encode_snapshot(frame, face_location, **budget)).decode('utf-8')
+
+
+def sample_quality(frame, rgb_frame, location):
+    """Why a registration sample is unusable, or None if it is good.
+
+    Checks face size, sharpness (variance of the Laplacian) and that the
+    head faces the camera (nose tip close to the midpoint of the eyes).
+    """
+    top, right, bottom, left = location
+    if bottom - top < REGISTER_MIN_FACE:
+        return 'too small, move closer'
+    gray = cv2.cvtColor(frame[max(top, 0):bottom, max(left, 0):right], cv2.COLOR_BGR2GRAY)
+    if gray.size == 0 or cv2.Laplacian(gray, cv2.CV_64F).var() < REGISTER_MIN_SHARPNESS:
+        return 'blurry, hold still'
+    landmarks = face_recognition.face_landmarks(rgb_frame, [location], model='small')
+    if not landmarks:
+        return 'no landmarks'
+    points = landmarks[0]
+    eye_a = np.mean(points['left_eye'], axis=0)
+    eye_b = np.mean(points['right_eye'], axis=0)
+    eye_distance = np.linalg.norm(eye_b - eye_a)
+    if eye_distance == 0:
+        return 'no landmarks'
+    yaw = abs(points['nose_tip'][0][0] - (eye_a[0] + eye_b[0]) / 2) / eye_distance
+    if yaw > REGISTER_MAX_YAW:
+        return 'turned away, look at the camera'
+    return None
+
+
+def select_templates(samples, count=None):
+    """Reduce registration samples to at most `count` templates.
+
+    Samples far from the rest (a bad frame, someone walking past) are
+    dropped first. With count 1 the centroid of the remaining samples is
+    returned; otherwise samples are picked farthest-point first, starting
+    from the one nearest the centroid, so the templates cover the spread
+    of expressions and angles instead of repeating the same frame.
+    """
+    count = REGISTER_TEMPLATES if count is None else count
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    dist = np.linalg.norm(samples - samples.mean(axis=0), axis=1)
+    inliers = samples[dist <= max(np.median(dist) * 2.0, 1e-6)]
+    centroid = inliers.mean(axis=0)
+    if count <= 1:
+        return centroid[None, :]
+    chosen = [int(np.argmin(np.linalg.norm(inliers - centroid, axis=1)))]
+    nearest = np.linalg.norm(inliers - inliers[chosen[0]], axis=1)
+    while len(chosen) < min(count, len(inliers)):
+        nxt = int(np.argmax(nearest))
+        if nearest[nxt] == 0:
+            break
+        chosen.append(nxt)
+        nearest = np.minimum(nearest, np.linalg.norm(inliers - inliers[nxt], axis=1))
+    return inliers[chosen]
 
 
 def register_mode(odoo):
     """Register a new employee's face using the camera.
-    Takes a photo and sends the encoding to Odoo.
+
+    SPACE starts a burst: for REGISTER_BURST_SECONDS every frame with one
+    good-quality face (see sample_quality) is encoded, up to
+    REGISTER_SAMPLES. The samples are reduced to REGISTER_TEMPLATES
+    templates (select_templates) and sent to Odoo.
     """
     employee_id = input('\nEnter employee ID to register: ').strip()
     if not employee_id.isdigit():
@@ -160,162 +1123,2638 @@ def register_mode(odoo):
         print('[Error] Cannot open camera.')
         return
 
+    samples = []
+    best_frame = best_location = None
+    burst_until = None
+    status = 'Press SPACE to capture, Q to cancel'
     while True:
         ret, frame = cap.read()
         if not ret:
             break
 
-        # Show preview
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_frame)
+        face_locations = get_detector().detect(rgb_frame)
+
+        if burst_until is not None:
+            if len(face_locations) == 1:
+                problem = sample_quality(frame, rgb_frame, face_locations[0])
+                if problem is None:
+                    samples.append(face_recognition.face_encodings(rgb_frame, face_locations)[0])
+                    if best_frame is None:
+                        best_frame, best_location = frame.copy(), face_locations[0]
+                    status = f'Capturing {len(samples)}/{REGISTER_SAMPLES} - turn the head slightly'
+                else:
+                    status = f'Sample rejected: {problem}'
+            elif face_locations:
+                status = 'Only one person should be in frame'
+            else:
+                status = 'No face detected'
+            if len(samples) >= REGISTER_SAMPLES or time.time() >= burst_until:
+                break
 
+        # Show preview
         for (top, right, bottom, left) in face_locations:
             cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-
-        cv2.putText(frame, 'Press SPACE to capture, Q to cancel', (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        cv2.putText(frame, status, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
         cv2.imshow('Register Face', frame)
 
         key = cv2.waitKey(1) & 0xFF
         if key == ord('q'):
+            burst_until = None
+            samples = []
             break
-        elif key == ord(' '):
-            # Capture
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-            if len(face_encodings) == 0:
-                print('[Register] No face detected! Try again.')
-                continue
-            if len(face_encodings) > 1:
-                print('[Register] Multiple faces detected! Only one person should be in frame.')
+        elif key == ord(' ') and burst_until is None:
+            burst_until = time.time() + REGISTER_BURST_SECONDS
+            status = 'Capturing...'
+
+    cap.release()
+    cv2.destroyAllWindows()
+
+    if burst_until is None:
+        return
+    if len(samples) < REGISTER_MIN_SAMPLES:
+        print(f'[Register] Only {len(samples)} good samples (need {REGISTER_MIN_SAMPLES}). '
+              f'Check lighting and distance, then try again.')
+        return
+
+    templates = select_templates(samples)
+    print(f'[Register] {len(samples)} samples -> {len(templates)} templates.')
+    # The registration photo is kept at its captured size
+    image_b64 = frame_to_base64(best_frame, best_location, max_size=0, quality=90, max_bytes=0)
+    result = odoo.register_face(employee_id, pack_encoding(templates), image_b64)
+    if result.get('success'):
+        print(f'[Register] Face registered for: {result.get("employee_name")}')
+    else:
+        print(f'[Register] Failed: {result.get("error")}')
+
+
+def odoo_datetime(timestamp):
+    """Format a unix timestamp the way Odoo stores Datetime fields (UTC)."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+
+class DetectionUploader:
+    """Background uploader for detections, backed by a SQLite spool.
+
+    enqueue() only writes the event to the local spool, so the frame loop
+    never waits on the network. A background thread sends spooled events
+    in batches to /face_attendance/log_batch; events stay on disk until
+    Odoo accepts them, which means detections survive restarts and offline
+    periods. While Odoo is
+    unreachable the thread backs off exponentially up to UPLOAD_RETRY_MAX.
+    Events Odoo rejects are retried UPLOAD_MAX_ATTEMPTS times and dropped.
+
+    Snapshots are spooled as JPEG bytes next to the event and, with
+    SNAPSHOT_BINARY_UPLOAD, sent as multipart files; servers without the
+    upload route get them base64-encoded inside the JSON batch instead.
+    """
+
+    def __init__(self, odoo, path=None, batch_size=None, flush_interval=None, binary=None):
+        self.odoo = odoo
+        self.path = SPOOL_PATH if path is None else path
+        self.batch_size = UPLOAD_BATCH_SIZE if batch_size is None else batch_size
+        self.flush_interval = UPLOAD_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.binary = SNAPSHOT_BINARY_UPLOAD if binary is None else binary
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS detection_spool ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' event_key TEXT UNIQUE NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' next_attempt REAL NOT NULL DEFAULT 0,'
+            ' snapshot BLOB)'
+        )
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(detection_spool)')}
+        if 'snapshot' not in columns:
+            # Spool written by a version that kept snapshots in the payload
+            self._db.execute('ALTER TABLE detection_spool ADD COLUMN snapshot BLOB')
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._backoff = 0.0
+        self._offline_until = 0.0
+        self.uploaded = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.retries = 0
+        self._upload_seconds = 0.0
+        self._upload_calls = 0
+        self._event_age_total = 0.0
+        self._snapshot_bytes = 0
+        self._snapshots = 0
+
+    # -- producer side -----------------------------------------
+
+    def enqueue(self, employee_id, confidence, snapshot=None, camera_name=None,
+                detected_at=None, direction=None, key=None):
+        """Spool one detection (snapshot = JPEG bytes) for upload.
+
+        `direction` ('entry'/'exit') comes with door line crossings. `key`
+        defaults to a random idempotency key; an event whose key is
+        already spooled is not spooled twice. Returns the key.
+        """
+        detected_at = detected_at or time.time()
+        key = key or uuid.uuid4().hex
+        payload = {
+            'key': key,
+            'employee_id': employee_id,
+            'confidence': round(confidence * 100, 1),
+            'camera_name': camera_name or CAMERA_NAME,
+            'detection_time': odoo_datetime(detected_at),
+        }
+        if direction:
+            payload['direction'] = direction
+        with self._lock:
+            self._db.execute(
+                'INSERT OR IGNORE INTO detection_spool (event_key, payload, created_at, snapshot)'
+                ' VALUES (?, ?, ?, ?)',
+                (key, json.dumps(payload), detected_at, snapshot),
+            )
+            if snapshot:
+                self._snapshot_bytes += len(snapshot)
+                self._snapshots += 1
+        if self.depth() >= self.batch_size:
+            self._wake.set()
+        return key
+
+    def depth(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM detection_spool').fetchone()[0]
+
+    # -- upload side -------------------------------------------
+
+    def _due_batch(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT id, payload, created_at, attempts, snapshot FROM detection_spool'
+                ' WHERE next_attempt <= ? ORDER BY id LIMIT ?',
+                (time.time(), self.batch_size),
+            ).fetchall()
+
+    def _send(self, events, snapshots):
+        """Send a batch in one request; returns {event_key: None | error message}.
+
+        Keys make the upload idempotent: if the answer is lost and the batch
+        is sent again, Odoo reports the events as duplicates instead of
+        logging them twice.
+        """
+        results = None
+        if self.binary:
+            try:
+                results = self.odoo.log_attendance_upload(events, snapshots)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                print('[Upload] Odoo has no binary upload route, sending snapshots inline.')
+                self.binary = False
+        if results is None:
+            for event in events:
+                if event['key'] in snapshots:
+                    event['snapshot_base64'] = base64.b64encode(snapshots[event['key']]).decode('ascii')
+            results = self.odoo.log_attendance_batch(events)
+        return {
+            item.get('key'): None if item.get('success') else (item.get('error') or 'rejected')
+            for item in results
+        }
+
+    def flush(self):
+        """Upload every due event now. Returns False if Odoo was unreachable."""
+        while True:
+            rows = self._due_batch()
+            if not rows:
+                return True
+            events = [json.loads(row[1]) for row in rows]
+            snapshots = {event['key']: row[4] for row, event in zip(rows, events) if row[4]}
+            started = time.perf_counter()
+            try:
+                outcome = self._send(events, snapshots)
+            except (requests.RequestException, ValueError) as e:
+                # Network down or a non-JSON answer (proxy page, restart):
+                # keep everything spooled and back off.
+                self._backoff = min(UPLOAD_RETRY_MAX, max(1.0, self._backoff * 2))
+                self._offline_until = time.time() + self._backoff
+                self.retries += 1
+                METRICS.inc('uploads', result='offline')
+                print(f'[Upload] Odoo unreachable ({e}); {self.depth()} spooled, '
+                      f'retrying in {self._backoff:.0f}s')
+                return False
+            except Exception as e:
+                # Odoo answered with an error for the batch as a whole
+                outcome = {event['key']: str(e) for event in events}
+            self._backoff = 0.0
+            seconds = time.perf_counter() - started
+            self._upload_seconds += seconds
+            self._upload_calls += 1
+            METRICS.observe('upload', seconds)
+            self._settle(rows, events, outcome)
+
+    def _settle(self, rows, events, outcome):
+        now = time.time()
+        with self._lock:
+            for (row_id, _payload, created_at, attempts, _snapshot), event in zip(rows, events):
+                error = outcome.get(event['key'], 'no result')
+                if error is None:
+                    self._db.execute('DELETE FROM detection_spool WHERE id = ?', (row_id,))
+                    self.uploaded += 1
+                    self._event_age_total += now - created_at
+                    METRICS.inc('uploads', result='ok')
+                elif attempts + 1 >= UPLOAD_MAX_ATTEMPTS:
+                    self._db.execute('DELETE FROM detection_spool WHERE id = ?', (row_id,))
+                    self.dropped += 1
+                    METRICS.inc('uploads', result='dropped')
+                    print(f'[Upload] Dropping detection of employee {event["employee_id"]} '
+                          f'after {attempts + 1} attempts: {error}')
+                else:
+                    self.rejected += 1
+                    METRICS.inc('uploads', result='rejected')
+                    delay = min(UPLOAD_RETRY_MAX, 2.0 ** (attempts + 1))
+                    self._db.execute(
+                        'UPDATE detection_spool SET attempts = ?, next_attempt = ? WHERE id = ?',
+                        (attempts + 1, now + delay, row_id),
+                    )
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if time.time() < self._offline_until:
                 continue
+            self.flush()
 
-            encoding = face_encodings[0]
-            encoding_json = json.dumps(encoding.tolist())
-            image_b64 = frame_to_base64(frame, face_locations[0])
+    def start(self):
+        pending = self.depth()
+        if pending:
+            print(f'[Upload] {pending} detections waiting in spool {self.path}')
+        self._thread = threading.Thread(target=self._run, name='uploader', daemon=True)
+        self._thread.start()
 
-            result = odoo.register_face(employee_id, encoding_json, image_b64)
-            if result.get('success'):
-                print(f'[Register] Face registered for: {result.get("employee_name")}')
-            else:
-                print(f'[Register] Failed: {result.get("error")}')
-            break
+    def stop(self, timeout=10):
+        """Stop the thread after one last flush attempt; unsent events stay spooled."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if time.time() >= self._offline_until:
+            self.flush()
+        left = self.depth()
+        if left:
+            print(f'[Upload] {left} detections kept in {self.path} for the next run.')
+        with self._lock:
+            self._db.close()
 
-    cap.release()
-    cv2.destroyAllWindows()
+    def stats(self):
+        with self._lock:
+            depth, oldest = self._db.execute(
+                'SELECT COUNT(*), MIN(created_at) FROM detection_spool').fetchone()
+        return {
+            'depth': depth,
+            'oldest_age_s': round(time.time() - oldest, 1) if oldest else 0.0,
+            'uploaded': self.uploaded,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'offline_retries': self.retries,
+            'avg_batch_ms': round(self._upload_seconds / self._upload_calls * 1000.0, 1)
+            if self._upload_calls else 0.0,
+            'avg_event_age_s': round(self._event_age_total / self.uploaded, 2) if self.uploaded else 0.0,
+            'avg_snapshot_kb': round(self._snapshot_bytes / self._snapshots / 1024.0, 1)
+            if self._snapshots else 0.0,
+            'binary_upload': self.binary,
+        }
 
+    def print_stats(self):
+        s = self.stats()
+        print(
+            f'[Upload] spooled={s["depth"]} (oldest {s["oldest_age_s"]}s) uploaded={s["uploaded"]} '
+            f'rejected={s["rejected"]} dropped={s["dropped"]} offline_retries={s["offline_retries"]} '
+            f'batch={s["avg_batch_ms"]}ms event_age={s["avg_event_age_s"]}s '
+            f'snapshot={s["avg_snapshot_kb"]}KB ({"binary" if s["binary_upload"] else "inline"})'
+        )
 
-def detection_mode(odoo):
-    """Main detection loop - continuously detect and identify faces."""
-    known_encodings, known_ids, known_names = load_known_faces(odoo)
 
-    if len(known_encodings) == 0:
-        print('[!] No known faces loaded. Register some faces first.')
-        print('    Run with --register flag to register faces.')
-        return
+# ------------------------------------------------------------
+# Metrics
+# ------------------------------------------------------------
 
-    # Cooldown tracking: {employee_id: last_logged_time}
-    cooldowns = {}
+class Histogram:
+    """Cumulative-bucket timing histogram (Prometheus style), thread-safe."""
 
-    print(f'[Camera] Opening camera: {CAMERA_SOURCE}')
-    cap = cv2.VideoCapture(CAMERA_SOURCE)
-    if not cap.isOpened():
-        print('[Error] Cannot open camera. Check CAMERA_SOURCE setting.')
-        return
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
-    print('[Camera] Running face detection. Press Q to quit.')
-    frame_count = 0
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)     # last = above every bucket
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print('[Camera] Failed to read frame.')
-            break
+    def observe(self, seconds):
+        index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
 
-        frame_count += 1
-        display_frame = frame.copy()
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                lower = self.BUCKETS[i - 1] if i else 0.0
+                upper = self.BUCKETS[i] if i < len(self.BUCKETS) else self.BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.BUCKETS[-1]
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels)
 
-        # Only process every Nth frame for performance
-        if frame_count % FRAME_SKIP != 0:
-            cv2.imshow('Door Monitor', display_frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-            continue
 
-        # Resize for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-        rgb_small = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+class Metrics:
+    """Stage timings and counters of the running camera script.
 
-        # Detect faces
-        face_locations = face_recognition.face_locations(rgb_small)
-        face_encodings = face_recognition.face_encodings(rgb_small, face_locations)
+    observe() feeds the per-stage histograms (capture, resize, detect,
+    encode, match, snapshot, upload), inc() the counters; gauge() registers
+    callbacks read at scrape time. render() produces the Prometheus text
+    format served by start_metrics_server(), summary() the periodic log
+    lines.
+    """
+
+    def __init__(self, prefix='face_camera'):
+        self.prefix = prefix
+        self.stages = {}        # (stage, camera) -> Histogram
+        self.counters = {}      # (name, labels) -> value
+        self.gauges = {}        # name -> (help, callback returning {labels: value})
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, camera=''):
+        key = (stage, camera)
+        histogram = self.stages.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(key, Histogram())
+        histogram.observe(seconds)
+
+    def observe_all(self, timings, camera=''):
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds, camera)
 
-        for (top, right, bottom, left), face_enc in zip(face_locations, face_encodings):
-            # Scale back up (since we resized to 0.5x)
-            top *= 2
-            right *= 2
-            bottom *= 2
-            left *= 2
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
 
-            # Compare with known faces
-            distances = face_recognition.face_distance(known_encodings, face_enc)
+    def gauge(self, name, help_text, callback):
+        """`callback()` returns {((label, value), ...): number}."""
+        self.gauges[name] = (help_text, callback)
 
-            if len(distances) == 0:
+    def render(self):
+        lines = []
+        name = f'{self.prefix}_stage_seconds'
+        lines += [f'# HELP {name} Time spent per frame/event in each pipeline stage.',
+                  f'# TYPE {name} histogram']
+        for (stage, camera), h in sorted(self.stages.items()):
+            labels = (('stage', stage),) + ((('camera', camera),) if camera else ())
+            with h._lock:
+                counts, count, total = list(h.counts), h.count, h.sum
+            cumulative = 0
+            for bound, n in zip(Histogram.BUCKETS, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+            lines.append(f'{name}_bucket{{{_labels(labels + (("le", "+Inf"),))}}} {count}')
+            lines.append(f'{name}_sum{{{_labels(labels)}}} {total:.6f}')
+            lines.append(f'{name}_count{{{_labels(labels)}}} {count}')
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+        seen = set()
+        for (counter, labels), value in counters:
+            full = f'{self.prefix}_{counter}_total'
+            if counter not in seen:
+                seen.add(counter)
+                lines.append(f'# TYPE {full} counter')
+            lines.append(f'{full}{{{_labels(labels)}}} {value}')
+
+        for gauge, (help_text, callback) in sorted(self.gauges.items()):
+            full = f'{self.prefix}_{gauge}'
+            lines += [f'# HELP {full} {help_text}', f'# TYPE {full} gauge']
+            for labels, value in callback().items():
+                lines.append(f'{full}{{{_labels(labels)}}} {value}' if labels else f'{full} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """One log line per stage: p50/p95 and count over all cameras."""
+        stages = {}
+        for (stage, _camera), h in self.stages.items():
+            stages.setdefault(stage, []).append(h)
+        lines = []
+        for stage in ('capture', 'resize', 'detect', 'encode', 'match', 'snapshot', 'upload'):
+            histograms = stages.get(stage)
+            if not histograms:
                 continue
+            merged = Histogram()
+            for h in histograms:
+                with h._lock:
+                    merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                    merged.count += h.count
+                    merged.sum += h.sum
+            lines.append(f'[Metrics] {stage:<8} p50={merged.quantile(0.5) * 1000:.1f}ms '
+                         f'p95={merged.quantile(0.95) * 1000:.1f}ms '
+                         f'avg={merged.sum / merged.count * 1000:.1f}ms n={merged.count}')
+        return lines
 
-            best_match_idx = np.argmin(distances)
-            best_distance = distances[best_match_idx]
-            confidence = 1.0 - best_distance
-
-            if best_distance <= CONFIDENCE_THRESHOLD:
-                # Match found
-                emp_id = known_ids[best_match_idx]
-                emp_name = known_names[best_match_idx]
-
-                # Check cooldown
-                now = time.time()
-                last_logged = cooldowns.get(emp_id, 0)
-
-                if now - last_logged >= COOLDOWN_SECONDS:
-                    # Log door detection
-                    snapshot_b64 = frame_to_base64(frame, (top, right, bottom, left))
-                    try:
-                        result = odoo.log_attendance(emp_id, confidence, snapshot_b64)
-                        if result.get('success'):
-                            print(f'[DETECTED] {emp_name} at door ({confidence*100:.1f}%)')
-                            cooldowns[emp_id] = now
-                        else:
-                            print(f'[Error] {result.get("error")}')
-                    except Exception as e:
-                        print(f'[Error] Failed to log: {e}')
-
-                # Draw green box with name
-                cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                label = f'{emp_name} ({confidence*100:.0f}%)'
-                cv2.putText(display_frame, label, (left, top - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-            else:
-                # Unknown face - red box
-                cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 0, 255), 2)
-                cv2.putText(display_frame, 'Unknown', (left, top - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-
-        # Show frame
-        cv2.imshow('Door Monitor', display_frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
 
-    cap.release()
-    cv2.destroyAllWindows()
-    print('[Camera] Stopped.')
+METRICS = Metrics()
 
 
-def main():
-    print('=' * 50)
-    print('  Door Monitoring - Face Recognition')
-    print('=' * 50)
-    print(f'  Odoo: {ODOO_URL}')
-    print(f'  Database: {ODOO_DB}')
-    print(f'  Camera: {CAMERA_SOURCE}')
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(metrics=METRICS, port=None, host=None):
+    """Serve `metrics` at http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host or METRICS_HOST, port or METRICS_PORT), _MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f'[Metrics] Serving Prometheus metrics on http://{server.server_address[0]}:'
+          f'{server.server_address[1]}/metrics')
+    return server
+
+
+# ------------------------------------------------------------
+# Detection pipeline
+#   capture thread -> [latest frame] -> detect/encode workers
+#   -> [results] -> main thread (match routing, display)
+#   -> [publish] -> publisher thread (snapshot) -> uploader (spool + Odoo)
+# ------------------------------------------------------------
+
+FrameTask = namedtuple('FrameTask', ['camera', 'seq', 'frame', 'captured_at', 'scale'])
+# One detected face; location is (top, right, bottom, left) in full-frame pixels
+Face = namedtuple('Face', ['location', 'candidates', 'track_id'], defaults=(None,))
+FrameResult = namedtuple('FrameResult', ['camera', 'seq', 'frame', 'faces', 'captured_at', 'processed_at'])
+# direction is 'entry'/'exit' for door line crossings, None in cooldown mode
+Detection = namedtuple('Detection', ['camera_name', 'employee_id', 'name', 'confidence',
+                                     'frame', 'location', 'detected_at', 'direction'], defaults=(None,))
+
+
+class LatestFrameSlot:
+    """Single-slot mailbox holding only the newest frame.
+
+    put() never blocks: a frame nobody has taken yet is replaced and counted
+    as dropped, so slow workers always see the freshest picture instead of
+    working through a backlog of stale frames.
+    """
+
+    def __init__(self, cond=None):
+        # Slots of several cameras may share one condition so a scheduler
+        # can wait for "any camera has a frame".
+        self._cond = cond or threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def take_nowait(self):
+        with self._cond:
+            item, self._item = self._item, None
+            return item
+
+    def qsize(self):
+        return 0 if self._item is None else 1
+
+
+class DroppingQueue(queue.Queue):
+    """Bounded queue that discards the oldest item instead of blocking."""
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put_latest(self, item):
+        while True:
+            try:
+                self.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    inter = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    __slots__ = ('track_id', 'box', 'candidates', 'identified_at', 'last_seen', 'missed')
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.candidates = []
+        self.identified_at = 0.0
+        self.last_seen = now
+        self.missed = 0
+
+    @property
+    def confident(self):
+        if not self.candidates:
+            return False
+        best = self.candidates[0]
+        return best.distance <= CONFIDENCE_THRESHOLD and best.margin >= TRACK_MIN_MARGIN
+
+
+class FaceTracker:
+    """Keeps persistent track IDs for faces of one camera across frames.
+
+    Detections are associated to tracks by box overlap (greedy IoU). A
+    track that was identified confidently reuses its identity and is only
+    re-encoded every TRACK_REFRESH_SECONDS; a new or doubtful track is
+    encoded again after TRACK_RETRY_SECONDS. Someone standing in view for a
+    few seconds is therefore encoded a handful of times, not every frame.
+    """
+
+    def __init__(self, iou_threshold=None, max_missed=None):
+        self.iou_threshold = TRACK_IOU if iou_threshold is None else iou_threshold
+        self.max_missed = TRACK_MAX_MISSED if max_missed is None else max_missed
+        self.tracks = []
+        self._next_id = 1
+        self._last_seq = -1
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.reused = 0
+
+    def settled_boxes(self, now=None):
+        """Boxes of tracks that do not need a new encoding right now."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [
+                t.box for t in self.tracks
+                if t.candidates and not t.missed and now - t.identified_at < (
+                    TRACK_REFRESH_SECONDS if t.confident else TRACK_RETRY_SECONDS)
+            ]
+
+    def _associate(self, locations):
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for di, box in enumerate(locations):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, ti, di))
+        pairs.sort(reverse=True)
+        assigned, used_tracks = {}, set()
+        for _iou, ti, di in pairs:
+            if ti in used_tracks or di in assigned:
+                continue
+            assigned[di] = self.tracks[ti]
+            used_tracks.add(ti)
+        return assigned
+
+    def update(self, seq, locations, candidates, now=None):
+        """Fold one frame into the tracks and return its Face list.
+
+        `candidates[i]` is the match list for face i, or None when the face
+        was not encoded (it then inherits the identity of its track).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            stale = seq is not None and seq < self._last_seq
+            if not stale and seq is not None:
+                self._last_seq = seq
+            assigned = self._associate(locations)
+
+            faces = []
+            for di, box in enumerate(locations):
+                track = assigned.get(di)
+                if track is None and not stale:
+                    track = Track(self._next_id, box, now)
+                    self._next_id += 1
+                    self.tracks.append(track)
+                if candidates[di] is None:
+                    self.reused += 1
+                    faces.append(Face(box, track.candidates if track else [], track and track.track_id))
+                    continue
+                self.encoded += 1
+                if track is not None and not stale:
+                    track.candidates = candidates[di]
+                    track.identified_at = now
+                faces.append(Face(box, candidates[di], track and track.track_id))
+
+            if not stale:
+                seen = set()
+                for di, track in assigned.items():
+                    track.box = locations[di]
+                    track.last_seen = now
+                    track.missed = 0
+                    seen.add(track.track_id)
+                for face in faces:
+                    seen.add(face.track_id)
+                for track in self.tracks:
+                    if track.track_id not in seen:
+                        track.missed += 1
+                self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+            return faces
+
+
+class MotionGate:
+    """Cheap motion pre-filter deciding whether a frame is worth detecting.
+
+    Works on a small blurred grayscale copy of the frame: pixels differing
+    from a slowly updated background by more than `threshold` grey levels
+    count as moving, and if more than `min_area` (fraction of the frame)
+    moves, the detector is enabled for the next `hold` seconds. An idle
+    door therefore costs one tiny resize and diff per frame instead of a
+    HOG pass.
+    """
+
+    def __init__(self, threshold=None, min_area=None, hold=None, width=None):
+        self.threshold = MOTION_THRESHOLD if threshold is None else threshold
+        self.min_area = MOTION_MIN_AREA if min_area is None else min_area
+        self.hold = MOTION_HOLD_SECONDS if hold is None else hold
+        self.width = width or MOTION_WIDTH
+        self._background = None
+        self.active_until = 0.0
+        self.checked = 0
+        self.skipped = 0
+        self.last_motion = 0.0
+
+    def check(self, frame, now=None):
+        """Update the background with `frame`; True if detection should run."""
+        now = time.time() if now is None else now
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, h * self.width // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        self.checked += 1
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            self.active_until = now + self.hold
+            return True
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        self.last_motion = np.count_nonzero(diff > self.threshold) / float(diff.size)
+        cv2.accumulateWeighted(gray, self._background, MOTION_BG_ALPHA)
+
+        if self.last_motion >= self.min_area:
+            self.active_until = now + self.hold
+        if now <= self.active_until:
+            return True
+        self.skipped += 1
+        return False
+
+
+class AdaptiveController:
+    """Feedback loop choosing frame skip and detect scale for one camera.
+
+    Every ADAPT_EVERY processed frames it compares the smoothed detection
+    time with TARGET_FRAME_MS and adjusts the downscale factor: lower when
+    over budget, higher (more accurate) when there is clear headroom. The
+    scale never drops below detector min_face / MIN_FACE_SIZE, so the
+    smallest face we care about stays detectable. The frame skip follows worker
+    saturation: frames overwritten before a worker took them mean the
+    workers cannot keep up, so more frames are skipped; the skip comes
+    back down once the workers' share of CPU (`parallelism`) could carry
+    the extra frames, but never below what TARGET_FPS allows.
+    """
+
+    ADAPT_EVERY = 10
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.enabled = ADAPTIVE_ENABLED
+        self.skip = max(1, FRAME_SKIP)
+        self.min_scale = min(1.0, get_detector().min_face / float(MIN_FACE_SIZE))
+        self.steps = sorted({s for s in DETECT_SCALE_STEPS if s >= self.min_scale} | {self.min_scale},
+                            reverse=True)
+        self.scale = max(DETECT_SCALE, self.min_scale)
+        self.frame_ms = 0.0
+        # Detection workers available to this camera (set by the pipeline)
+        self.parallelism = 1.0
+        self._samples = 0
+        self._mark = (time.time(), 0, 0)    # time, captured, dropped
+
+    def observe(self, seconds):
+        ms = seconds * 1000.0
+        self.frame_ms = ms if not self.frame_ms else 0.8 * self.frame_ms + 0.2 * ms
+        self._samples += 1
+        if self.enabled and self._samples % self.ADAPT_EVERY == 0:
+            self._adapt()
+
+    def _step_scale(self, direction):
+        """Next scale step; direction -1 = smaller/faster, +1 = larger/more accurate."""
+        smaller = [s for s in self.steps if s < self.scale - 1e-6]
+        larger = [s for s in self.steps if s > self.scale + 1e-6]
+        if direction < 0:
+            return smaller[0] if smaller else self.scale
+        return larger[-1] if larger else self.scale
+
+    def _adapt(self):
+        old_scale, old_skip = self.scale, self.skip
+        now = time.time()
+        feed = self.feed
+        then, captured, dropped = self._mark
+        elapsed = max(now - then, 1e-6)
+        offered = (feed.captured - captured) / float(self.skip)
+        drop_ratio = (feed.frames.dropped - dropped) / offered if offered else 0.0
+        self._mark = (now, feed.captured, feed.frames.dropped)
+
+        # Resolution: keep detection time per frame within budget
+        if self.frame_ms > TARGET_FRAME_MS * 1.15:
+            self.scale = self._step_scale(-1)
+        elif self.frame_ms < TARGET_FRAME_MS * 0.6:
+            larger = self._step_scale(+1)
+            # Detector cost grows with pixel count (scale squared)
+            if self.frame_ms * (larger / self.scale) ** 2 < TARGET_FRAME_MS * 0.9:
+                self.scale = larger
+
+        # Frame skip: follow worker saturation and the FPS budget
+        capture_fps = (feed.captured - captured) / elapsed
+        floor = 1
+        if TARGET_FPS:
+            floor = max(1, int(np.ceil(capture_fps / TARGET_FPS)))
+        if drop_ratio > 0.2:
+            self.skip += 1
+        elif drop_ratio == 0.0 and self.skip > floor:
+            # Detection seconds needed per second if one frame fewer is skipped
+            load = capture_fps / (self.skip - 1) * self.frame_ms / 1000.0
+            if load < self.parallelism * 0.8:
+                self.skip -= 1
+        self.skip = max(floor, min(MAX_FRAME_SKIP, self.skip))
+
+        if (self.scale, self.skip) != (old_scale, old_skip):
+            print(f'[Adaptive] {feed.name}: scale {old_scale:.2f} -> {self.scale:.2f}, '
+                  f'skip {old_skip} -> {self.skip} (frame {self.frame_ms:.0f}ms, '
+                  f'target {TARGET_FRAME_MS}ms, drops {drop_ratio:.0%}, capture {capture_fps:.1f} fps)')
+
+
+# ------------------------------------------------------------
+# Face detectors
+# ------------------------------------------------------------
+
+def _upsampled(detect, image, upsample):
+    """Run `detect` on an image enlarged 2^upsample times; boxes in image pixels."""
+    if upsample <= 0:
+        return detect(image)
+    factor = 2 ** upsample
+    big = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_LINEAR)
+    return [(int(t / factor), int(r / factor), int(b / factor), int(l / factor))
+            for t, r, b, l in detect(big)]
+
+
+class HogDetector:
+    """dlib HOG (face_recognition's default). Accurate on frontal faces, CPU heavy."""
+
+    name = 'hog'
+
+    def __init__(self, upsample=None):
+        self.upsample = DETECTOR_UPSAMPLE if upsample is None else upsample
+        # dlib's 80px window, halved per upsample
+        self.min_face = HOG_MIN_FACE * 2 / 2 ** self.upsample
+
+    def detect(self, rgb):
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model='hog')
+
+
+class HaarDetector:
+    """OpenCV Haar cascade. Very fast, misses turned faces, more false boxes."""
+
+    name = 'haar'
+    WINDOW = 30
+
+    def __init__(self, upsample=None):
+        self.upsample = DETECTOR_UPSAMPLE if upsample is None else upsample
+        self.min_face = self.WINDOW / 2 ** self.upsample
+        if not hasattr(cv2, 'CascadeClassifier'):
+            # OpenCV 5 moved the cascades out of the main package
+            raise RuntimeError(f'OpenCV {cv2.__version__} has no Haar cascade support')
+        path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise RuntimeError(f'Cannot load Haar cascade {path}')
+
+    def _detect(self, rgb):
+        gray = cv2.equalizeHist(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+        boxes = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(self.WINDOW, self.WINDOW))
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in boxes]
+
+    def detect(self, rgb):
+        return _upsampled(self._detect, rgb, self.upsample)
+
+
+class YuNetDetector:
+    """OpenCV DNN YuNet (CPU). Fast and robust to pose; needs YUNET_MODEL."""
+
+    name = 'yunet'
+
+    def __init__(self, upsample=None, input_size=None, model=None):
+        self.upsample = DETECTOR_UPSAMPLE if upsample is None else upsample
+        self.input_size = DETECTOR_INPUT_SIZE if input_size is None else input_size
+        self.min_face = 12 / 2 ** self.upsample
+        model = model or YUNET_MODEL
+        if not os.path.exists(model):
+            raise RuntimeError(f'YuNet model {model} not found')
+        self.net = cv2.FaceDetectorYN.create(model, '', (320, 320), DETECTOR_CONFIDENCE)
+
+    def _detect(self, rgb):
+        bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        h, w = bgr.shape[:2]
+        factor = 1.0
+        if self.input_size and max(h, w) > self.input_size:
+            factor = self.input_size / float(max(h, w))
+            bgr = cv2.resize(bgr, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        self.net.setInputSize((bgr.shape[1], bgr.shape[0]))
+        _, faces = self.net.detect(bgr)
+        boxes = []
+        for x, y, fw, fh in (faces[:, :4] / factor if faces is not None else ()):
+            boxes.append((max(0, int(y)), min(w, int(x + fw)), min(h, int(y + fh)), max(0, int(x))))
+        return boxes
+
+    def detect(self, rgb):
+        return _upsampled(self._detect, rgb, self.upsample)
+
+
+class SsdDetector:
+    """OpenCV DNN res10 SSD (CPU). Fixed-size input, so cost hardly depends on
+    the frame size; needs SSD_CONFIG and SSD_MODEL."""
+
+    name = 'ssd'
+
+    def __init__(self, upsample=None, input_size=None, config=None, model=None):
+        self.upsample = DETECTOR_UPSAMPLE if upsample is None else upsample
+        self.input_size = (DETECTOR_INPUT_SIZE if input_size is None else input_size) or 300
+        self.min_face = 40 / 2 ** self.upsample
+        config, model = config or SSD_CONFIG, model or SSD_MODEL
+        for path in (config, model):
+            if not os.path.exists(path):
+                raise RuntimeError(f'SSD file {path} not found')
+        self.net = cv2.dnn.readNetFromCaffe(config, model)
+
+    def _detect(self, rgb):
+        h, w = rgb.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), 1.0,
+                                     (self.input_size, self.input_size), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        boxes = []
+        for _, _, score, x1, y1, x2, y2 in detections:
+            if score < DETECTOR_CONFIDENCE:
+                continue
+            boxes.append((max(0, int(y1 * h)), min(w, int(x2 * w)), min(h, int(y2 * h)), max(0, int(x1 * w))))
+        return boxes
+
+    def detect(self, rgb):
+        return _upsampled(self._detect, rgb, self.upsample)
+
+
+DETECTOR_BACKENDS = {
+    'hog': HogDetector,
+    'haar': HaarDetector,
+    'yunet': YuNetDetector,
+    'ssd': SsdDetector,
+}
+
+_detectors = threading.local()
+
+
+def build_detector(backend=None, **options):
+    """Create a face detector: detect(rgb) -> [(top, right, bottom, left)].
+
+    Every detector also has `min_face`, the smallest face (input pixels) it
+    finds, which bounds how far the adaptive controller may downscale.
+    Boxes of every backend are encoded by face_recognition's landmark
+    model, so the gallery does not depend on the detector.
+    """
+    backend = backend or DETECTOR_BACKEND
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f'Unknown detector backend {backend!r}, expected one of {sorted(DETECTOR_BACKENDS)}')
+    return DETECTOR_BACKENDS[backend](**options)
+
+
+def get_detector():
+    """The configured detector of the calling thread.
+
+    DNN nets are not safe to share between threads, so every detection
+    thread (and worker process) builds its own on first use.
+    """
+    detector = getattr(_detectors, 'detector', None)
+    if detector is None or detector.name != DETECTOR_BACKEND:
+        detector = _detectors.detector = build_detector()
+    return detector
+
+
+def read_sample_frames(path, every=1, limit=200):
+    """Frames for calibration from a video file or an image sequence pattern
+    (e.g. 'shots/img_%03d.jpg'), taking every Nth frame."""
+    cap = cv2.VideoCapture(path)
+    frames = []
+    index = 0
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % every == 0:
+            frames.append(frame)
+        index += 1
+    cap.release()
+    return frames
+
+
+def calibrate_detectors(frames, scale=None, reference=('hog', 1), upsamples=(0, 1)):
+    """Speed and recall of every detector backend on sample footage.
+
+    Without labelled boxes, recall is measured against a slow reference
+    run (HOG, upsample 1, full resolution): a reference face counts as
+    found when a box overlaps it with IoU >= TRACK_IOU. Extra boxes the
+    reference did not see are reported too - false positives or faces it
+    missed. Prints a table and a recommendation, returns the rows.
+    """
+    scale = scale or DETECT_SCALE
+    if not frames:
+        print('[Calibrate] No frames to calibrate on.')
+        return []
+    ref_detector = build_detector(reference[0], upsample=reference[1])
+    truth = [ref_detector.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in frames]
+    total = sum(len(boxes) for boxes in truth)
+    print(f'[Calibrate] {len(frames)} frames, {total} reference faces '
+          f'({reference[0]} upsample={reference[1]} at full size), detect scale {scale}')
+
+    rows = []
+    for backend in DETECTOR_BACKENDS:
+        for upsample in upsamples:
+            try:
+                detector = build_detector(backend, upsample=upsample)
+            except RuntimeError as e:
+                print(f'[Calibrate]   {backend:<6} skipped: {e}')
+                break
+            found = extra = 0
+            timings = []
+            for frame, expected in zip(frames, truth):
+                small = cv2.resize(frame, (0, 0), fx=scale, fy=scale) if scale != 1.0 else frame
+                rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+                started = time.perf_counter()
+                boxes = detector.detect(rgb)
+                timings.append(time.perf_counter() - started)
+                boxes = [(int(t / scale), int(r / scale), int(b / scale), int(l / scale))
+                         for t, r, b, l in boxes]
+                hits = sum(1 for box in expected if any(box_iou(box, got) >= TRACK_IOU for got in boxes))
+                found += hits
+                extra += max(0, len(boxes) - hits)
+            row = {
+                'backend': backend,
+                'upsample': upsample,
+                'ms_per_frame': float(np.median(timings) * 1000.0),
+                'recall': found / total if total else None,
+                'extra_boxes': extra,
+            }
+            rows.append(row)
+            recall = f'{row["recall"]:.3f}' if row['recall'] is not None else '  n/a'
+            print(f'[Calibrate]   {backend:<6} upsample={upsample}  {row["ms_per_frame"]:8.1f} ms/frame  '
+                  f'recall={recall}  extra boxes={extra}')
+
+    good = [r for r in rows if r['recall'] is not None and r['recall'] >= CALIBRATION_MIN_RECALL]
+    if good:
+        best = min(good, key=lambda r: r['ms_per_frame'])
+        print(f'[Calibrate] Fastest with recall >= {CALIBRATION_MIN_RECALL}: '
+              f"DETECTOR_BACKEND = '{best['backend']}', DETECTOR_UPSAMPLE = {best['upsample']}")
+    elif total:
+        print(f'[Calibrate] No backend reached recall {CALIBRATION_MIN_RECALL} at scale {scale}; '
+              f'try a larger scale.')
+    return rows
+
+
+class RegionOfInterest:
+    """The part of a camera image where faces count - the door, not the
+    corridor, reception desk or window next to it.
+
+    A polygon in frame pixels, or in fractions (0-1) of the frame size when
+    every coordinate is at most 1. The detector only sees the polygon's
+    bounding box, and faces whose centre lies outside the polygon are
+    dropped before encoding. Small enough to send to worker processes.
+    """
+
+    def __init__(self, points):
+        self.points = [(float(x), float(y)) for x, y in points]
+        if len(self.points) < 3:
+            raise ValueError('A region of interest needs at least 3 points')
+        self.relative = all(0.0 <= v <= 1.0 for point in self.points for v in point)
+        self._shape = None
+        self._polygon = None
+        self.box = None
+
+    def _resolve(self, shape):
+        if shape[:2] == self._shape:
+            return
+        h, w = shape[:2]
+        sx, sy = (w, h) if self.relative else (1.0, 1.0)
+        polygon = np.array([(x * sx, y * sy) for x, y in self.points], dtype=np.float32)
+        x0, y0 = np.floor(polygon.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(polygon.max(axis=0)).astype(int)
+        box = (max(0, int(x0)), max(0, int(y0)), min(w, int(x1)), min(h, int(y1)))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            raise ValueError(f'Region of interest {self.points} lies outside the {w}x{h} frame')
+        self._polygon, self.box = polygon.reshape(-1, 1, 2), box
+        self._shape = shape[:2]
+
+    def crop(self, frame):
+        """The bounding box of the region as a view: (crop, (x, y) origin)."""
+        self._resolve(frame.shape)
+        x0, y0, x1, y1 = self.box
+        return frame[y0:y1, x0:x1], (x0, y0)
+
+    def contains(self, location):
+        """Whether a (top, right, bottom, left) box's centre is inside the polygon."""
+        top, right, bottom, left = location
+        centre = ((left + right) / 2.0, (top + bottom) / 2.0)
+        return cv2.pointPolygonTest(self._polygon, centre, False) >= 0
+
+    def saved_fraction(self, shape):
+        """Share of the frame's pixels the detector no longer looks at."""
+        self._resolve(shape)
+        x0, y0, x1, y1 = self.box
+        return 1.0 - (x1 - x0) * (y1 - y0) / float(shape[0] * shape[1])
+
+    def draw(self, frame):
+        self._resolve(frame.shape)
+        cv2.polylines(frame, [self._polygon.astype(np.int32)], True, (255, 200, 0), 1)
+
+
+def _parse_points(value):
+    """Points from config: a list of [x, y], JSON text of one, or 'x,y x,y'."""
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith('['):
+            return json.loads(text)
+        return [point.split(',') for point in text.split()]
+    return value
+
+
+def parse_roi(value):
+    """Region of interest from config (see _parse_points) - None when empty."""
+    return RegionOfInterest(_parse_points(value)) if value else None
+
+
+class DoorLine:
+    """Virtual line across the door that turns face tracks into passages.
+
+    The line runs from its first to its second point (pixels, or 0-1
+    fractions of the frame size). Looking from the first point towards the
+    second, a face moving from the right-hand side to the left-hand side
+    is an entry, the other way an exit - swap the points to flip. Faces
+    within DOOR_LINE_MARGIN of the line count as on neither side, so
+    jitter on the line is not a passage.
+
+    Every track produces one event per crossing, once it is matched to an
+    employee (for up to LINE_PENDING_SECONDS after crossing). Tracks must
+    survive between processed frames, so keep the frame skip low enough
+    that a walking face still overlaps itself (TRACK_IOU).
+    """
+
+    def __init__(self, points, margin=None):
+        self.points = [(float(x), float(y)) for x, y in points]
+        if len(self.points) != 2:
+            raise ValueError('A door line needs exactly 2 points')
+        self.relative = all(0.0 <= v <= 1.0 for point in self.points for v in point)
+        self.margin = DOOR_LINE_MARGIN if margin is None else margin
+        self._shape = None
+        self._tracks = {}       # track_id -> [side, pending direction, crossed at, last seen]
+        self.entries = 0
+        self.exits = 0
+        self.unidentified = 0
+
+    def _resolve(self, shape):
+        if shape[:2] == self._shape:
+            return
+        h, w = shape[:2]
+        sx, sy = (w, h) if self.relative else (1.0, 1.0)
+        (ax, ay), (bx, by) = [(x * sx, y * sy) for x, y in self.points]
+        length = float(np.hypot(bx - ax, by - ay))
+        if not length:
+            raise ValueError('The door line points must differ')
+        self._a = (ax, ay)
+        self._direction = ((bx - ax) / length, (by - ay) / length)
+        self._margin_px = self.margin * float(np.hypot(w, h))
+        self._shape = shape[:2]
+
+    def side(self, location):
+        """+1 right of the line, -1 left of it, 0 on it (within the margin)."""
+        top, right, bottom, left = location
+        dx = (left + right) / 2.0 - self._a[0]
+        dy = (top + bottom) / 2.0 - self._a[1]
+        # Image y points down, so a positive cross product is the right-hand side
+        distance = self._direction[0] * dy - self._direction[1] * dx
+        if abs(distance) < self._margin_px:
+            return 0
+        return 1 if distance > 0 else -1
+
+    def update(self, faces, shape, now=None):
+        """Fold one processed frame in; returns [(face, best match, direction)]
+        for every recognised crossing."""
+        now = time.time() if now is None else now
+        self._resolve(shape)
+        events = []
+        for face in faces:
+            if face.track_id is None:
+                continue
+            state = self._tracks.setdefault(face.track_id, [0, None, 0.0, now])
+            state[3] = now
+            side = self.side(face.location)
+            if side and state[0] and side != state[0]:
+                state[1], state[2] = ('entry' if state[0] > 0 else 'exit'), now
+            if side:
+                state[0] = side
+            best = face.candidates[0] if face.candidates else None
+            if state[1] and best is not None and best.distance <= CONFIDENCE_THRESHOLD:
+                events.append((face, best, state[1]))
+                if state[1] == 'entry':
+                    self.entries += 1
+                else:
+                    self.exits += 1
+                state[1] = None
+
+        for track_id, state in list(self._tracks.items()):
+            if state[1] and now - state[2] > LINE_PENDING_SECONDS:
+                self.unidentified += 1
+                state[1] = None
+            if now - state[3] > LINE_PENDING_SECONDS:
+                del self._tracks[track_id]
+        return events
+
+    def draw(self, frame):
+        self._resolve(frame.shape)
+        (ax, ay), (ux, uy) = self._a, self._direction
+        h, w = frame.shape[:2]
+        sx, sy = (w, h) if self.relative else (1.0, 1.0)
+        (bx, by) = self.points[1][0] * sx, self.points[1][1] * sy
+        cv2.line(frame, (int(ax), int(ay)), (int(bx), int(by)), (0, 200, 255), 2)
+        # Mark the inside (left-hand side): where entries go
+        mx, my = (ax + bx) / 2.0 + uy * 20, (ay + by) / 2.0 - ux * 20
+        cv2.putText(frame, 'IN', (int(mx), int(my)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 200, 255), 2)
+
+
+def parse_door_line(value):
+    """Door line from config (see _parse_points) - None when empty."""
+    return DoorLine(_parse_points(value)) if value else None
+
+
+def detect_and_encode(frame, skip_boxes=None, scale=None, timings=None, roi=None):
+    """Find and encode faces in one BGR frame.
+
+    The frame is resized by `scale` (default DETECT_SCALE) before
+    detection. Returns (locations, encodings) with locations in full-frame
+    pixels. Faces overlapping one
+    of `skip_boxes` (already identified tracks) are not encoded; their
+    encoding is None. With a `roi` (RegionOfInterest) only its bounding
+    box is searched and faces outside it are dropped. This is the
+    CPU-heavy part and is what worker processes run.
+
+    A `timings` dict receives the seconds spent in 'resize', 'detect' and
+    'encode'.
+    """
+    scale = scale or DETECT_SCALE
+    started = time.perf_counter()
+    origin_x = origin_y = 0
+    if roi is not None:
+        frame, (origin_x, origin_y) = roi.crop(frame)
+    # Resize for faster processing
+    small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale) if scale != 1.0 else frame
+    rgb_small = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+    resized = time.perf_counter()
+
+    face_locations = get_detector().detect(rgb_small)
+    detected = time.perf_counter()
+
+    # Scale back up to full-frame coordinates
+    locations = [(int(top / scale) + origin_y, int(right / scale) + origin_x,
+                  int(bottom / scale) + origin_y, int(left / scale) + origin_x)
+                 for (top, right, bottom, left) in face_locations]
+    if roi is not None:
+        inside = [i for i, box in enumerate(locations) if roi.contains(box)]
+        locations = [locations[i] for i in inside]
+        face_locations = [face_locations[i] for i in inside]
+
+    todo = [
+        i for i, box in enumerate(locations)
+        if not any(box_iou(box, known) >= TRACK_IOU for known in (skip_boxes or ()))
+    ]
+    encodings = [None] * len(locations)
+    if todo:
+        computed = face_recognition.face_encodings(rgb_small, [face_locations[i] for i in todo])
+        for i, encoding in zip(todo, computed):
+            encodings[i] = encoding
+    if timings is not None:
+        timings['resize'] = resized - started
+        timings['detect'] = detected - resized
+        timings['encode'] = time.perf_counter() - detected
+    return locations, encodings
+
+
+def identify_faces(locations, encodings, matcher, tracker=None, seq=None, now=None):
+    """Match the encoded faces of one frame at once and apply tracking.
+
+    `now` is the frame's time (default: the wall clock)."""
+    todo = [i for i, encoding in enumerate(encodings) if encoding is not None]
+    candidates = [None] * len(locations)
+    for i, found in zip(todo, matcher.match([encodings[i] for i in todo]) if todo else []):
+        candidates[i] = found
+    if tracker is None:
+        return [Face(location, found or []) for location, found in zip(locations, candidates)]
+    return tracker.update(seq, locations, candidates, now)
+
+
+def process_frame(frame, matcher, tracker=None, seq=None, scale=None, timings=None, roi=None, now=None):
+    """Detect, encode and match every face in one BGR frame.
+
+    `timings` (a dict) gets 'resize', 'detect', 'encode' and 'match' seconds.
+    `now` is the frame's time for the tracker (default: the wall clock).
+    """
+    skip_boxes = tracker.settled_boxes(now) if tracker else None
+    locations, encodings = detect_and_encode(frame, skip_boxes, scale, timings, roi)
+    started = time.perf_counter()
+    faces = identify_faces(locations, encodings, matcher, tracker, seq, now)
+    if timings is not None:
+        timings['match'] = time.perf_counter() - started
+    return faces
+
+
+def _encoder_process(task_q, result_q, settings=None, current=None, number=0):
+    """Worker process body: encode frames found in shared memory.
+
+    Tasks are (index, shm_name, offset, shape, skip_boxes, scale, roi); only
+    these few values are pickled, the pixels are read straight from the
+    shared block. `current[number]` holds the index being worked on, so the
+    pool knows which frame was lost if this process dies.
+    """
+    if settings:
+        apply_settings(settings)
+    blocks = {}
+    while True:
+        task = task_q.get()
+        if task is None:
+            break
+        index, shm_name, offset, shape, skip_boxes, scale, roi = task
+        if current is not None:
+            current[number] = index
+        if shm_name not in blocks:
+            # Tasks arrive in order: once the pool has grown its block the
+            # older one is never used again
+            for block in blocks.values():
+                block.close()
+            blocks = {shm_name: shared_memory.SharedMemory(name=shm_name)}
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=blocks[shm_name].buf, offset=offset)
+        started = time.perf_counter()
+        timings = {}
+        try:
+            locations, encodings = detect_and_encode(frame, skip_boxes, scale, timings, roi)
+            error = None
+        except Exception as e:
+            locations, encodings, error = [], [], str(e)
+        del frame
+        encoded = [i for i, encoding in enumerate(encodings) if encoding is not None]
+        packed = np.asarray([encodings[i] for i in encoded], dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        result_q.put((
+            index, locations, encoded, packed,
+            time.perf_counter() - started, timings, os.getpid(), error,
+        ))
+        if current is not None:
+            current[number] = -1
+    for block in blocks.values():
+        block.close()
+
+
+class EncoderProcessPool:
+    """Detection + encoding on N worker processes, one per CPU core.
+
+    Frames are copied into slots of one shared-memory block instead of
+    being pickled through a pipe. The block is sized by the largest frame
+    seen so far and replaced by a bigger one when a larger camera frame
+    arrives (the old block is freed once its frames are done). Results
+    come back in submission order (a small reorder buffer holds early
+    finishers), so downstream routing sees frames in the order they were
+    captured.
+
+    A worker that dies (segfault, OOM killer) is restarted and the frame it
+    held is dropped; a frame that takes longer than WORKER_TASK_TIMEOUT is
+    dropped as well, so one lost frame never stalls the ones behind it. Its
+    slot stays taken until the worker returns or is restarted, as the
+    worker may still be reading it.
+
+    submit() (dispatch thread) and results() (collect thread) share the
+    bookkeeping below under one lock.
+    """
+
+    def __init__(self, workers, slots_per_worker=2):
+        self.workers = workers
+        self.n_slots = workers * slots_per_worker
+        self._ctx = multiprocessing.get_context()
+        self._task_q = self._ctx.Queue()
+        self._result_q = self._ctx.Queue()
+        self._free_slots = queue.Queue()
+        for slot in range(self.n_slots):
+            self._free_slots.put(slot)
+        self._shm = None
+        self._slot_bytes = 0
+        self._retired = {}      # name -> replaced block, kept while frames in it are in flight
+
+        self._next_submit = 0
+        self._next_release = 0
+        self._inflight = {}     # index -> (slot, payload, submitted at, block name)
+        self._finished = {}     # index -> result tuple (None if lost), waiting for earlier frames
+        self._abandoned = set() # indexes given up on whose slot a worker may still read
+        self._lock = threading.Lock()
+        self._current = self._ctx.Array('q', [-1] * workers, lock=False)    # worker -> index
+
+        self.oversize = 0
+        self.errors = 0
+        self.lost = 0
+        self.restarts = 0
+        self.per_worker = {}    # pid -> [frames, seconds]
+        if os.name == 'posix':
+            # Workers must share our resource tracker; otherwise each one
+            # would try to clean up the shared block it merely attached to.
+            resource_tracker.ensure_running()
+        self._settings = current_settings()
+        self._procs = [self._start_worker(i) for i in range(workers)]
+
+    def _start_worker(self, number):
+        proc = self._ctx.Process(target=_encoder_process,
+                                 args=(self._task_q, self._result_q, self._settings, self._current, number),
+                                 name=f'encoder-{number}', daemon=True)
+        proc.start()
+        return proc
+
+    def acquire_slot(self, timeout=None):
+        """Wait for a free frame slot; None if all are busy until timeout."""
+        try:
+            return self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release_slot(self, slot):
+        self._free_slots.put(slot)
+
+    def submit(self, slot, frame, payload, skip_boxes=None, scale=None, roi=None):
+        """Copy a frame into `slot` and hand it to the workers.
+
+        `payload` is returned untouched with the result. Returns False (and
+        frees the slot) when no shared block large enough for the frame can
+        be allocated.
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        with self._lock:
+            if frame.nbytes > self._slot_bytes:
+                try:
+                    self._grow(frame.nbytes)
+                except OSError as e:
+                    self.oversize += 1
+                    self.release_slot(slot)
+                    print(f'[Workers] No shared memory for a {frame.shape[1]}x{frame.shape[0]} frame: {e}')
+                    return False
+
+            offset = slot * self._slot_bytes
+            view = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf, offset=offset)
+            view[...] = frame
+            del view
+
+            index = self._next_submit
+            self._next_submit += 1
+            self._inflight[index] = (slot, payload, time.monotonic(), self._shm.name)
+            self._task_q.put((index, self._shm.name, offset, frame.shape, skip_boxes, scale, roi))
+            return True
+
+    def results(self, timeout=0.5):
+        """Collect finished frames in order.
+
+        Returns [(payload, locations, encodings, seconds, timings)], seconds
+        being the worker's detection time for that frame and timings its
+        per-stage split (see detect_and_encode).
+        """
+        try:
+            item = self._result_q.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+        items = []
+        while item is not None:
+            items.append(item)
+            try:
+                item = self._result_q.get_nowait()
+            except queue.Empty:
+                item = None
+        with self._lock:
+            return self._collect(items)
+
+    def _collect(self, items):
+        for index, locations, encoded, packed, seconds, timings, pid, error in items:
+            if index in self._abandoned:
+                # Late result of a frame given up on: only its slot is still needed
+                self._abandoned.discard(index)
+                self.release_slot(self._inflight.pop(index)[0])
+                continue
+            if index not in self._inflight:
+                continue    # Released when its worker was restarted
+            encodings = [None] * len(locations)
+            for i, encoding in zip(encoded, packed):
+                encodings[i] = encoding
+            slot, payload, _submitted, _block = self._inflight.pop(index)
+            self.release_slot(slot)
+            stats = self.per_worker.setdefault(pid, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            if error:
+                self.errors += 1
+                print(f'[Workers] Encoding failed in pid {pid}: {error}')
+            self._finished[index] = (payload, locations, encodings, seconds, timings)
+
+        self._check_workers()
+        self._free_retired()
+        ready = []
+        while self._next_release in self._finished:
+            result = self._finished.pop(self._next_release)
+            if result is not None:
+                ready.append(result)
+            self._next_release += 1
+        return ready
+
+    def _grow(self, slot_bytes):
+        """Replace the shared block by one whose slots hold `slot_bytes`."""
+        shm = shared_memory.SharedMemory(create=True, size=slot_bytes * self.n_slots)
+        if self._shm is not None:
+            self._retired[self._shm.name] = self._shm
+            print(f'[Workers] Frame slots grown to {slot_bytes // 1024} KB for a larger camera.')
+        self._shm = shm
+        self._slot_bytes = slot_bytes
+
+    def _free_retired(self):
+        if not self._retired:
+            return
+        busy = {entry[3] for entry in self._inflight.values()}
+        for name in [name for name in self._retired if name not in busy]:
+            block = self._retired.pop(name)
+            block.close()
+            block.unlink()
+
+    def _drop(self, index, reason):
+        """Give up on a frame; its slot is freed now only if no worker can
+        still be reading it."""
+        self.lost += 1
+        print(f'[Workers] Frame {index} dropped: {reason}')
+        self._finished[index] = None
+        self._abandoned.add(index)
+
+    def _release_abandoned(self):
+        busy = set(self._current)
+        for index in [index for index in self._abandoned if index not in busy]:
+            self._abandoned.discard(index)
+            self.release_slot(self._inflight.pop(index)[0])
+
+    def _check_workers(self):
+        """Restart dead workers and give up on frames that will not return."""
+        restarted = False
+        for number, proc in enumerate(self._procs):
+            if proc.is_alive():
+                continue
+            index = self._current[number]
+            self._current[number] = -1
+            if index in self._inflight and index not in self._abandoned:
+                self._drop(index, f'worker pid {proc.pid} died (exit code {proc.exitcode})')
+            else:
+                print(f'[Workers] Worker pid {proc.pid} died (exit code {proc.exitcode})')
+            self.restarts += 1
+            restarted = True
+            self._procs[number] = self._start_worker(number)
+        if restarted:
+            # Frames given up on that no live worker holds will never return
+            self._release_abandoned()
+        # A worker can die between taking a task and recording it, or hang;
+        # the oldest frame would then block every later one forever.
+        head = self._inflight.get(self._next_release)
+        if head is not None and self._next_release not in self._abandoned \
+                and time.monotonic() - head[2] > WORKER_TASK_TIMEOUT:
+            self._drop(self._next_release, f'no result after {WORKER_TASK_TIMEOUT:.0f}s')
+
+    def report(self):
+        lines = []
+        for i, (pid, (frames, seconds)) in enumerate(sorted(self.per_worker.items())):
+            avg = seconds / frames * 1000.0 if frames else 0.0
+            lines.append(f'[Workers]   #{i} pid={pid} frames={frames} avg={avg:.1f}ms')
+        return lines
+
+    def close(self):
+        for _ in self._procs:
+            self._task_q.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for block in [self._shm, *self._retired.values()]:
+            if block is not None:
+                block.close()
+                block.unlink()
+        self._shm = None
+        self._retired = {}
+
+
+def is_stream_source(source):
+    """True for network streams (rtsp://, http://, ...) as opposed to USB or files."""
+    return isinstance(source, str) and '://' in source
+
+
+def open_capture(source):
+    """Open a camera with low-latency settings.
+
+    Network streams go through FFmpeg with buffering disabled, the chosen
+    RTSP transport and open/read timeouts, so a dead camera fails a read
+    instead of hanging the capture thread. Every source asks OpenCV to keep
+    at most CAPTURE_BUFFER_SIZE frames (not every backend honours it; the
+    capture thread reading continuously keeps the buffer drained anyway).
+    """
+    if is_stream_source(source):
+        # Read by OpenCV when the FFmpeg backend opens a stream
+        os.environ.setdefault(
+            'OPENCV_FFMPEG_CAPTURE_OPTIONS',
+            f'rtsp_transport;{RTSP_TRANSPORT}|fflags;nobuffer|flags;low_delay|max_delay;500000',
+        )
+        params = []
+        for prop, value in (('CAP_PROP_OPEN_TIMEOUT_MSEC', CAPTURE_TIMEOUT_MS),
+                            ('CAP_PROP_READ_TIMEOUT_MSEC', CAPTURE_TIMEOUT_MS)):
+            if hasattr(cv2, prop):  # OpenCV 4.6+
+                params += [getattr(cv2, prop), value]
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params) if params \
+            else cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+    else:
+        cap = cv2.VideoCapture(source)
+    if cap.isOpened():
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, CAPTURE_BUFFER_SIZE)
+    return cap
+
+
+class CameraFeed:
+    """One camera stream: capture handle, newest-frame slots and activity.
+
+    Cameras other than video files reconnect on their own when the stream
+    drops (see reconnect()).
+    """
+
+    def __init__(self, name, source, cond=None, roi=None, door_line=None):
+        self.name = name
+        self.source = source
+        self.roi = roi                          # RegionOfInterest or None (whole frame)
+        self.door_line = door_line              # DoorLine in 'line' event mode, else None
+        self.roi_saved = 0.0                    # Share of frame pixels the ROI keeps from the detector
+        self.frame_pixels = 0
+        self.reconnectable = not (isinstance(source, str) and os.path.isfile(source))
+        self.cap = None
+        self.frames = LatestFrameSlot(cond)    # capture -> workers (via scheduler)
+        self.preview = LatestFrameSlot()       # capture -> display
+        self.captured = 0
+        self.processed = 0
+        self.alive = False
+        # Set by detection_mode when someone looks at every frame (window);
+        # otherwise only frames that go to detection are decoded.
+        self.decode_all = True
+        self.reconnects = 0
+        self.read_failures = 0
+        # How far the newest frame lags behind real time (stream clock vs
+        # wall clock, smoothed); 0 for sources without timestamps
+        self.frame_age = 0.0
+        self._clock = None
+        # Decaying count of faces seen recently; busy doors get more turns
+        self.activity = 0.0
+        self.pass_value = 0.0
+        self.last_faces = []
+        self.tracker = FaceTracker() if TRACKING_ENABLED else None
+        self.motion = MotionGate() if MOTION_GATE_ENABLED else None
+        self.controller = AdaptiveController(self)
+
+    def open(self):
+        self.cap = open_capture(self.source)
+        self.alive = self.cap.isOpened()
+        self._clock = None
+        return self.alive
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+    def read(self, decode=True):
+        """Grab the next frame; decode it only if `decode` (or decode_all).
+
+        Returns (ok, frame) where frame is None for grabbed-only frames.
+        Skipped frames are still grabbed so the stream never backs up.
+        """
+        if not self.cap.grab():
+            return False, None
+        self._track_age()
+        if not (decode or self.decode_all):
+            return True, None
+        return self.cap.retrieve()
+
+    def _track_age(self):
+        stream_ms = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if not stream_ms or stream_ms < 0:
+            return
+        now = time.time()
+        if self._clock is None:
+            self._clock = now - stream_ms / 1000.0
+            return
+        # The earliest frame sets the reference; lag is how far later than
+        # its stream time a frame reaches us
+        lag = now - stream_ms / 1000.0 - self._clock
+        if lag < 0:
+            self._clock += lag
+            lag = 0.0
+        self.frame_age = 0.9 * self.frame_age + 0.1 * lag
+
+    def reconnect(self, stop_event):
+        """Reopen a dropped stream, backing off up to RECONNECT_MAX_SECONDS.
+
+        Returns False if stop_event was set before the camera came back.
+        """
+        self.release()
+        delay = RECONNECT_MIN_SECONDS
+        while not stop_event.wait(delay):
+            print(f'[Camera] {self.name}: reconnecting...')
+            if self.open():
+                self.reconnects += 1
+                print(f'[Camera] {self.name}: reconnected ({self.reconnects} reconnects so far).')
+                return True
+            self.release()
+            delay = min(RECONNECT_MAX_SECONDS, delay * 2)
+            print(f'[Camera] {self.name}: still down, next attempt in {delay:.1f}s.')
+        return False
+
+
+class FairScheduler:
+    """Decides which camera's newest frame the next free worker gets.
+
+    Stride scheduling: every camera with a pending frame competes, the one
+    with the lowest pass value wins and then advances by 1 / weight. The
+    weight grows with recent face activity, so a busy door is served more
+    often while an idle corridor still gets a guaranteed minimum share.
+    """
+
+    def __init__(self, feeds, cond):
+        self.feeds = feeds
+        self._cond = cond
+        self._virtual_time = 0.0
+
+    def weight(self, feed):
+        return 1.0 + SCHEDULER_ACTIVITY_WEIGHT * feed.activity
+
+    def get(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while True:
+                pending = [f for f in self.feeds if f.frames.qsize()]
+                if pending:
+                    break
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            for feed in pending:
+                # A camera coming back from idle starts at the current
+                # virtual time instead of cashing in all its missed turns.
+                feed.pass_value = max(feed.pass_value, self._virtual_time)
+            feed = min(pending, key=lambda f: f.pass_value)
+            self._virtual_time = feed.pass_value
+            feed.pass_value += 1.0 / self.weight(feed)
+            return feed.frames.take_nowait()
+
+    def record(self, feed, faces):
+        feed.activity = feed.activity * SCHEDULER_ACTIVITY_DECAY + len(faces)
+
+
+class DetectionPipeline:
+    """Runs capture, detection and publishing on separate threads.
+
+    Each stage hands over through a bounded queue, so a slow Odoo response
+    or a heavy frame never stalls capture, and end-to-end latency stays
+    bounded: when a stage falls behind, the oldest work is dropped and
+    counted rather than queued up.
+
+    Any number of cameras can feed one pipeline; they share the gallery,
+    the Odoo session and the detection workers.
+    """
+
+    def __init__(self, feeds, matcher, uploader, workers=None, pool=None):
+        self.feeds = feeds
+        self.matcher = matcher
+        self.uploader = uploader
+        self.workers = max(1, DETECT_WORKERS if workers is None else workers)
+        # With a process pool, detection runs in other processes and the
+        # thread workers are replaced by a dispatch and a collect thread.
+        self.pool = pool
+
+        self.stop_event = threading.Event()
+        self.scheduler = FairScheduler(feeds, feeds[0].frames._cond)
+        self.results = DroppingQueue(RESULT_QUEUE_SIZE)
+        self.publish = DroppingQueue(PUBLISH_QUEUE_SIZE)
+
+        # Cooldown tracking: {(camera_name, employee_id, direction): last_logged_time}
+        self.cooldowns = {}
+        self._cooldown_lock = threading.Lock()
+
+        self.processed = 0
+        self.published = 0
+        self.failed = 0
+        self._latency_total = 0.0
+        self._busy_seconds = 0.0
+        self._started_at = None
+        self._stats_lock = threading.Lock()
+        self._threads = []
+
+    @property
+    def captured(self):
+        return sum(feed.captured for feed in self.feeds)
+
+    # -- stages ------------------------------------------------
+
+    def _capture_loop(self, feed):
+        seq = 0
+        if not feed.alive and not feed.reconnect(self.stop_event):
+            return
+        while not self.stop_event.is_set():
+            # Only process every Nth frame for performance; the others are
+            # grabbed but not decoded unless a window shows them
+            wanted = (seq + 1) % feed.controller.skip == 0
+            started = time.perf_counter()
+            ret, frame = feed.read(decode=wanted)
+            if not ret:
+                print(f'[Camera] {feed.name}: Failed to read frame.')
+                feed.read_failures += 1
+                feed.alive = False
+                if feed.reconnectable and feed.reconnect(self.stop_event):
+                    continue
+                if not any(f.alive or f.reconnectable for f in self.feeds):
+                    self.stop_event.set()
+                break
+            seq += 1
+            feed.captured = seq
+            now = time.time()
+            METRICS.inc('frames', camera=feed.name, outcome='captured')
+            if not wanted:
+                METRICS.inc('frames', camera=feed.name, outcome='skipped')
+            if frame is None:
+                continue
+            # Includes waiting for the camera to deliver the frame
+            METRICS.observe('capture', time.perf_counter() - started, feed.name)
+            feed.preview.put(frame)
+            if not wanted:
+                continue
+            if feed.roi is not None and not feed.frame_pixels:
+                try:
+                    feed.roi_saved = feed.roi.saved_fraction(frame.shape)
+                    print(f'[ROI] {feed.name}: detecting in {feed.roi.box}, '
+                          f'{feed.roi_saved * 100:.0f}% of each frame skipped.')
+                except ValueError as e:
+                    print(f'[ROI] {feed.name}: {e} - using the whole frame.')
+                    feed.roi = None
+                feed.frame_pixels = frame.shape[0] * frame.shape[1]
+            # Skip the detector while nothing moves (in the ROI) and nobody is in view
+            motion_frame = feed.roi.crop(frame)[0] if feed.roi is not None else frame
+            if feed.motion is not None and not feed.motion.check(motion_frame, now) \
+                    and not (feed.tracker and feed.tracker.tracks):
+                feed.last_faces = []
+                METRICS.inc('frames', camera=feed.name, outcome='idle')
+                continue
+            feed.frames.put(FrameTask(feed, seq, frame, now, feed.controller.scale))
+
+    def _worker_loop(self):
+        while not self.stop_event.is_set():
+            task = self.scheduler.get(timeout=0.5)
+            if task is None:
+                continue
+            feed = task.camera
+            timings = {}
+            started = time.perf_counter()
+            faces = process_frame(task.frame, self.matcher, feed.tracker, task.seq, task.scale, timings,
+                                  feed.roi)
+            seconds = time.perf_counter() - started
+            with self._stats_lock:
+                self._busy_seconds += seconds
+            self._finish(task, faces, seconds, timings)
+
+    def _finish(self, task, faces, seconds, timings=None):
+        done = time.time()
+        METRICS.observe_all(timings or {}, task.camera.name)
+        METRICS.inc('frames', camera=task.camera.name, outcome='processed')
+        self.scheduler.record(task.camera, faces)
+        task.camera.controller.observe(seconds)
+        with self._stats_lock:
+            self.processed += 1
+            task.camera.processed += 1
+            self._latency_total += done - task.captured_at
+        self.results.put_latest(FrameResult(task.camera, task.seq, task.frame, faces, task.captured_at, done))
+
+    def _dispatch_loop(self):
+        while not self.stop_event.is_set():
+            slot = self.pool.acquire_slot(timeout=0.5)
+            if slot is None:
+                continue
+            # Take the newest frame only once a slot is free, so nothing
+            # waits in line while all workers are busy.
+            task = None
+            while task is None and not self.stop_event.is_set():
+                task = self.scheduler.get(timeout=0.5)
+            if task is None:
+                self.pool.release_slot(slot)
+                break
+            tracker = task.camera.tracker
+            if not self.pool.submit(slot, task.frame, task, tracker.settled_boxes() if tracker else None,
+                                    task.scale, task.camera.roi):
+                METRICS.inc('frames', camera=task.camera.name, outcome='dropped')
+
+    def _collect_loop(self):
+        while not self.stop_event.is_set():
+            for task, locations, encodings, seconds, timings in self.pool.results(timeout=0.5):
+                started = time.perf_counter()
+                faces = identify_faces(locations, encodings, self.matcher, task.camera.tracker, task.seq)
+                timings['match'] = time.perf_counter() - started
+                self._finish(task, faces, seconds, timings)
+
+    def _publisher_loop(self):
+        while not self.stop_event.is_set() or not self.publish.empty():
+            try:
+                det = self.publish.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # Encoded here, in the publisher thread, never in the frame loop
+            started = time.perf_counter()
+            try:
+                snapshot = encode_snapshot(det.frame, det.location)
+            except cv2.error as e:
+                print(f'[Error] Snapshot encoding failed: {e}')
+                snapshot = None
+            METRICS.observe('snapshot', time.perf_counter() - started, det.camera_name)
+            try:
+                self.uploader.enqueue(det.employee_id, det.confidence, snapshot,
+                                      camera_name=det.camera_name, detected_at=det.detected_at,
+                                      direction=det.direction)
+                passage = f' ({det.direction})' if det.direction else ''
+                print(f'[DETECTED] {det.name}{passage} at {det.camera_name} ({det.confidence*100:.1f}%)')
+                self.published += 1
+                METRICS.inc('detections', camera=det.camera_name)
+                continue
+            except Exception as e:
+                print(f'[Error] Failed to spool detection: {e}')
+            # Not spooled - allow the next sighting to try again
+            self.failed += 1
+            key = (det.camera_name, det.employee_id, det.direction)
+            with self._cooldown_lock:
+                if self.cooldowns.get(key) == det.detected_at:
+                    del self.cooldowns[key]
+
+    def avg_frame_seconds(self):
+        """Average detector time per processed frame."""
+        if self.pool is not None:
+            frames = sum(v[0] for v in self.pool.per_worker.values())
+            seconds = sum(v[1] for v in self.pool.per_worker.values())
+        else:
+            frames, seconds = self.processed, self._busy_seconds
+        return seconds / frames if frames else 0.0
+
+    # -- routing (main thread) ---------------------------------
+
+    def _claim(self, key, now, seconds):
+        """Reserve a log for `key` unless one was made in the last `seconds`."""
+        with self._cooldown_lock:
+            if now - self.cooldowns.get(key, 0) < seconds:
+                return False
+            self.cooldowns[key] = now
+            return True
+
+    def route(self, result):
+        """Queue a log for every matched face whose cooldown has expired,
+        or - for cameras with a door line - for every recognised crossing."""
+        camera = result.camera
+        camera.last_faces = result.faces
+        matched_faces = []
+        for face in result.faces:
+            best = face.candidates[0] if face.candidates else None
+            matched = best is not None and best.distance <= CONFIDENCE_THRESHOLD
+            METRICS.inc('faces', camera=camera.name, result='matched' if matched else 'unknown')
+            if matched:
+                matched_faces.append((face, best, None))
+
+        now = time.time()
+        if camera.door_line is not None:
+            events = camera.door_line.update(result.faces, result.frame.shape, now)
+            for _face, _best, direction in events:
+                METRICS.inc('crossings', camera=camera.name, direction=direction)
+            window = LINE_REPEAT_SECONDS
+        else:
+            events, window = matched_faces, COOLDOWN_SECONDS
+        for face, best, direction in events:
+            if not self._claim((camera.name, best.employee_id, direction), now, window):
+                continue
+            self.publish.put_latest(Detection(
+                camera.name, best.employee_id, best.name, 1.0 - best.distance,
+                result.frame, face.location, now, direction,
+            ))
+
+    def drain_results(self):
+        """Route every processed frame waiting in the results queue."""
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.route(result)
+
+    def stats(self):
+        with self._stats_lock:
+            avg_latency = self._latency_total / self.processed if self.processed else 0.0
+        elapsed = time.time() - self._started_at if self._started_at else 0.0
+        captured = self.captured
+        return {
+            'captured': captured,
+            'processed': self.processed,
+            'processed_fps': round(self.processed / elapsed, 2) if elapsed else 0.0,
+            'capture_fps': round(captured / elapsed, 2) if elapsed else 0.0,
+            'published': self.published,
+            'publish_failed': self.failed,
+            'avg_latency_ms': round(avg_latency * 1000.0, 1),
+            'frame_slot_depth': sum(f.frames.qsize() for f in self.feeds),
+            'frame_slot_dropped': sum(f.frames.dropped for f in self.feeds),
+            'results_depth': self.results.qsize(),
+            'results_dropped': self.results.dropped,
+            'publish_depth': self.publish.qsize(),
+            'publish_dropped': self.publish.dropped,
+            'motion_checked': sum(f.motion.checked for f in self.feeds if f.motion),
+            'motion_skipped': sum(f.motion.skipped for f in self.feeds if f.motion),
+            'faces_encoded': sum(f.tracker.encoded for f in self.feeds if f.tracker),
+            'faces_reused': sum(f.tracker.reused for f in self.feeds if f.tracker),
+            'cameras': {
+                f.name: {
+                    'alive': f.alive,
+                    'captured': f.captured,
+                    'processed': f.processed,
+                    'dropped': f.frames.dropped,
+                    'activity': round(f.activity, 2),
+                    'frame_skip': f.controller.skip,
+                    'detect_scale': f.controller.scale,
+                    'frame_ms': round(f.controller.frame_ms, 1),
+                    'frame_age_ms': round(f.frame_age * 1000.0, 1),
+                    'reconnects': f.reconnects,
+                    'read_failures': f.read_failures,
+                    'roi_saved': round(f.roi_saved, 3),
+                    'roi_megapixels_saved': round(f.processed * f.frame_pixels * f.roi_saved / 1e6, 1),
+                    'entries': f.door_line.entries if f.door_line else None,
+                    'exits': f.door_line.exits if f.door_line else None,
+                    'unidentified_crossings': f.door_line.unidentified if f.door_line else None,
+                }
+                for f in self.feeds
+            },
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(
+            f'[Pipeline] captured={s["captured"]} ({s["capture_fps"]} fps) '
+            f'processed={s["processed"]} ({s["processed_fps"]} fps) '
+            f'latency={s["avg_latency_ms"]}ms | '
+            f'frames q={s["frame_slot_depth"]} drop={s["frame_slot_dropped"]} | '
+            f'results q={s["results_depth"]} drop={s["results_dropped"]} | '
+            f'publish q={s["publish_depth"]} drop={s["publish_dropped"]} '
+            f'ok={s["published"]} fail={s["publish_failed"]}'
+        )
+        if s['motion_checked']:
+            saved = s['motion_skipped'] * self.avg_frame_seconds()
+            print(f'[Motion] checked={s["motion_checked"]} idle={s["motion_skipped"]} '
+                  f'({s["motion_skipped"] * 100.0 / s["motion_checked"]:.0f}%) '
+                  f'detector time saved={saved:.1f}s')
+        for name, cam in s['cameras'].items():
+            if cam['roi_saved']:
+                print(f'[ROI] {name}: {cam["roi_saved"] * 100:.0f}% of each frame skipped, '
+                      f'{cam["roi_megapixels_saved"]} megapixels not searched')
+            if cam['entries'] is not None:
+                print(f'[Line] {name}: entries={cam["entries"]} exits={cam["exits"]} '
+                      f'unrecognised crossings={cam["unidentified_crossings"]}')
+        if s['faces_encoded'] or s['faces_reused']:
+            total = s['faces_encoded'] + s['faces_reused']
+            print(f'[Tracking] faces={total} encoded={s["faces_encoded"]} '
+                  f'reused={s["faces_reused"]} ({s["faces_reused"] * 100.0 / total:.0f}% encodes saved)')
+        if len(self.feeds) > 1 or any(cam['reconnects'] or cam['frame_age_ms']
+                                      for cam in s['cameras'].values()):
+            for name, cam in s['cameras'].items():
+                print(f'[Pipeline]   {name}: {"up" if cam["alive"] else "DOWN"} '
+                      f'captured={cam["captured"]} processed={cam["processed"]} '
+                      f'drop={cam["dropped"]} activity={cam["activity"]} '
+                      f'skip={cam["frame_skip"]} scale={cam["detect_scale"]} '
+                      f'age={cam["frame_age_ms"]}ms reconnects={cam["reconnects"]}')
+        if self.pool is not None:
+            print(f'[Workers] {self.pool.workers} processes, oversize={self.pool.oversize} '
+                  f'errors={self.pool.errors} lost={self.pool.lost} restarts={self.pool.restarts}')
+            for line in self.pool.report():
+                print(line)
+        self.uploader.print_stats()
+        for line in METRICS.summary():
+            print(line)
+
+    # -- lifecycle ---------------------------------------------
+
+    def start(self):
+        self._started_at = time.time()
+        workers = self.pool.workers if self.pool is not None else self.workers
+        for feed in self.feeds:
+            feed.controller.parallelism = workers / float(len(self.feeds))
+        targets = [(f'capture-{f.name}', self._capture_loop, (f,))
+                   for f in self.feeds if f.alive or f.reconnectable]
+        targets.append(('publisher', self._publisher_loop, ()))
+        if self.pool is not None:
+            targets += [('dispatch', self._dispatch_loop, ()), ('collect', self._collect_loop, ())]
+        else:
+            targets += [(f'detect-{i}', self._worker_loop, ()) for i in range(self.workers)]
+        for name, target, args in targets:
+            thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+
+def draw_faces(display_frame, faces):
+    for face in faces:
+        top, right, bottom, left = face.location
+        best = face.candidates[0] if face.candidates else None
+        if best and best.distance <= CONFIDENCE_THRESHOLD:
+            # Draw green box with name
+            cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 255, 0), 2)
+            label = f'{best.name} ({(1.0 - best.distance)*100:.0f}%)'
+            cv2.putText(display_frame, label, (left, top - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        else:
+            # Unknown face - red box
+            cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 0, 255), 2)
+            cv2.putText(display_frame, 'Unknown', (left, top - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+
+
+def load_camera_config(path):
+    """Read the camera list for supervisor mode.
+
+    The file is JSON, either a list or {"cameras": [...]}, each entry being
+    {"name": "Back Door", "source": "rtsp://..."}; a numeric source such as
+    0 or "0" means a local USB camera. An optional "roi" (list of [x, y]
+    points, see RegionOfInterest) limits detection to the door area, an
+    optional "door_line" (two [x, y] points, see DoorLine) is used in
+    'line' event mode. Returns (name, source, roi, door_line) tuples.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    entries = data.get('cameras', []) if isinstance(data, dict) else data
+
+    cameras = []
+    for i, entry in enumerate(entries):
+        source = entry.get('source', 0)
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        cameras.append((entry.get('name') or f'Camera {i + 1}', source,
+                        parse_roi(entry.get('roi')), parse_door_line(entry.get('door_line'))))
+    if not cameras:
+        raise ValueError(f'No cameras defined in {path}')
+    return cameras
+
+
+def write_preview(feeds, path=None):
+    """Headless debug preview: save each camera's newest frame, annotated.
+
+    `path` defaults to PREVIEW_PATH (read at call time, --preview sets it).
+    """
+    path = path or PREVIEW_PATH
+    for feed in feeds:
+        frame = feed.preview.take_nowait()
+        if frame is None:
+            continue
+        display_frame = frame.copy()
+        if feed.roi is not None:
+            feed.roi.draw(display_frame)
+        if feed.door_line is not None:
+            feed.door_line.draw(display_frame)
+        draw_faces(display_frame, feed.last_faces)
+        slug = ''.join(c if c.isalnum() else '_' for c in feed.name).lower()
+        target = path.replace('{camera}', slug)
+        # Write then rename, so a viewer never sees a half-written file
+        tmp_path = f'{target}.tmp.jpg'
+        if not cv2.imwrite(tmp_path, display_frame):
+            print(f'[Preview] Cannot write {target}.')
+            continue
+        os.replace(tmp_path, target)
+
+
+def register_gauges(metrics, feeds, uploader, gallery):
+    """Expose the current state of cameras, spool and gallery as gauges."""
+    def per_camera(value):
+        return lambda: {(('camera', f.name),): value(f) for f in feeds}
+
+    metrics.gauge('camera_up', 'Camera stream is delivering frames (1) or down (0).',
+                  per_camera(lambda f: int(f.alive)))
+    metrics.gauge('frame_age_seconds', 'How far the newest frame lags behind real time.',
+                  per_camera(lambda f: round(f.frame_age, 4)))
+    metrics.gauge('reconnects', 'Stream reconnects since start.', per_camera(lambda f: f.reconnects))
+    metrics.gauge('frame_skip', 'Current frame skip (process every Nth frame).',
+                  per_camera(lambda f: f.controller.skip))
+    metrics.gauge('detect_scale', 'Current detection downscale factor.',
+                  per_camera(lambda f: f.controller.scale))
+    metrics.gauge('roi_pixels_skipped_ratio', 'Share of frame pixels outside the region of interest.',
+                  per_camera(lambda f: round(f.roi_saved, 4)))
+    metrics.gauge('spool_depth', 'Detections waiting to be uploaded to Odoo.',
+                  lambda: {(): uploader.depth()})
+    metrics.gauge('gallery_employees', 'Employees in the face gallery.',
+                  lambda: {(): gallery.employee_count()})
+
+
+def install_shutdown_handlers(stop_event):
+    """Stop on SIGTERM/SIGINT (and SIGHUP) so a service manager can stop us cleanly."""
+    def handle(signum, _frame):
+        print(f'[Camera] Received {signal.Signals(signum).name}, shutting down.')
+        stop_event.set()
+
+    for name in ('SIGTERM', 'SIGINT', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handle)
+
+
+def detection_mode(odoo, workers=None, cameras=None, headless=None):
+    """Main detection loop - continuously detect and identify faces.
+
+    `workers` > 1 runs detection/encoding in that many processes.
+    `cameras` is a list of (name, source, roi, door_line); by default the
+    single CAMERA_NAME / CAMERA_SOURCE / CAMERA_ROI / DOOR_LINE camera.
+    With EVENT_MODE 'line', cameras that have a door line log one
+    entry/exit event per passage instead of a detection per cooldown. With several cameras this is the
+    supervisor mode: one gallery, one Odoo session and one worker pool
+    serve every stream.
+
+    `headless` (default HEADLESS) opens no windows and draws nothing,
+    except the optional PREVIEW_PATH snapshot every PREVIEW_INTERVAL
+    seconds. Returns False when detection could not start, so a service
+    manager sees a failed exit.
+    """
+    headless = HEADLESS if headless is None else headless
+    workers = PROCESS_WORKERS if workers is None else workers
+    cameras = cameras or [(CAMERA_NAME, CAMERA_SOURCE, parse_roi(CAMERA_ROI), parse_door_line(DOOR_LINE))]
+    gallery = load_known_faces(odoo)
+
+    if len(gallery) == 0:
+        print('[!] No known faces loaded. Register some faces first.')
+        print('    Run with --register flag to register faces.')
+        return False
+
+    matcher = build_matcher(gallery)
+    print(f'[Faces] Matcher: {matcher.name}')
+    try:
+        detector = get_detector()
+    except RuntimeError as e:
+        print(f'[Error] Cannot load face detector {DETECTOR_BACKEND!r}: {e}')
+        return False
+    print(f'[Faces] Detector: {detector.name} (smallest face {detector.min_face:.0f}px at detect scale)')
+
+    if EVENT_MODE not in ('cooldown', 'line'):
+        print(f"[Error] Unknown EVENT_MODE {EVENT_MODE!r}, expected 'cooldown' or 'line'.")
+        return False
+    if EVENT_MODE == 'line' and not TRACKING_ENABLED:
+        print('[Error] EVENT_MODE line follows face tracks; enable TRACKING_ENABLED.')
+        return False
+
+    schedule_cond = threading.Condition()
+    feeds = []
+    for name, source, roi, door_line in cameras:
+        if EVENT_MODE != 'line':
+            door_line = None
+        elif door_line is None:
+            print(f'[Camera] {name}: no door line set, logging with the cooldown instead.')
+        feed = CameraFeed(name, source, schedule_cond, roi, door_line)
+        # Without a window only the frames that go to detection are decoded
+        feed.decode_all = not headless
+        print(f'[Camera] Opening camera: {name} ({source})')
+        if not feed.open():
+            print(f'[Error] Cannot open camera {name}. Check its source setting.')
+        feeds.append(feed)
+    # Cameras that fail now keep retrying in the background, but at least
+    # one must work to start at all
+    if not any(feed.alive for feed in feeds):
+        return False
+
+    pool = None
+    if workers > 1:
+        print(f'[Workers] Starting {workers} encoder processes.')
+        pool = EncoderProcessPool(workers)
+
+    uploader = DetectionUploader(odoo)
+    uploader.start()
+    sync = GallerySync(odoo, gallery, matcher=matcher)
+    sync.start()
+
+    pipeline = DetectionPipeline(feeds, matcher, uploader, pool=pool)
+    register_gauges(METRICS, feeds, uploader, gallery)
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = start_metrics_server()
+        except OSError as e:
+            print(f'[Metrics] Cannot serve metrics on port {METRICS_PORT}: {e}')
+    install_shutdown_handlers(pipeline.stop_event)
+    pipeline.start()
+    if headless:
+        print('[Camera] Running face detection (headless). Stop with SIGTERM or Ctrl+C.')
+    else:
+        print('[Camera] Running face detection. Press Q to quit.')
+
+    next_stats = time.time() + STATS_INTERVAL
+    next_preview = time.time()
+    try:
+        while not pipeline.stop_event.is_set():
+            pipeline.drain_results()
+
+            if headless:
+                if PREVIEW_PATH and time.time() >= next_preview:
+                    write_preview(feeds)
+                    next_preview = time.time() + PREVIEW_INTERVAL
+                pipeline.stop_event.wait(0.2)
+            else:
+                for feed in feeds:
+                    frame = feed.preview.get(timeout=0.5 / len(feeds))
+                    if frame is None:
+                        continue
+                    display_frame = frame.copy()
+                    if feed.roi is not None:
+                        feed.roi.draw(display_frame)
+                    if feed.door_line is not None:
+                        feed.door_line.draw(display_frame)
+                    draw_faces(display_frame, feed.last_faces)
+                    title = 'Door Monitor' if len(feeds) == 1 else f'Door Monitor - {feed.name}'
+                    cv2.imshow(title, display_frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            if time.time() >= next_stats:
+                pipeline.print_stats()
+                next_stats = time.time() + STATS_INTERVAL
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        pipeline.stop()
+        sync.stop()
+        pipeline.print_stats()
+        uploader.stop()
+        if pool is not None:
+            pool.close()
+        for feed in feeds:
+            feed.release()
+        if not headless:
+            cv2.destroyAllWindows()
+    print('[Camera] Stopped.')
+    return True
+
+
+# ------------------------------------------------------------
+# Footage replay
+# ------------------------------------------------------------
+
+# One stretch of a footage file, processed by one worker process
+FootageSegment = namedtuple('FootageSegment', ['path', 'start_frame', 'end_frame', 'fps', 'start_time'])
+ReplayEvent = namedtuple('ReplayEvent', ['detected_at', 'employee_id', 'name', 'confidence',
+                                         'direction', 'snapshot'])
+
+# NVR exports carry the recording start in the name: door_20261001_080000.mp4
+_FOOTAGE_STAMP = re.compile(r'(\d{8})[_\-T ]?(\d{6})')
+
+
+def footage_start(path, start=None):
+    """Wall-clock time (unix) of a footage file's first frame.
+
+    An explicit `start` (unix time, see parse_replay_start) wins, then a
+    YYYYMMDD_HHMMSS stamp in the file name, then the file's modification
+    time minus its duration (recorders write the file until it ends).
+    """
+    if start is not None:
+        return start
+    stamp = _FOOTAGE_STAMP.search(os.path.basename(path))
+    if stamp:
+        return time.mktime(time.strptime(''.join(stamp.groups()), '%Y%m%d%H%M%S'))
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+    cap.release()
+    return os.path.getmtime(path) - frames / fps
+
+
+def parse_replay_start(value):
+    """--replay-start value ('YYYY-MM-DD HH:MM:SS', local time) -> unix time."""
+    try:
+        return time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected "YYYY-MM-DD HH:MM:SS", got {value!r}')
+
+
+def footage_segments(path, start_time, segment_seconds=None):
+    """Split a footage file into FootageSegments of `segment_seconds`
+    (default REPLAY_SEGMENT_SECONDS).
+
+    Files whose length is unknown become one segment read to the end.
+    """
+    segment_seconds = segment_seconds or REPLAY_SEGMENT_SECONDS
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f'Cannot open footage {path}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    cap.release()
+    if frames <= 0:
+        return [FootageSegment(path, 0, None, fps, start_time)]
+    step = max(1, int(segment_seconds * fps))
+    return [FootageSegment(path, first, min(frames, first + step), fps, start_time)
+            for first in range(0, frames, step)]
+
+
+_replay = {}
+
+
+def _replay_init(encodings, ids, names, options, settings):
+    """Worker process setup: the settings, the gallery and the replay options."""
+    apply_settings(settings)
+    # One process per core already; OpenCV's own threads would only compete
+    cv2.setNumThreads(1)
+    _replay.update(options)
+    _replay['matcher'] = build_matcher(GalleryIndex.from_arrays(encodings, ids, names))
+
+
+def _replay_segment(segment):
+    """Worker: the detections of one footage segment.
+
+    Runs the live pipeline's steps in footage time: motion gate, tracking,
+    detection in the ROI, matching, and either the cooldown or the door
+    line. Returns (segment, [ReplayEvent], frames processed, seconds).
+    """
+    started = time.perf_counter()
+    matcher, roi = _replay['matcher'], _replay['roi']
+    door_line = _replay['door_line']
+    if door_line is not None:
+        door_line = DoorLine(door_line.points, door_line.margin)
+    window = LINE_REPEAT_SECONDS if door_line is not None else COOLDOWN_SECONDS
+    tracker = FaceTracker() if TRACKING_ENABLED else None
+    motion = MotionGate() if MOTION_GATE_ENABLED else None
+
+    cap = cv2.VideoCapture(segment.path)
+    if segment.start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, segment.start_frame)
+    step = max(1, int(round(segment.fps / REPLAY_FPS)))
+    events, last_logged = [], {}
+    index, processed = segment.start_frame, 0
+    while segment.end_frame is None or index < segment.end_frame:
+        if (index - segment.start_frame) % step:
+            # Skipped frames are only demuxed, not converted
+            if not cap.grab():
+                break
+            index += 1
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        now = segment.start_time + index / segment.fps
+        index += 1
+        if motion is not None and not motion.check(roi.crop(frame)[0] if roi else frame, now) \
+                and not (tracker and tracker.tracks):
+            continue
+        skip_boxes = tracker.settled_boxes(now) if tracker else None
+        locations, encodings = detect_and_encode(frame, skip_boxes, DETECT_SCALE, None, roi)
+        faces = identify_faces(locations, encodings, matcher, tracker, index, now)
+        processed += 1
+
+        if door_line is not None:
+            hits = door_line.update(faces, frame.shape, now)
+        else:
+            hits = [(face, face.candidates[0], None) for face in faces
+                    if face.candidates and face.candidates[0].distance <= CONFIDENCE_THRESHOLD]
+        for face, best, direction in hits:
+            key = (best.employee_id, direction)
+            if now - last_logged.get(key, float('-inf')) < window:
+                continue
+            last_logged[key] = now
+            events.append(ReplayEvent(now, best.employee_id, best.name, 1.0 - best.distance, direction,
+                                      encode_snapshot(frame, face.location)))
+    cap.release()
+    return segment, events, processed, time.perf_counter() - started
+
+
+def merge_replay_events(events, window):
+    """Apply the cooldown across segment borders: per employee and
+    direction, drop events within `window` seconds of the previous one."""
+    merged, last_logged = [], {}
+    for event in sorted(events, key=lambda e: e.detected_at):
+        key = (event.employee_id, event.direction)
+        if event.detected_at - last_logged.get(key, float('-inf')) < window:
+            continue
+        last_logged[key] = event.detected_at
+        merged.append(event)
+    return merged
+
+
+def replay_key(camera_name, event):
+    """Idempotency key of a replayed event: replaying the same footage
+    again gives the same keys, so Odoo reports duplicates, not new logs."""
+    name = f'replay:{camera_name}:{event.employee_id}:{int(event.detected_at)}:{event.direction or ""}'
+    return uuid.uuid5(uuid.NAMESPACE_URL, name).hex
+
+
+def replay_mode(odoo, paths, start=None, workers=None, camera_name=None):
+    """Reprocess recorded footage and upload its detections to Odoo.
+
+    Every file is split into REPLAY_SEGMENT_SECONDS segments processed in
+    parallel by `workers` processes (default: one per core), REPLAY_FPS
+    frames per footage second. detection_time comes from the footage
+    clock (see footage_start); an explicit `start` (unix time) is meant
+    for a single file. Events are spooled with replay keys and uploaded in
+    REPLAY_UPLOAD_BATCH batches; what Odoo does not take now stays in the
+    spool for the next run or the live camera. Returns False when nothing
+    could be replayed.
+    """
+    camera_name = camera_name or CAMERA_NAME
+    gallery = load_known_faces(odoo)
+    if len(gallery) == 0:
+        print('[!] No known faces loaded. Register some faces first.')
+        return False
+    door_line = parse_door_line(DOOR_LINE) if EVENT_MODE == 'line' else None
+    if door_line is not None and not TRACKING_ENABLED:
+        print('[Error] EVENT_MODE line follows face tracks; enable TRACKING_ENABLED.')
+        return False
+
+    segments = []
+    footage_seconds = 0.0
+    for path in paths:
+        try:
+            began = footage_start(path, start)
+            file_segments = footage_segments(path, began)
+        except ValueError as e:
+            print(f'[Replay] {e}')
+            continue
+        known = [seg for seg in file_segments if seg.end_frame is not None]
+        seconds = sum((seg.end_frame - seg.start_frame) / seg.fps for seg in known)
+        footage_seconds += seconds
+        print(f'[Replay] {path}: starts {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(began))}, '
+              f'{seconds / 60.0:.1f} min in {len(file_segments)} segments')
+        segments += file_segments
+    if not segments:
+        return False
+
+    workers = workers if workers and workers > 0 else os.cpu_count() or 1
+    options = {
+        'roi': parse_roi(CAMERA_ROI),
+        'door_line': door_line,
+    }
+    print(f'[Replay] {len(segments)} segments on {workers} processes, {REPLAY_FPS:g} frames per footage second.')
+    started = time.time()
+    events = []
+    frames = 0
+    with multiprocessing.Pool(workers, _replay_init,
+                              (gallery.encodings, gallery.ids, gallery.names, options,
+                               current_settings())) as pool:
+        for done, (segment, found, processed, _seconds) in enumerate(
+                pool.imap_unordered(_replay_segment, segments), 1):
+            events += found
+            frames += processed
+            print(f'[Replay] {done}/{len(segments)} segments  frames={frames} events={len(events)}')
+    elapsed = time.time() - started
+    print(f'[Replay] {footage_seconds / 60.0:.1f} min of footage in {elapsed / 60.0:.1f} min '
+          f'({footage_seconds / elapsed:.0f}x real time).')
+
+    window = LINE_REPEAT_SECONDS if door_line is not None else COOLDOWN_SECONDS
+    events = merge_replay_events(events, window)
+    print(f'[Replay] {len(events)} detections after merging segment borders.')
+    if not events:
+        return True
+
+    uploader = DetectionUploader(odoo, batch_size=REPLAY_UPLOAD_BATCH)
+    for event in events:
+        uploader.enqueue(event.employee_id, event.confidence, event.snapshot, camera_name=camera_name,
+                         detected_at=event.detected_at, direction=event.direction,
+                         key=replay_key(camera_name, event))
+    uploader.flush()
+    print(f'[Replay] uploaded={uploader.uploaded} rejected={uploader.rejected} dropped={uploader.dropped} '
+          f'(re-sent events are reported by Odoo as duplicates, not logged again)')
+    left = uploader.depth()
+    if left:
+        print(f'[Replay] {left} detections stay spooled in {uploader.path} and are uploaded later.')
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Door Monitoring - Face Recognition')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--register', action='store_true', help='register a new face')
+    mode.add_argument('--detect', action='store_true', help='start detection without the mode prompt')
+    mode.add_argument('--calibrate-detectors', metavar='FOOTAGE',
+                      help='speed and recall of every detector backend on a video or image sequence')
+    mode.add_argument('--recall-report', action='store_true',
+                      help='compare approximate and exact matching on the gallery')
+    mode.add_argument('--replay', nargs='+', metavar='FOOTAGE',
+                      help='reprocess recorded video files and upload their detections')
+    parser.add_argument('--replay-start', metavar='"YYYY-MM-DD HH:MM:SS"', type=parse_replay_start,
+                        help='local time of the first frame of a single --replay file '
+                             '(default: from the file name or mtime)')
+    parser.add_argument('--workers', type=int, default=PROCESS_WORKERS, metavar='N',
+                        help='run detection/encoding in N processes (default: in-process)')
+    parser.add_argument('--cameras', metavar='FILE',
+                        help='supervisor mode: serve every camera listed in this JSON file')
+    parser.add_argument('--config', metavar='FILE',
+                        help='JSON file overriding the settings at the top of this script')
+    parser.add_argument('--detector', choices=sorted(DETECTOR_BACKENDS), default=DETECTOR_BACKEND,
+                        help=f'face detector backend (default: {DETECTOR_BACKEND})')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, metavar='PORT',
+                        help='serve Prometheus metrics on this local port')
+    parser.add_argument('--headless', action='store_true', default=HEADLESS,
+                        help='run as a service: no windows, no mode prompt (implies --detect)')
+    parser.add_argument('--preview', metavar='PATH', default=PREVIEW_PATH,
+                        help='headless only: write an annotated JPEG here every PREVIEW_INTERVAL s')
+    args = parser.parse_args(argv)
+    if args.replay_start is not None and len(args.replay or ()) != 1:
+        # One start time for several files would give them all the same clock
+        parser.error('--replay-start needs exactly one --replay file')
+    return args
+
+
+def main():
+    global PREVIEW_PATH, METRICS_PORT, DETECTOR_BACKEND
+    args = parse_args()
+    PREVIEW_PATH = args.preview
+    METRICS_PORT = args.metrics_port
+    DETECTOR_BACKEND = args.detector
+    if args.calibrate_detectors:
+        # Offline: needs neither Odoo nor a camera
+        frames = read_sample_frames(args.calibrate_detectors, every=CALIBRATION_FRAME_STEP)
+        calibrate_detectors(frames)
+        return
+    if args.headless:
+        # Service managers read our output through a pipe
+        sys.stdout.reconfigure(line_buffering=True)
+
+    print('=' * 50)
+    print('  Door Monitoring - Face Recognition')
+    print('=' * 50)
+    print(f'  Odoo: {ODOO_URL}')
+    print(f'  Database: {ODOO_DB}')
+    print(f'  Detector: {DETECTOR_BACKEND} (upsample {DETECTOR_UPSAMPLE})')
+    if OVERRIDDEN_SETTINGS:
+        print(f'  Settings from config/env: {", ".join(OVERRIDDEN_SETTINGS)}')
+    cameras = load_camera_config(args.cameras) if args.cameras else None
+    if cameras:
+        print(f'  Cameras: {len(cameras)} from {args.cameras}')
+    else:
+        print(f'  Camera: {CAMERA_SOURCE}')
     print('=' * 50)
 
     # Connect to Odoo
@@ -324,11 +3763,23 @@ def main():
         odoo.authenticate()
     except Exception as e:
         print(f'[Error] Cannot connect to Odoo: {e}')
-        sys.exit(1)
+        if args.register or not (SNAPSHOT_PATH and os.path.exists(SNAPSHOT_PATH)):
+            sys.exit(1)
+        # Detection can run from the local gallery snapshot; detections
+        # are spooled and Odoo is logged into once it is reachable again.
+        print(f'[Odoo] Starting offline from gallery snapshot {SNAPSHOT_PATH}.')
 
     # Check mode
-    if '--register' in sys.argv:
+    if args.register:
         register_mode(odoo)
+    elif args.recall_report:
+        recall_report(load_known_faces(odoo))
+    elif args.replay:
+        if not replay_mode(odoo, args.replay, start=args.replay_start, workers=args.workers):
+            sys.exit(1)
+    elif args.detect or args.headless or not sys.stdin.isatty():
+        if not detection_mode(odoo, workers=args.workers, cameras=cameras, headless=args.headless):
+            sys.exit(1)
     else:
         print('\nModes:')
         print('  1. Start Detection (default)')
@@ -337,7 +3788,7 @@ def main():
         choice = input('\nSelect mode [1]: ').strip() or '1'
 
         if choice == '1':
-            detection_mode(odoo)
+            detection_mode(odoo, workers=args.workers, cameras=cameras)
         elif choice == '2':
             register_mode(odoo)
         else:
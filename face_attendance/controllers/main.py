@@ -1,9 +1,16 @@
+import base64
+import binascii
 import json
 import logging
+import struct
+
+import psycopg2.errors
 
 from odoo import http
 from odoo.http import request
 
+from odoo.addons.face_attendance.models.face_employee import unpack_face_encoding
+
 _logger = logging.getLogger(__name__)
 
 
@@ -11,18 +18,45 @@ class FaceAttendanceController(http.Controller):
 
     @http.route('/face_attendance/employees', type='json', auth='user', methods=['POST'])
     def get_employees_with_faces(self, **kwargs):
-        """Return all employees that have face encodings registered.
+        """Return employees that have face encodings registered.
         Used by camera script to load known faces on startup.
+
+        Without parameters the full list is returned in the original format
+        (`encoding` is JSON text of one 128-value encoding, the first
+        template), for camera scripts that predate packed encodings.
+        With `since` (cursor) and/or `etag` the camera gets a delta sync
+        object instead: changed and removed encodings, or not_modified.
+        format='blob' packs all changed encodings into one base64 blob.
         """
+        if 'since' in kwargs or 'etag' in kwargs:
+            result = request.env['hr.employee'].get_face_gallery_changes(
+                since=kwargs.get('since'),
+                etag=kwargs.get('etag'),
+                blob=kwargs.get('format') == 'blob',
+            )
+            if not result.get('not_modified'):
+                _logger.info(
+                    'Face gallery sync: %d changed, %d removed (full=%s).',
+                    len(result['ids'] if 'blob' in result else result['employees']),
+                    len(result['removed']),
+                    result['full'],
+                )
+            return result
+
         employees = request.env['hr.employee'].sudo().search([
             ('face_encoding', '!=', False),
         ])
         result = []
         for emp in employees:
+            try:
+                encoding = unpack_face_encoding(emp.face_encoding)[0]
+            except (binascii.Error, ValueError, IndexError, struct.error):
+                _logger.warning('Skipping unreadable face encoding of employee %s.', emp.id)
+                continue
             result.append({
                 'id': emp.id,
                 'name': emp.name,
-                'encoding': emp.face_encoding,
+                'encoding': json.dumps(encoding),
             })
         _logger.info('Returning %d employees with face encodings.', len(result))
         return result
@@ -36,6 +70,9 @@ class FaceAttendanceController(http.Controller):
         confidence = kwargs.get('confidence', 0.0)
         snapshot_base64 = kwargs.get('snapshot_base64')
         camera_name = kwargs.get('camera_name', 'Main Door')
+        detection_time = kwargs.get('detection_time')
+        event_key = kwargs.get('key')
+        direction = kwargs.get('direction')
 
         if not employee_id:
             return {'success': False, 'error': 'employee_id is required'}
@@ -46,6 +83,9 @@ class FaceAttendanceController(http.Controller):
                 confidence=confidence,
                 snapshot_base64=snapshot_base64,
                 camera_name=camera_name,
+                detection_time=detection_time,
+                event_key=event_key,
+                direction=direction,
             )
             _logger.info(
                 'Door detection logged: %s (%s%%)',
@@ -53,16 +93,105 @@ class FaceAttendanceController(http.Controller):
                 confidence,
             )
             return {'success': True, **result}
+        except psycopg2.errors.TransactionRollbackError:
+            # Concurrent detection of the same person: Odoo retries the request
+            raise
         except Exception as e:
             _logger.error('Error logging door detection: %s', str(e))
             return {'success': False, 'error': str(e)}
 
+    @http.route('/face_attendance/log_batch', type='json', auth='user', methods=['POST'])
+    def log_detection_batch(self, **kwargs):
+        """Log many door detections in one request and one transaction.
+        Each item of `detections` takes the /face_attendance/log parameters
+        plus an optional idempotency `key`; a retried batch does not create
+        duplicates. Per-item results are returned in input order.
+        """
+        return self._log_detection_batch(kwargs.get('detections'))
+
+    def _log_detection_batch(self, detections):
+        if not isinstance(detections, list):
+            return {'success': False, 'error': 'detections must be a list'}
+
+        try:
+            results = request.env['face.attendance.log'].sudo().create_batch_from_camera(detections)
+            logged = sum(1 for r in results if r.get('success') and not r.get('duplicate'))
+            _logger.info(
+                'Door detection batch: %d received, %d logged, %d failed.',
+                len(detections),
+                logged,
+                sum(1 for r in results if not r.get('success')),
+            )
+            return {'success': True, 'results': results}
+        except psycopg2.errors.TransactionRollbackError:
+            raise
+        except Exception as e:
+            _logger.error('Error logging door detection batch: %s', str(e))
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/face_attendance/log_upload', type='http', auth='user', methods=['POST'], csrf=False)
+    def log_detection_upload(self, detections=None, **kwargs):
+        """Multipart variant of /face_attendance/log_batch.
+
+        `detections` is the same list as JSON text; the snapshot of the
+        detection with key K comes as the binary file field `snapshot_K`,
+        which saves the base64 overhead of sending images inside JSON.
+        """
+        try:
+            detections = json.loads(detections or 'null')
+        except ValueError:
+            detections = None
+        if isinstance(detections, list):
+            files = request.httprequest.files
+            for item in detections:
+                if isinstance(item, dict) and item.get('key') and f'snapshot_{item["key"]}' in files:
+                    item['snapshot_base64'] = base64.b64encode(files[f'snapshot_{item["key"]}'].read())
+        return request.make_json_response(self._log_detection_batch(detections))
+
+    @http.route('/face_attendance/backfill', type='json', auth='user', methods=['POST'])
+    def get_backfill_page(self, **kwargs):
+        """Return one page of employees with a face photo but no encoding.
+        Used by face_backfill.py; page with `after_id` (last id seen) and `limit`.
+        """
+        try:
+            return {'success': True, **request.env['hr.employee'].get_face_backfill_page(
+                after_id=kwargs.get('after_id') or 0,
+                limit=kwargs.get('limit') or 50,
+            )}
+        except Exception as e:
+            _logger.error('Error reading face backfill page: %s', str(e))
+            return {'success': False, 'error': str(e)}
+
+    @http.route('/face_attendance/register_batch', type='json', auth='user', methods=['POST'])
+    def register_face_batch(self, **kwargs):
+        """Register face encodings for many employees in one request.
+        Each item of `registrations` takes the /face_attendance/register
+        employee_id and encoding. Per-item results are returned in input order.
+        """
+        registrations = kwargs.get('registrations')
+        if not isinstance(registrations, list):
+            return {'success': False, 'error': 'registrations must be a list'}
+
+        try:
+            results = request.env['hr.employee'].register_face_encodings(registrations)
+            _logger.info(
+                'Face registration batch: %d received, %d registered.',
+                len(registrations),
+                sum(1 for r in results if r['success']),
+            )
+            return {'success': True, 'results': results}
+        except Exception as e:
+            _logger.error('Error registering face batch: %s', str(e))
+            return {'success': False, 'error': str(e)}
+
     @http.route('/face_attendance/register', type='json', auth='user', methods=['POST'])
     def register_face(self, **kwargs):
         """Register face encoding for an employee.
         Camera script computes the encoding and sends it here.
         """
         employee_id = kwargs.get('employee_id')
+        # Packed float32 base64 with one or more templates (or legacy JSON),
+        # normalised on write
         encoding = kwargs.get('encoding')
         face_image_base64 = kwargs.get('face_image_base64')
 
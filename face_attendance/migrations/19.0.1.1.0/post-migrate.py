@@ -0,0 +1,22 @@
+import logging
+
+from odoo.addons.face_attendance.models.face_employee import pack_face_encoding
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Convert JSON face encodings to the packed float32 base64 form."""
+    cr.execute("SELECT id, face_encoding FROM hr_employee WHERE face_encoding LIKE '[%%'")
+    rows = cr.fetchall()
+    converted = failed = 0
+    for employee_id, encoding in rows:
+        try:
+            packed = pack_face_encoding(encoding)
+        except ValueError:
+            _logger.warning('Employee %s has an invalid face encoding, left unchanged.', employee_id)
+            failed += 1
+            continue
+        cr.execute('UPDATE hr_employee SET face_encoding = %s WHERE id = %s', (packed, employee_id))
+        converted += 1
+    _logger.info('Packed %d face encodings (%d invalid).', converted, failed)
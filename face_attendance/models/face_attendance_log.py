@@ -1,6 +1,23 @@
+import json
+import logging
+
+import psycopg2
+
 from odoo import models, fields, api
+from odoo.tools import sql
 from datetime import datetime, timedelta
 
+_logger = logging.getLogger(__name__)
+
+# Repeats of a detection (same employee, camera group and direction) within
+# this many seconds are merged into the first log; 0 turns merging off
+DEDUP_WINDOW_PARAM = 'face_attendance.dedup_window'
+DEFAULT_DEDUP_WINDOW = 300
+# JSON object mapping camera names to a group, e.g. two cameras on one door:
+# {"Main Door": "main", "Main Door (inside)": "main"}; by default every
+# camera is its own group
+CAMERA_GROUPS_PARAM = 'face_attendance.camera_groups'
+
 
 class FaceAttendanceLog(models.Model):
     _name = 'face.attendance.log'
@@ -35,6 +52,17 @@ class FaceAttendanceLog(models.Model):
         string='Employee Name',
         store=True,
     )
+    direction = fields.Selection(
+        [('entry', 'Entry'), ('exit', 'Exit')],
+        string='Direction',
+        help='Which way the employee passed the door line (cameras in line-crossing mode only).',
+    )
+    event_key = fields.Char(
+        string='Event Key',
+        copy=False,
+        readonly=True,
+        help='Idempotency key sent by the camera script; a retried upload with the same key is not logged twice.',
+    )
     has_app_checkout = fields.Boolean(
         string='Has App Checkout',
         compute='_compute_has_app_checkout',
@@ -42,6 +70,16 @@ class FaceAttendanceLog(models.Model):
         help='Whether the employee had a proper app checkout around this detection time.',
     )
 
+    _event_key_unique = models.Constraint(
+        'UNIQUE(event_key)',
+        'This camera detection has already been logged.',
+    )
+
+    def init(self):
+        # Dedup window lookups and the mismatch report search by employee and time
+        sql.create_index(self.env.cr, 'face_attendance_log_employee_time_idx', self._table,
+                         ['employee_id', 'detection_time'])
+
     @api.depends('employee_id', 'detection_time')
     def _compute_has_app_checkout(self):
         """Check if employee has a proper hr.attendance checkout around this detection time."""
@@ -61,8 +99,10 @@ class FaceAttendanceLog(models.Model):
             rec.has_app_checkout = bool(checkout)
 
     @api.model
-    def create_from_camera(self, employee_id, confidence=0.0, snapshot_base64=None, camera_name='Main Door'):
-        """Called by camera script when a face is detected at the door."""
+    def _prepare_camera_vals(self, employee_id, confidence=0.0, snapshot_base64=None, camera_name='Main Door',
+                             detection_time=None, event_key=None, direction=None):
+        if direction and direction not in ('entry', 'exit'):
+            raise ValueError("direction must be 'entry' or 'exit'")
         vals = {
             'employee_id': employee_id,
             'confidence': confidence,
@@ -70,13 +110,302 @@ class FaceAttendanceLog(models.Model):
         }
         if snapshot_base64:
             vals['snapshot'] = snapshot_base64
+        if detection_time:
+            vals['detection_time'] = fields.Datetime.to_datetime(detection_time)
+        if event_key:
+            vals['event_key'] = event_key
+        if direction:
+            vals['direction'] = direction
+        return vals
+
+    @api.model
+    def create_from_camera(self, employee_id, confidence=0.0, snapshot_base64=None, camera_name='Main Door',
+                           detection_time=None, event_key=None, direction=None):
+        """Called by camera script when a face is detected at the door.
 
+        detection_time (UTC) is sent by cameras that upload from a spool,
+        so detections made while offline keep the moment they happened.
+        direction ('entry'/'exit') is sent by cameras in line-crossing mode.
+        A repeat of a recent log (see _find_repeats) is merged into that log
+        and returned with 'duplicate' and 'repeat' set.
+        """
+        if event_key:
+            existing = self.search([('event_key', '=', event_key)], limit=1)
+            if existing:
+                return {
+                    'id': existing.id,
+                    'employee_name': existing.employee_id.name,
+                    'duplicate': True,
+                }
+        vals = self._prepare_camera_vals(
+            employee_id, confidence, snapshot_base64, camera_name, detection_time, event_key, direction,
+        )
+        window, groups = self._dedup_settings()
+        if window:
+            self._lock_dedup_keys([vals], groups)
+            repeat = self._find_repeats([vals], window, groups)[0]
+            if repeat is not None:
+                self._merge_repeat(repeat, vals)
+                return {
+                    'id': repeat.id,
+                    'employee_name': repeat.employee_id.name,
+                    'duplicate': True,
+                    'repeat': True,
+                }
         log = self.create(vals)
         return {
             'id': log.id,
             'employee_name': log.employee_id.name,
         }
 
+    @api.model
+    def create_batch_from_camera(self, detections):
+        """Log many camera detections with a single multi-create.
+
+        Each item is a dict with the create_from_camera arguments plus an
+        optional 'key' (idempotency key). Returns one result per item, in
+        order: {'key', 'success', 'id'} with 'duplicate': True for keys that
+        were already logged ('repeat': True as well when it was merged into
+        a recent log), or {'key', 'success': False, 'error'}.
+        """
+        results = [None] * len(detections)
+        pending = {}        # index -> vals
+        keys_seen = {}      # key -> first index in this batch
+
+        employee_ids = {d.get('employee_id') for d in detections if isinstance(d, dict)}
+        valid_employees = set(self.env['hr.employee'].browse(
+            [e for e in employee_ids if isinstance(e, int)]).exists().ids)
+
+        keys = [d.get('key') for d in detections if isinstance(d, dict) and d.get('key')]
+        existing = {
+            log.event_key: log.id
+            for log in self.search([('event_key', 'in', keys)])
+        } if keys else {}
+
+        for index, item in enumerate(detections):
+            if not isinstance(item, dict):
+                results[index] = {'key': None, 'success': False, 'error': 'detection must be an object'}
+                continue
+            key = item.get('key') or None
+            if key in existing:
+                results[index] = {'key': key, 'success': True, 'id': existing[key], 'duplicate': True}
+                continue
+            if key and key in keys_seen:
+                # Same key twice in one batch - resolved after the create
+                continue
+            if item.get('employee_id') not in valid_employees:
+                results[index] = {'key': key, 'success': False, 'error': 'Employee not found'}
+                continue
+            try:
+                pending[index] = self._prepare_camera_vals(
+                    item['employee_id'],
+                    confidence=item.get('confidence', 0.0),
+                    snapshot_base64=item.get('snapshot_base64'),
+                    camera_name=item.get('camera_name') or 'Main Door',
+                    detection_time=item.get('detection_time'),
+                    event_key=key,
+                    direction=item.get('direction'),
+                )
+            except (TypeError, ValueError) as e:
+                results[index] = {'key': key, 'success': False, 'error': str(e)}
+                continue
+            if key:
+                keys_seen[key] = index
+
+        repeat_of = {}      # index -> earlier index in this batch it repeats
+        window, groups = self._dedup_settings()
+        if pending and window:
+            indexes = list(pending)
+            self._lock_dedup_keys([pending[i] for i in indexes], groups)
+            repeats = self._find_repeats([pending[i] for i in indexes], window, groups)
+            for index, repeat in zip(indexes, repeats):
+                if repeat is None:
+                    continue
+                vals = pending.pop(index)
+                if isinstance(repeat, int):
+                    first = indexes[repeat]
+                    repeat_of[index] = first
+                    if vals.get('confidence', 0.0) > pending[first].get('confidence', 0.0):
+                        pending[first].update(self._merged_fields(vals))
+                    continue
+                self._merge_repeat(repeat, vals)
+                results[index] = {'key': vals.get('event_key'), 'success': True, 'id': repeat.id,
+                                  'duplicate': True, 'repeat': True}
+
+        if pending:
+            indexes = list(pending)
+            try:
+                with self.env.cr.savepoint():
+                    logs = self.create([pending[i] for i in indexes])
+                created = dict(zip(indexes, logs.ids))
+            except psycopg2.IntegrityError:
+                # A concurrent retry of the same batch won the race for some
+                # keys: fall back to one savepoint per item.
+                _logger.info('Batch detection create hit a duplicate key, retrying per item.')
+                created = self._create_one_by_one(pending)
+            for index, outcome in created.items():
+                key = pending[index].get('event_key')
+                if isinstance(outcome, int):
+                    results[index] = {'key': key, 'success': True, 'id': outcome}
+                else:
+                    results[index] = {'key': key, **outcome}
+
+        for index, first in repeat_of.items():
+            outcome = results[first]
+            key = detections[index].get('key') or None
+            results[index] = {**outcome, 'key': key, 'duplicate': True, 'repeat': True} \
+                if outcome.get('success') else {**outcome, 'key': key}
+
+        for index, item in enumerate(detections):
+            if results[index] is None:
+                first = results[keys_seen[item.get('key')]]
+                results[index] = {**first, 'duplicate': True} if first.get('success') else first
+        return results
+
+    @api.model
+    def _dedup_settings(self):
+        """(window in seconds, {camera name: group}) from the system parameters."""
+        params = self.env['ir.config_parameter'].sudo()
+        try:
+            window = int(params.get_param(DEDUP_WINDOW_PARAM, DEFAULT_DEDUP_WINDOW))
+        except ValueError:
+            window = DEFAULT_DEDUP_WINDOW
+        try:
+            groups = json.loads(params.get_param(CAMERA_GROUPS_PARAM) or '{}')
+        except ValueError:
+            _logger.warning('Ignoring %s: not a JSON object.', CAMERA_GROUPS_PARAM)
+            groups = {}
+        return max(0, window), groups if isinstance(groups, dict) else {}
+
+    @api.model
+    def _dedup_key(self, vals, groups):
+        camera = vals.get('camera_name') or 'Main Door'
+        return vals['employee_id'], groups.get(camera, camera), vals.get('direction') or False
+
+    @api.model
+    def _lock_dedup_keys(self, vals_list, groups):
+        """Claim the dedup row of every (employee, camera group) about to be
+        logged, in a fixed order to avoid deadlocks.
+
+        The transaction's snapshot is older than this call, so a lock alone
+        would not let it see a log committed meanwhile. Writing the row
+        does: when a concurrent request has written it since our snapshot,
+        PostgreSQL raises a serialization failure and Odoo retries the
+        request, which then finds that request's log.
+        """
+        keys = sorted({self._dedup_key(vals, groups)[:2] for vals in vals_list})
+        self.env['face.attendance.dedup.lock']._claim(keys)
+
+    @api.model
+    def _find_repeats(self, vals_list, window, groups):
+        """What each new log repeats: an existing log, the index of an earlier
+        item of vals_list, or None for a new passage. A repeat has the same
+        employee, camera group and direction within `window` seconds.
+
+        Entry/exit events only repeat the employee's closest earlier event
+        at that camera group, so entry, exit, entry again within the window
+        stays three passages.
+        """
+        now = fields.Datetime.now()
+        times = [vals.get('detection_time') or now for vals in vals_list]
+        delta = timedelta(seconds=window)
+        seen = {}       # (employee, group) -> [(time, direction, log record or index)]
+        for log in self.search([
+            ('employee_id', 'in', list({vals['employee_id'] for vals in vals_list})),
+            ('detection_time', '>=', min(times) - delta),
+            ('detection_time', '<=', max(times) + delta),
+        ], order='detection_time'):
+            employee_id, group, direction = self._dedup_key({
+                'employee_id': log.employee_id.id,
+                'camera_name': log.camera_name,
+                'direction': log.direction,
+            }, groups)
+            seen.setdefault((employee_id, group), []).append((log.detection_time, direction, log))
+
+        repeats = []
+        for index, (vals, when) in enumerate(zip(vals_list, times)):
+            employee_id, group, direction = self._dedup_key(vals, groups)
+            logged = seen.setdefault((employee_id, group), [])
+            if direction:
+                candidates = [self._previous_passage(logged, when)]
+            else:
+                candidates = [item for item in logged if not item[1]]
+            first = next((origin for logged_at, logged_direction, origin in candidates
+                          if logged_direction == direction
+                          and abs((when - logged_at).total_seconds()) < window), None)
+            if first is None:
+                logged.append((when, direction, index))
+            repeats.append(first)
+        return repeats
+
+    @api.model
+    def _previous_passage(self, logged, when):
+        """The entry/exit event closest before `when` (or, for a detection
+        uploaded late, the first one after it); (None, None, None) if none."""
+        passages = [item for item in logged if item[1]]
+        earlier = [item for item in passages if item[0] <= when]
+        if earlier:
+            return max(earlier, key=lambda item: item[0])
+        return min(passages, key=lambda item: item[0], default=(None, None, None))
+
+    @api.model
+    def _merged_fields(self, vals):
+        return {name: vals[name] for name in ('confidence', 'snapshot') if name in vals}
+
+    @api.model
+    def _merge_repeat(self, log, vals):
+        """Keep the better sighting on the first log of a passage."""
+        if vals.get('confidence', 0.0) > log.confidence:
+            log.write(self._merged_fields(vals))
+
+    def _create_one_by_one(self, pending):
+        created = {}
+        for index, vals in pending.items():
+            key = vals.get('event_key')
+            try:
+                with self.env.cr.savepoint():
+                    created[index] = self.create(vals).id
+            except psycopg2.IntegrityError:
+                existing = self.search([('event_key', '=', key)], limit=1) if key else self.browse()
+                if existing:
+                    created[index] = {'success': True, 'id': existing.id, 'duplicate': True}
+                else:
+                    created[index] = {'success': False, 'error': 'Could not log detection'}
+            except Exception as e:
+                created[index] = {'success': False, 'error': str(e)}
+        return created
+
+
+class FaceAttendanceDedupLock(models.Model):
+    _name = 'face.attendance.dedup.lock'
+    _description = 'Door Detection Dedup Lock'
+    _log_access = False
+
+    employee_id = fields.Many2one(
+        'hr.employee',
+        string='Employee',
+        required=True,
+        ondelete='cascade',
+    )
+    camera_group = fields.Char(string='Camera Group', required=True)
+    claimed_at = fields.Datetime(string='Last Claimed')
+
+    _employee_group_unique = models.Constraint(
+        'UNIQUE(employee_id, camera_group)',
+        'One dedup lock per employee and camera group.',
+    )
+
+    @api.model
+    def _claim(self, keys):
+        """Upsert the row of each (employee_id, camera group) in `keys`."""
+        for employee_id, group in keys:
+            self.env.cr.execute(
+                'INSERT INTO face_attendance_dedup_lock (employee_id, camera_group, claimed_at) '
+                "VALUES (%s, %s, now() at time zone 'UTC') "
+                'ON CONFLICT (employee_id, camera_group) DO UPDATE SET claimed_at = EXCLUDED.claimed_at',
+                (employee_id, group),
+            )
+
 
 class DoorMismatchReport(models.TransientModel):
     _name = 'face.door.mismatch.report'
@@ -114,29 +443,36 @@ class DoorMismatchReport(models.TransientModel):
             time_before = det.detection_time - timedelta(minutes=30)
             time_after = det.detection_time + timedelta(minutes=30)
 
-            # Check for any attendance check_out near this time
-            checkout = Attendance.search([
+            # An exit must match a check_out, an entry a check_in; a detection
+            # without direction matches either
+            checkout = det.direction != 'entry' and Attendance.search([
                 ('employee_id', '=', det.employee_id.id),
                 ('check_out', '>=', time_before),
                 ('check_out', '<=', time_after),
             ], limit=1)
 
-            # Check for any attendance check_in near this time
-            checkin = Attendance.search([
+            checkin = det.direction != 'exit' and Attendance.search([
                 ('employee_id', '=', det.employee_id.id),
                 ('check_in', '>=', time_before),
                 ('check_in', '<=', time_after),
             ], limit=1)
 
             if not checkout and not checkin:
-                # Mismatch! Detected at door but no app check-in or check-out
+                # Mismatch! Detected at door but no matching app check-in or check-out
+                if det.direction == 'entry':
+                    remark = 'Entered at door without app check-in'
+                elif det.direction == 'exit':
+                    remark = 'Left at door without app check-out'
+                else:
+                    remark = 'Detected at door without app check-in/check-out'
                 mismatch_lines.append({
                     'employee_id': det.employee_id.id,
                     'detection_time': det.detection_time,
+                    'direction': det.direction,
                     'confidence': det.confidence,
                     'camera_name': det.camera_name,
                     'snapshot': det.snapshot,
-                    'remark': 'Detected at door without app check-in/check-out',
+                    'remark': remark,
                 })
 
         # Create mismatch lines
@@ -162,6 +498,7 @@ class DoorMismatchLine(models.TransientModel):
     employee_id = fields.Many2one('hr.employee', string='Employee', readonly=True)
     employee_name = fields.Char(related='employee_id.name', string='Employee Name', store=True)
     detection_time = fields.Datetime(string='Detected At Door', readonly=True)
+    direction = fields.Selection([('entry', 'Entry'), ('exit', 'Exit')], string='Direction', readonly=True)
     confidence = fields.Float(string='Confidence (%)', readonly=True)
     camera_name = fields.Char(string='Camera', readonly=True)
     snapshot = fields.Binary(string='Snapshot', readonly=True)
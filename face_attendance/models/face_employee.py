@@ -1,11 +1,73 @@
 import base64
+import binascii
 import json
 import logging
+import struct
+from datetime import timedelta
 
 from odoo import models, fields, api
 
 _logger = logging.getLogger(__name__)
 
+FACE_ENCODING_SIZE = 128
+# Most templates (registration samples) kept per employee
+MAX_FACE_TEMPLATES = 8
+# Most photos handed out per backfill page (photos are large)
+MAX_BACKFILL_PAGE = 200
+# Packed form: 128 little-endian float32 = 512 bytes per template, stored
+# base64 (684 chars for one template)
+_PACKED_FORMAT = '<%df' % FACE_ENCODING_SIZE
+_PACKED_BYTES = struct.calcsize(_PACKED_FORMAT)
+# write_date is when a transaction started, not when it committed: a row
+# can become visible after a cursor later than its write_date was handed
+# out. Deltas look back this far, and the camera's upsert absorbs repeats.
+SYNC_CURSOR_OVERLAP = timedelta(minutes=5)
+
+
+def pack_face_encoding(value):
+    """Normalise face templates to the packed float32 base64 form.
+
+    Accepts the packed form itself (one or more templates back to back),
+    JSON text or a list holding either one encoding of 128 floats or a list
+    of such encodings. Raises ValueError for anything else.
+    """
+    if isinstance(value, str):
+        text = value.strip()
+        if not text.startswith('['):
+            try:
+                raw = base64.b64decode(text, validate=True)
+            except (binascii.Error, ValueError):
+                raise ValueError('Face encoding is neither JSON nor packed base64')
+            if not raw or len(raw) % _PACKED_BYTES:
+                raise ValueError('Packed face encoding must be a multiple of %d bytes' % _PACKED_BYTES)
+            if len(raw) // _PACKED_BYTES > MAX_FACE_TEMPLATES:
+                raise ValueError('At most %d face templates are allowed' % MAX_FACE_TEMPLATES)
+            return text
+        value = json.loads(text)
+    if not isinstance(value, (list, tuple)) or not value:
+        raise ValueError('Face encoding must be a list of values')
+    templates = value if isinstance(value[0], (list, tuple)) else [value]
+    if len(templates) > MAX_FACE_TEMPLATES:
+        raise ValueError('At most %d face templates are allowed' % MAX_FACE_TEMPLATES)
+    packed = []
+    for template in templates:
+        if not isinstance(template, (list, tuple)) or len(template) != FACE_ENCODING_SIZE:
+            raise ValueError('Face encoding must have %d values' % FACE_ENCODING_SIZE)
+        packed.append(struct.pack(_PACKED_FORMAT, *[float(v) for v in template]))
+    return base64.b64encode(b''.join(packed)).decode('ascii')
+
+
+def unpack_face_encoding(packed):
+    """Packed face encoding -> list of templates (lists of 128 floats)."""
+    raw = base64.b64decode(packed)
+    return [list(struct.unpack_from(_PACKED_FORMAT, raw, offset))
+            for offset in range(0, len(raw), _PACKED_BYTES)]
+
+
+def face_template_count(packed):
+    """Number of templates in a packed face encoding (without decoding it)."""
+    return len(base64.b64decode(packed)) // _PACKED_BYTES if packed else 0
+
 
 class HrEmployee(models.Model):
     _inherit = 'hr.employee'
@@ -16,7 +78,13 @@ class HrEmployee(models.Model):
     )
     face_encoding = fields.Text(
         string='Face Encoding',
-        help='Auto-generated face encoding data (JSON). Do not edit manually.',
+        help='Auto-generated face templates (128 packed float32 values each, base64). '
+             'Do not edit manually.',
+    )
+    face_template_count = fields.Integer(
+        string='Face Templates',
+        compute='_compute_face_template_count',
+        help='Number of face samples kept for matching this employee.',
     )
     face_registered = fields.Boolean(
         string='Face Registered',
@@ -24,6 +92,26 @@ class HrEmployee(models.Model):
         store=True,
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('face_encoding'):
+                vals['face_encoding'] = pack_face_encoding(vals['face_encoding'])
+        return super().create(vals_list)
+
+    def write(self, vals):
+        if vals.get('face_encoding'):
+            vals = dict(vals, face_encoding=pack_face_encoding(vals['face_encoding']))
+        return super().write(vals)
+
+    @api.depends('face_encoding')
+    def _compute_face_template_count(self):
+        for rec in self:
+            try:
+                rec.face_template_count = face_template_count(rec.face_encoding)
+            except ValueError:
+                rec.face_template_count = 0
+
     @api.depends('face_encoding')
     def _compute_face_registered(self):
         for rec in self:
@@ -31,12 +119,153 @@ class HrEmployee(models.Model):
 
     def action_compute_face_encoding(self):
         """Compute face encoding from the uploaded face image.
-        This is called from the camera script via API, not from the Odoo UI,
-        because face_recognition library is not installed on the Odoo server.
+        This is done by camera_script/face_backfill.py via API, not from the
+        Odoo UI, because face_recognition library is not installed on the
+        Odoo server.
         """
         for rec in self:
             if not rec.face_image:
                 rec.face_encoding = False
                 continue
-            # Encoding is computed by the camera script and sent via API
-            _logger.info('Face encoding for employee %s should be computed by camera script.', rec.name)
+            # Encoding is computed by the backfill tool and sent via API
+            _logger.info('Face encoding for employee %s should be computed by face_backfill.py.', rec.name)
+
+    @api.model
+    def get_face_backfill_page(self, after_id=0, limit=50):
+        """Employees with a face photo but no encoding, for the backfill tool.
+
+        Paged by id: pass the last id of the previous page as `after_id`, so
+        photos that failed to encode do not shift later pages. Returns the
+        page ({'id', 'name', 'image'}) and how many are left from `after_id`
+        on.
+        """
+        domain = [('face_image', '!=', False), ('face_encoding', '=', False)]
+        Employee = self.sudo()
+        remaining = Employee.search_count(domain + [('id', '>', after_id or 0)])
+        page = Employee.search(domain + [('id', '>', after_id or 0)], order='id',
+                               limit=max(1, min(int(limit or 50), MAX_BACKFILL_PAGE)))
+        employees = []
+        for emp in page:
+            image = emp.face_image
+            employees.append({
+                'id': emp.id,
+                'name': emp.name,
+                'image': image.decode('ascii') if isinstance(image, bytes) else image,
+            })
+        return {'employees': employees, 'remaining': remaining}
+
+    @api.model
+    def register_face_encodings(self, registrations):
+        """Store the face encodings of many employees in one transaction.
+
+        Each item is {'employee_id', 'encoding'} with the encoding in any form
+        pack_face_encoding accepts. Returns one result per item, in order:
+        {'employee_id', 'success'} plus 'error' for failures.
+        """
+        ids = [item.get('employee_id') for item in registrations if isinstance(item, dict)]
+        existing = set(self.sudo().browse([i for i in ids if isinstance(i, int)]).exists().ids)
+        results = []
+        for item in registrations:
+            if not isinstance(item, dict):
+                results.append({'employee_id': None, 'success': False, 'error': 'registration must be an object'})
+                continue
+            employee_id = item.get('employee_id')
+            if employee_id not in existing:
+                results.append({'employee_id': employee_id, 'success': False, 'error': 'Employee not found'})
+                continue
+            try:
+                packed = pack_face_encoding(item.get('encoding'))
+                with self.env.cr.savepoint():
+                    self.sudo().browse(employee_id).write({'face_encoding': packed})
+            except (TypeError, ValueError) as e:
+                results.append({'employee_id': employee_id, 'success': False, 'error': str(e)})
+                continue
+            results.append({'employee_id': employee_id, 'success': True})
+        return results
+
+    @api.model
+    def _face_gallery_entry(self, employee):
+        return {
+            'id': employee.id,
+            'name': employee.name,
+            'encoding': employee.face_encoding,
+        }
+
+    @api.model
+    def _face_gallery_blob(self, employees):
+        """Several employees as parallel id/name/count lists plus one blob
+        of concatenated packed templates (512 bytes each, base64); `counts`
+        tells how many templates belong to each employee.
+
+        Employees whose stored encoding cannot be packed are listed under
+        `invalid` instead.
+        """
+        ids, names, counts, chunks, invalid = [], [], [], [], []
+        for emp in employees:
+            try:
+                raw = base64.b64decode(pack_face_encoding(emp.face_encoding))
+            except ValueError:
+                _logger.warning('Employee %s has an invalid face encoding.', emp.id)
+                invalid.append(emp.id)
+                continue
+            chunks.append(raw)
+            ids.append(emp.id)
+            names.append(emp.name)
+            counts.append(len(raw) // _PACKED_BYTES)
+        return {
+            'ids': ids,
+            'names': names,
+            'counts': counts,
+            'blob': base64.b64encode(b''.join(chunks)).decode('ascii'),
+            'invalid': invalid,
+        }
+
+    @api.model
+    def get_face_gallery_changes(self, since=None, etag=None, blob=False):
+        """Face encodings for the camera script, full or as a delta.
+
+        `since` is the cursor returned by a previous call: only employees
+        written since then are returned, split into changed entries and
+        removed ids (face cleared, employee archived). `etag` identifies
+        the gallery state the caller already has; if nothing changed, only
+        {'not_modified': True} is returned. Deleted employees cannot be
+        reported, so the response carries the total `count` and callers
+        resync fully when their gallery size disagrees. Deltas overlap the
+        previous one by SYNC_CURSOR_OVERLAP, and while the newest write is
+        that recent a matching etag is not trusted either, so rows of slow
+        transactions committed after the cursor are still picked up.
+
+        With `blob` the changed encodings come as one contiguous blob
+        (see _face_gallery_blob) instead of a list of entries.
+        """
+        Employee = self.sudo().with_context(active_test=False)
+        last = Employee.search([], order='write_date desc, id desc', limit=1)
+        count = self.sudo().search_count([('face_encoding', '!=', False)])
+        cursor = fields.Datetime.to_string(last.write_date) if last else False
+        current_etag = '%s-%s' % (count, cursor or '')
+
+        settled = not last or last.write_date < fields.Datetime.now() - SYNC_CURSOR_OVERLAP
+        if etag and etag == current_etag and settled:
+            return {'not_modified': True, 'etag': current_etag, 'cursor': since or cursor}
+
+        if since:
+            since = fields.Datetime.to_datetime(since) - SYNC_CURSOR_OVERLAP
+            changed = Employee.search([('write_date', '>=', since)])
+            present = changed.filtered(lambda emp: emp.active and emp.face_encoding)
+            removed = (changed - present).ids
+        else:
+            present = self.sudo().search([('face_encoding', '!=', False)])
+            removed = []
+
+        result = {
+            'full': not since,
+            'removed': removed,
+            'cursor': cursor,
+            'etag': current_etag,
+            'count': count,
+        }
+        if blob:
+            result.update(self._face_gallery_blob(present))
+        else:
+            result['employees'] = [self._face_gallery_entry(emp) for emp in present]
+        return result
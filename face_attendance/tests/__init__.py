@@ -0,0 +1 @@
+from . import test_face_attendance_log
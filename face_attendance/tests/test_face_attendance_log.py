@@ -0,0 +1,199 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+SNAPSHOT = base64.b64encode(b'snapshot').decode()
+
+
+@tagged('post_install', '-at_install')
+class TestCameraDedup(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Log = cls.env['face.attendance.log']
+        cls.alice = cls.env['hr.employee'].create({'name': 'Alice'})
+        cls.bob = cls.env['hr.employee'].create({'name': 'Bob'})
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('face_attendance.dedup_window', '300')
+        params.set_param('face_attendance.camera_groups', json.dumps({
+            'Main Door': 'main',
+            'Main Door (inside)': 'main',
+        }))
+        cls.start = datetime(2026, 10, 1, 8, 0, 0)
+
+    def at(self, seconds):
+        return fields.Datetime.to_string(self.start + timedelta(seconds=seconds))
+
+    def log(self, employee, seconds, **kwargs):
+        return self.Log.create_from_camera(employee.id, detection_time=self.at(seconds), **kwargs)
+
+    def logs(self, employee):
+        return self.Log.search([('employee_id', '=', employee.id)])
+
+    def test_repeat_within_window_is_merged(self):
+        first = self.log(self.alice, 0, confidence=60.0)
+        repeat = self.log(self.alice, 120, confidence=80.0, snapshot_base64=SNAPSHOT)
+        self.assertNotIn('repeat', first)
+        self.assertEqual(repeat['id'], first['id'])
+        self.assertTrue(repeat['repeat'])
+        log = self.logs(self.alice)
+        self.assertEqual(len(log), 1)
+        self.assertEqual(log.detection_time, self.start)
+        self.assertEqual(log.confidence, 80.0)
+        self.assertTrue(log.snapshot)
+
+    def test_lower_confidence_repeat_keeps_first_sighting(self):
+        self.log(self.alice, 0, confidence=90.0)
+        self.log(self.alice, 30, confidence=70.0, snapshot_base64=SNAPSHOT)
+        log = self.logs(self.alice)
+        self.assertEqual(log.confidence, 90.0)
+        self.assertFalse(log.snapshot)
+
+    def test_outside_window_is_logged_again(self):
+        first = self.log(self.alice, 0)
+        later = self.log(self.alice, 301)
+        self.assertNotEqual(later['id'], first['id'])
+        self.assertEqual(len(self.logs(self.alice)), 2)
+
+    def test_out_of_order_detection_is_a_repeat(self):
+        # Spooled uploads can arrive after a later detection was logged
+        later = self.log(self.alice, 200)
+        earlier = self.log(self.alice, 10)
+        self.assertEqual(earlier['id'], later['id'])
+
+    def test_camera_group(self):
+        first = self.log(self.alice, 0, camera_name='Main Door')
+        same_door = self.log(self.alice, 10, camera_name='Main Door (inside)')
+        other_door = self.log(self.alice, 20, camera_name='Back Door')
+        self.assertEqual(same_door['id'], first['id'])
+        self.assertNotEqual(other_door['id'], first['id'])
+
+    def test_direction(self):
+        entry = self.log(self.alice, 0, direction='entry')
+        same_entry = self.log(self.alice, 30, direction='entry')
+        exit_ = self.log(self.alice, 60, direction='exit')
+        self.assertEqual(same_entry['id'], entry['id'])
+        self.assertNotEqual(exit_['id'], entry['id'])
+        self.assertEqual(len(self.logs(self.alice)), 2)
+
+    def test_reentry_within_window_is_a_new_passage(self):
+        entry = self.log(self.alice, 0, direction='entry')
+        self.log(self.alice, 60, direction='exit')
+        reentry = self.log(self.alice, 90, direction='entry')
+        self.assertNotEqual(reentry['id'], entry['id'])
+        self.assertEqual(len(self.logs(self.alice)), 3)
+
+    def test_late_upload_repeats_the_passage_it_belongs_to(self):
+        entry = self.log(self.alice, 0, direction='entry')
+        exit_ = self.log(self.alice, 60, direction='exit')
+        self.assertEqual(self.log(self.alice, 30, direction='entry')['id'], entry['id'])
+        self.assertEqual(self.log(self.alice, 70, direction='exit')['id'], exit_['id'])
+
+    def test_other_employee_is_not_merged(self):
+        alice = self.log(self.alice, 0)
+        bob = self.log(self.bob, 0)
+        self.assertNotEqual(alice['id'], bob['id'])
+
+    def test_zero_window_logs_every_detection(self):
+        self.env['ir.config_parameter'].sudo().set_param('face_attendance.dedup_window', '0')
+        self.log(self.alice, 0)
+        self.log(self.alice, 1)
+        self.assertEqual(len(self.logs(self.alice)), 2)
+
+    def test_logging_claims_the_dedup_lock(self):
+        self.log(self.alice, 0, camera_name='Main Door (inside)')
+        lock = self.env['face.attendance.dedup.lock'].search([('employee_id', '=', self.alice.id)])
+        self.assertEqual(lock.camera_group, 'main')
+
+    def test_batch_repeats_within_the_batch(self):
+        results = self.Log.create_batch_from_camera([
+            {'employee_id': self.alice.id, 'detection_time': self.at(0), 'confidence': 60.0, 'key': 'a'},
+            {'employee_id': self.alice.id, 'detection_time': self.at(30), 'confidence': 75.0, 'key': 'b',
+             'snapshot_base64': SNAPSHOT},
+            {'employee_id': self.alice.id, 'detection_time': self.at(400), 'key': 'c'},
+            {'employee_id': self.bob.id, 'detection_time': self.at(30), 'key': 'd'},
+        ])
+        self.assertTrue(all(r['success'] for r in results))
+        self.assertEqual([r['key'] for r in results], ['a', 'b', 'c', 'd'])
+        self.assertEqual(results[1]['id'], results[0]['id'])
+        self.assertTrue(results[1]['repeat'])
+        self.assertNotEqual(results[2]['id'], results[0]['id'])
+        self.assertEqual(len(self.logs(self.alice)), 2)
+        first = self.Log.browse(results[0]['id'])
+        self.assertEqual(first.confidence, 75.0)
+        self.assertTrue(first.snapshot)
+
+    def test_batch_repeats_an_existing_log(self):
+        first = self.log(self.alice, 0, direction='exit')
+        results = self.Log.create_batch_from_camera([
+            {'employee_id': self.alice.id, 'detection_time': self.at(100), 'direction': 'exit', 'key': 'x'},
+            {'employee_id': self.alice.id, 'detection_time': self.at(100), 'direction': 'entry', 'key': 'y'},
+        ])
+        self.assertEqual(results[0]['id'], first['id'])
+        self.assertTrue(results[0]['duplicate'])
+        self.assertNotEqual(results[1]['id'], first['id'])
+        self.assertNotIn('repeat', results[1])
+
+
+@tagged('post_install', '-at_install')
+class TestCameraBatchIdempotency(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Log = cls.env['face.attendance.log']
+        cls.alice = cls.env['hr.employee'].create({'name': 'Alice'})
+        # Only idempotency keys decide about duplicates here
+        cls.env['ir.config_parameter'].sudo().set_param('face_attendance.dedup_window', '0')
+
+    def detection(self, key, **kwargs):
+        return {'employee_id': self.alice.id, 'confidence': 90.0, 'key': key, **kwargs}
+
+    def count(self):
+        return self.Log.search_count([('employee_id', '=', self.alice.id)])
+
+    def test_batch_logs_every_detection_in_order(self):
+        results = self.Log.create_batch_from_camera([self.detection('k1'), self.detection('k2')])
+        self.assertEqual([r['key'] for r in results], ['k1', 'k2'])
+        self.assertTrue(all(r['success'] and not r.get('duplicate') for r in results))
+        self.assertEqual(self.Log.browse(results[0]['id']).event_key, 'k1')
+        self.assertEqual(self.count(), 2)
+
+    def test_retried_batch_is_not_logged_twice(self):
+        batch = [self.detection('k1'), self.detection('k2')]
+        first = self.Log.create_batch_from_camera(batch)
+        retry = self.Log.create_batch_from_camera(batch)
+        self.assertEqual([r['id'] for r in retry], [r['id'] for r in first])
+        self.assertTrue(all(r['duplicate'] for r in retry))
+        self.assertEqual(self.count(), 2)
+
+    def test_same_key_twice_in_one_batch(self):
+        results = self.Log.create_batch_from_camera([self.detection('k1'), self.detection('k1')])
+        self.assertEqual(results[1]['id'], results[0]['id'])
+        self.assertTrue(results[1]['duplicate'])
+        self.assertEqual(self.count(), 1)
+
+    def test_single_log_with_a_batch_key(self):
+        batch = self.Log.create_batch_from_camera([self.detection('k1')])
+        single = self.Log.create_from_camera(self.alice.id, event_key='k1')
+        self.assertEqual(single['id'], batch[0]['id'])
+        self.assertTrue(single['duplicate'])
+
+    def test_detections_without_key_are_all_logged(self):
+        self.Log.create_batch_from_camera([self.detection(None), self.detection(None)])
+        self.assertEqual(self.count(), 2)
+
+    def test_invalid_items_fail_alone(self):
+        results = self.Log.create_batch_from_camera([
+            'not a detection',
+            self.detection('k1', employee_id=0),
+            self.detection('k2', direction='sideways'),
+            self.detection('k3'),
+        ])
+        self.assertEqual([r['success'] for r in results], [False, False, False, True])
+        self.assertEqual(results[1]['error'], 'Employee not found')
+        self.assertEqual(self.count(), 1)